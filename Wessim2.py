@@ -7,19 +7,20 @@ import cPickle
 import numpy
 from time import time, localtime, strftime
 import argparse
-from multiprocessing import Process
 import os
 import math
 
-inds={'A':0,'T':1,'G':2,'C':3,'N':4,'a':0,'t':1,'g':2,'c':3,'n':4}
+import compile_model
+import live_metrics
+import run_report
+import stream_writer
+import worker_pool
+import __sub_wessim2 as sub_wessim2
 
-def subprogram(command, name):
-	os.system(command)
-	print "exiting subprocess " + str(name)
+inds={'A':0,'T':1,'G':2,'C':3,'N':4,'a':0,'t':1,'g':2,'c':3,'n':4}
 
 def main(argv):
 	t0 = time()
-	arguline = " ".join(argv)
 	parser = argparse.ArgumentParser(description='Wessim2: Whole Exome Sequencing SIMulator 2 (Probe-based version)', prog='Wessim2', formatter_class=argparse.RawTextHelpFormatter)
 	group1 = parser.add_argument_group('Mandatory input files')
 	group1.add_argument('-R', metavar = 'FILE', dest='reference', required=True, help='faidx-indexed (R)eference genome FASTA file or meta description file (.meta)')
@@ -39,14 +40,31 @@ def main(argv):
 	group3.add_argument('-l', metavar = 'INT', type=int, dest='readlength', required=True, help='read (l)ength (bp)')
 	group3.add_argument('-M', metavar = 'FILE', dest='model', required=True, help='GemSim (M)odel file (.gzip)')
 	group3.add_argument('-t', metavar = 'INT', type=int, dest='threadnumber', required=False, help='number of (t)hreaded subprocesses [1]', default=1) 
+	group3.add_argument('--seed', metavar = 'INT', type=int, dest='seed', required=False, help='seed of the random number generators. Reads are then reproducible and do not depend on -t [random]')
+	group3.add_argument('--shard', metavar = 'i/N', dest='shard', required=False, help='generate only shard i of N of the reads, e.g. one array job per shard. Use the same --seed for all shards and join their outputs with concat_shards.py [1/1]')
 
 	group4 = parser.add_argument_group('Output options')
-	group4.add_argument('-o', metavar = 'FILE', dest='outfile', help='(o)utput file header. ".fastq.gz" or ".fastq" will be attached automatically. Output will be splitted into two files in paired-end mode', required=True)
-	group4.add_argument('-z', action='store_true', help='compress output with g(z)ip [false]')
+	group4.add_argument('-o', metavar = 'FILE', dest='outfile', help='(o)utput file header. ".fastq.gz" or ".fastq" will be attached automatically. Output will be splitted into two files in paired-end mode. "-" or an existing named pipe streams the reads there', required=True)
+	group4.add_argument('-z', action='store_true', help='compress output with BGZF, a blocked g(z)ip format [false]')
+	group4.add_argument('--interleaved', action='store_true', help='write both reads of a pair into one interleaved output [false]')
+	group4.add_argument('--compress-level', metavar = 'INT', type=int, dest='compress_level', required=False, help='compression level of the BGZF output with -z [6]', default=6)
+	group4.add_argument('--compress-threads', metavar = 'INT', type=int, dest='compress_threads', required=False, help='compression threads per subprocess with -z, independent of -t [1]', default=1)
 	group4.add_argument('-q', metavar = 'INT', type=int, dest='qualbase', required=False, help='(q)uality score offset [33]', default=33)
 	group4.add_argument('-v', action='store_true', help='(v)erbose; print out intermediate messages.')
+	group4.add_argument('--report', metavar = 'FILE', dest='report', required=False, help='write a JSON report of the time spent in each stage, counts of reads and rejections and peak memory to FILE, and the report of each subprocess to FILE.worker<t>.json')
+	group4.add_argument('--profile-every', metavar = 'INT', type=int, dest='profile_every', required=False, help='with --report, run every INT-th chunk of reads of a subprocess under cProfile and save the statistics to FILE.worker<t>.prof [0: off]', default=0)
+	group4.add_argument('--metrics-port', metavar = 'PORT', type=int, dest='metrics_port', required=False, help='serve the progress of the run (reads/sec, ETA, reads and rejections of each subprocess) as Prometheus metrics on http://127.0.0.1:PORT/metrics')
+	group4.add_argument('--status-file', metavar = 'FILE', dest='status_file', required=False, help='write the progress of the run as JSON to FILE every --status-interval seconds')
+	group4.add_argument('--status-interval', metavar = 'SECS', type=float, dest='status_interval', required=False, help='seconds between two writes of --status-file [10]', default=10.0)
+	group4.add_argument('--model-cache-dir', metavar = 'DIR', dest='model_cache_dir', required=False, help='directory holding compiled error models [$WESSIM_CACHE or ~/.cache/wessim]')
 
 	args = parser.parse_args()
+	shard, shards = 1, 1
+	if args.shard is not None:
+		try:
+			shard, shards = stream_writer.parseShard(args.shard)
+		except ValueError as e:
+			parser.error("--shard: " + str(e))
 	reffile = args.reference
 	probefile = args.probe
 	alignfile = args.probeblat
@@ -60,6 +78,7 @@ def main(argv):
 	readlength = args.readlength
 	readnumber = args.readnumber		
 	threadnumber = args.threadnumber
+	readstart, readend = stream_writer.shardRange(readnumber, shard, shards)
 	if imin==None:
 		if paired:
 			imin = readlength + 20
@@ -71,6 +90,9 @@ def main(argv):
 	model = args.model
 		
 	outfile = args.outfile
+	if outfile == "-":
+		# The reads go to stdout, so print all the messages to stderr.
+		sys.stdout = sys.stderr
 	compress = args.z
 	qualbase = args.qualbase
 	verbose = args.v
@@ -88,81 +110,59 @@ def main(argv):
 	print "Gzip compress?", compress
 	print "Quality base:", qualbase
 	print "Thread number:", threadnumber
+	print "Shard:", str(shard) + "/" + str(shards), "(reads", readstart, "to", str(readend) + ")"
 	print "Job started at:", strftime("%Y-%m-%d %H:%M:%S", localtime())
 	print "-------------------------------------------"
 	print
 
-	processes = []
+	report = run_report.current()
+	if args.report is not None:
+		report = run_report.start("main")
+
+	t1 = time()
+	compiled_model = compile_model.compile_model(model, paired, readlength, args.model_cache_dir)
+	report.add("model_load", time() - t1)
+	print "Compiled model:", compiled_model
+
+	# Load the probe matches, the model and the GC calibration once. The
+	# workers are forked from this process and share them copy-on-write.
+	args.compiled_model = compiled_model
+	shared = sub_wessim2.loadShared(args)
+
+	# Reads are generated in chunks, handed out to the workers as they ask
+	# for them. The workers hand the chunks back here, where they are written
+	# in read order straight into the final files.
+	chunks = stream_writer.planChunks(readend, readstart=readstart)
+	scheduler = stream_writer.ChunkScheduler(chunks, threadnumber)
+	jobs = []
 	for t in range(0, threadnumber):
-		readstart = int(float(readnumber) / float(threadnumber) * t) + 1
-		readend = int(float(readnumber) / float(threadnumber) * (t+1))
-		command = "python __sub_wessim2.py " + arguline + " -1 " + str(readstart) + " -2 " + str(readend) + " -i " + str(t+1)
-		p = Process(target=subprogram, args=(command, t+1))
-		p.start()
-		processes.append(p)
-	for p in processes:
-		p.join()
+		jobs.append((sub_wessim2.generateReads, args, shared, t+1))
+
+	writer = stream_writer.openWriter(outfile, paired, compress, args.interleaved)
+	consume = writer
+	if report.enabled:
+		def consume(chunk):
+			with report.stage("merge"):
+				writer(chunk)
+	monitor = None
+	if args.metrics_port is not None or args.status_file is not None:
+		# Started before the workers are forked, so that they inherit its queue.
+		monitor = live_metrics.Monitor(chunks, threadnumber, args.metrics_port, args.status_file, args.status_interval)
+		monitor.start()
+		consume = monitor.consumer(consume)
+	try:
+		worker_pool.runWorkers(stream_writer.streamChunks, jobs, scheduler=scheduler, consume=consume)
+	except worker_pool.WorkerError as e:
+		print >> sys.stderr, str(e)
+		sys.exit(1)
+	writer.close()
+	if monitor is not None:
+		monitor.close()
+	if report.enabled:
+		run_report.writeRunReport(args.report, report, threadnumber)
+		print "Run report:", args.report
 	t1 = time()
-	print "Done generating " + str(readnumber) + " reads in %f secs" % (t1 - t0)
-	print "Merging subresults..."
-	wread = None
-	wread2 = None
-	if paired and compress:
-		wread = gzip.open(outfile + "_1.fastq.gz", 'wb')
-		wread2 = gzip.open(outfile + "_2.fastq.gz", 'wb')
-	elif paired and not compress:
-		wread = open(outfile + "_1.fastq", 'w')
-		wread2 = open(outfile + "_2.fastq", 'w')
-	elif not paired and compress:
-		wread = gzip.open(outfile + ".fastq.gz", 'wb')
-	else:
-		wread = open(outfile + ".fastq", 'w')
-	if not paired:
-		for t in range(0, threadnumber):
-			suboutfile = outfile + "-" + str(t+1)
-			fread = None
-			if compress:
-				suboutfile += ".fastq.gz"
-				fread = gzip.open(suboutfile, 'rb')
-			else:
-				suboutfile += ".fastq"
-				fread = open(suboutfile, 'r')
-			line = fread.readline()
-			while line:
-				wread.write(line)
-				line = fread.readline()
-			fread.close()
-			os.remove(suboutfile)
-		wread.close()
-	else:
-		for t in range(0, threadnumber):
-			suboutfile1 = outfile + "-" + str(t+1) + "_1"
-			suboutfile2 = outfile + "-" + str(t+1) + "_2"
-			fread1 = None
-			fread2 = None
-			if compress:
-				suboutfile1 += ".fastq.gz"
-				suboutfile2 += ".fastq.gz"
-				fread1 = gzip.open(suboutfile1, "rb")
-				fread2 = gzip.open(suboutfile2, "rb")
-			else:
-				suboutfile1 += ".fastq"
-				suboutfile2 += ".fastq"
-				fread1 = open(suboutfile1, "r")
-				fread2 = open(suboutfile2, "r")
-			line1 = fread1.readline()
-			line2 = fread2.readline()
-			while line1 and line2:
-				wread.write(line1)
-				wread2.write(line2)
-				line1 = fread1.readline()
-				line2 = fread2.readline()
-			fread1.close()
-			fread2.close()
-			os.remove(suboutfile1)
-			os.remove(suboutfile2)
-		wread.close()
-		wread2.close()
+	print "Done generating " + str(max(readend - readstart + 1, 0)) + " reads in %f secs" % (t1 - t0)
 	sys.exit(0)
 	
 	
@@ -12,8 +12,34 @@ import os
 import csv
 import pandas as pd
 
+import batch_errors
+import bgzf
+import compile_model
+import fastq_records
+import fragment_planner
+import gc_bias
+import gc_index
+import merge_outputs
+import random_streams
+import run_report
+import samplers
+import target_store
+
 inds={'A':0,'T':1,'G':2,'C':3,'N':4,'a':0,'t':1,'g':2,'c':3,'n':4}
 
+# Translation table of `comp`. Anything that is not a base becomes N.
+_COMPLEMENT = ['N'] * 256
+for _b, _c in zip('ATCGatcgNn', 'TAGCtagcNn'):
+	_COMPLEMENT[ord(_b)] = _c
+_COMPLEMENT = ''.join(_COMPLEMENT)
+
+# Number of fragments sampled for the GC calibration (`gcVector`).
+GC_SAMPLES = 10000
+
+# Plans of fragments in a row that may be rejected entirely by the GC-bias
+# filter before a worker gives up.
+MAX_EMPTY_PLANS = 100
+
 def main(argv):
 	t0 = time()
 	parser = argparse.ArgumentParser(description='sub-wessim: a sub-program for Wessim1. (NOTE!) Do not run this program. Use "Wessim1.py" instead. ', prog='wessim1_sub', formatter_class=argparse.RawTextHelpFormatter)
@@ -21,13 +47,15 @@ def main(argv):
 	group1 = parser.add_argument_group('Mandatory input files')
 	group1.add_argument(
 		"--target-fasta-file",
-		help = "The target FASTA file generated from get_region_vector.py",
-		required = True
+		help = "The target FASTA file generated from get_region_vector.py"
 	)
 	group1.add_argument(
 		"--target-abd-file",
-		help = "The target abd file generated from get_region_vector.py",
-		required = True
+		help = "The target abd file generated from get_region_vector.py"
+	)
+	group1.add_argument(
+		"--target-store",
+		help = "The target store generated by get_region_vector.py, used instead of the target FASTA and abd files"
 	)
 
 	group2 = parser.add_argument_group('Parameters for exome capture')
@@ -45,302 +73,401 @@ def main(argv):
 	group3.add_argument('-i', metavar = 'INT', type=int, dest='processid', required=True, help='subprocess (i)d')
 	group3.add_argument('-M', metavar = 'FILE', dest='model', required=True, help='GemSim (M)odel file (.gzip)')
 	group3.add_argument('-t', help='do not care')
+	group3.add_argument('--compiled-model', metavar = 'DIR', dest='compiled_model', required=False, help='compiled model bundle (given by main process)')
+	group3.add_argument('--model-cache-dir', metavar = 'DIR', dest='model_cache_dir', required=False, help='directory holding compiled models')
 
 	group4 = parser.add_argument_group('Output options')
 	group4.add_argument('-o', metavar = 'FILE', dest='outfile', help='(o)utput file header. ".fastq.gz" or ".fastq" will be attached automatically. Output will be splitted into two files in paired-end mode', required=True)
-	group4.add_argument('-z', action='store_true', help='compress output with g(z)ip [false]')
+	group4.add_argument('-z', action='store_true', help='compress output with BGZF, a blocked g(z)ip format [false]')
+	group4.add_argument('--compress-level', metavar = 'INT', type=int, dest='compress_level', required=False, help='compression level of the BGZF output with -z [6]', default=6)
+	group4.add_argument('--compress-threads', metavar = 'INT', type=int, dest='compress_threads', required=False, help='compression threads per subprocess with -z, independent of -t [1]', default=1)
 	group4.add_argument('-q', metavar = 'INT', type=int, dest='qualbase', required=False, help='(q)uality score offset [33]', default=33)
 	group4.add_argument('-v', action='store_true', help='(v)erbose; print out intermediate messages.')
+	group4.add_argument('--seed', metavar = 'INT', type=int, dest='seed', required=False, help='seed of the random number generators (given by main process) [random]')
 	group4.add_argument('--read-name-prefix', dest='read_name_prefix', default = '_from_', required=False, help='Prefix to add to simulated read names (default: "%(default)s")')
 	group4.add_argument(
 		'--use-rce', action='store_true',
 		help='Use the target RCE values for generating reads'
 	)
 
-	args = parser.parse_args()
-	faoutfile = args.target_fasta_file
+	args = parser.parse_args(argv)
+	if args.target_store is None and (args.target_fasta_file is None or args.target_abd_file is None):
+		parser.error("either --target-store or both --target-fasta-file and --target-abd-file are required")
 
-	isize = args.fragsize
-	isd = args.fragsd
-	imin = args.fragmin
-	bind = args.bind
-	subid = args.processid
+	imin = getMinFragment(args)
+	if args.fragsize < imin:
+		print "too small mean fragment size (" + str(args.fragsize) + ") compared to minimum length (" + str(imin) + "). Increase it and try again."
+		sys.exit(0)
 
-	paired = args.paired_reads
-	readlength = args.readlength
-	readstart = args.readstart
-	readend = args.readend
+	# The error model is compiled once into a memory-mapped bundle (see
+	# compile_model.py). Normally the main process has already done this.
+	if args.compiled_model is None:
+		args.compiled_model = compile_model.compile_model(args.model, args.paired_reads, args.readlength, args.model_cache_dir)
 
-	read_name_prefix = args.read_name_prefix
+	shared = loadShared(args)
+	print("Generating reads")
+	generateReads(args, shared, args.readstart, args.readend, args.processid)
 
-	if imin==None:
-		if paired:
-			imin = readlength + 20
-		else:
-			imin = readlength + 20
-	if isize < imin:
-		print "too small mean fragment size (" + str(isize) + ") compared to minimum length (" + str(imin) + "). Increase it and try again."
-		sys.exit(0)
-	model = args.model
-
-	f = open(faoutfile)
-	i = f.readline()
-	seqlist = []
-	while i:
-		header = i.strip()[1:]
-		seq = f.readline().strip()
-		seqlist.append((header, seq))
+
+def getMinFragment(args):
+	"""Minimum fragment length, defaulting to read length + 20."""
+	if args.fragmin is None:
+		return args.readlength + 20
+	return args.fragmin
+
+
+def loadShared(args):
+	"""
+	Load everything the read generation needs but does not modify.
+
+	Wessim1.py calls this once before forking its workers, which then share
+	the result copy-on-write.
+
+	Args:
+		args: Parsed arguments of Wessim1.py or of this program. The compiled
+			model bundle must be in `args.compiled_model`.
+
+	Returns:
+		A dict of the targets, the error model and the GC calibration.
+	"""
+	report = run_report.current()
+	t0 = time()
+	if args.target_store is not None:
+		# The store is memory-mapped and read lazily, so this takes the same
+		# time whatever the size of the targets.
+		store = target_store.load_store(args.target_store)
+		seqlist = store
+		targetTags = store.tags
+		target_reference_df = pd.DataFrame({
+			"total_len": store.targets["cumlen"],
+			"rce": store.targets["rce"],
+		}, columns=["total_len", "rce"])
+	else:
+		f = open(args.target_fasta_file)
 		i = f.readline()
-	f.close()
+		seqlist = []
+		while i:
+			header = i.strip()[1:]
+			seq = f.readline().strip()
+			seqlist.append((header, seq))
+			i = f.readline()
+		f.close()
+
+		# "<chrom>_" and start of every target, parsed once from the FASTA
+		# headers for the read names.
+		targetTags = []
+		for header, seq in seqlist:
+			headervalues = header.split("_")
+			targetTags.append((headervalues[0] + "_", int(headervalues[1])))
 
-	#
-	# Load --target-abd-file.
-	#
-	target_reference_df = \
-		pd.read_csv(
-			args.target_abd_file, sep="\t",
-			header=None, names=["total_len", "rce"]
-		)
+		#
+		# Load --target-abd-file.
+		#
+		target_reference_df = \
+			pd.read_csv(
+				args.target_abd_file, sep="\t",
+				header=None, names=["total_len", "rce"]
+			)
 
 	target_reference_df["pos"] = numpy.arange(len(target_reference_df))
 
-	# Convert RCE into probability so that it can be used in
-	# `numpy.random.choices()`
+	# Convert RCE into probability of sampling the target region
 	target_reference_df["rce_prob"] = \
 		target_reference_df["rce"] / target_reference_df["rce"].sum()
 
-	abdlist = target_reference_df["total_len"].tolist()
+	if args.target_store is not None:
+		abdlist = store.targets["cumlen"]
+	else:
+		abdlist = target_reference_df["total_len"].tolist()
+
+	last = int(abdlist[-1])
+	t1 = time()
+	report.add("target_load", t1 - t0)
+
+	modelArrays, modelIndex = compile_model.load_model(args.compiled_model)
+	errModel = batch_errors.BatchErrorModel(modelArrays, args.qualbase)
+	t2 = time()
+	report.add("model_load", t2 - t1)
+
+	# The GC calibration and the read templates are read straight from the
+	# targets, only the bases that are needed.
+	if args.target_store is not None:
+		targetLengths = numpy.diff(store.offsets)
+		def fetch(i, start, end):
+			# Like slicing a string, the end is clipped to the target.
+			o = store.offsets[i]
+			return store.sequences[o + start:min(o + end, store.offsets[i + 1])].tostring()
+	else:
+		targetLengths = numpy.array([len(seq) for header, seq in seqlist], dtype=numpy.int64)
+		def fetch(i, start, end):
+			return seqlist[i][1][start:end]
+
+	# Only the targets that can hold a fragment of the minimum length are
+	# sampled, each with its weight among them, so that no draw is wasted
+	# on a target that is too short.
+	imin = getMinFragment(args)
+	eligible, eligibleAbd = fragment_planner.eligibleTargets(abdlist, targetLengths, imin)
+	if len(eligible) == 0:
+		sys.exit("None of the " + str(len(targetLengths)) + " targets is at least " + str(imin) + " bp long, the minimum fragment length (-m). Use a smaller -m or longer targets.")
+	print "Targets that can hold a fragment of " + str(imin) + " bp:", len(eligible), "of", len(targetLengths), "(%.1f%% of the target length)" % (100.0 * eligibleAbd[-1] / last)
+	report.count("targets_ineligible", len(targetLengths) - len(eligible))
+
+	# Alias table of the eligible target regions weighted by RCE, built
+	# once and shared by all subprocesses.
+	rceSampler = None
+	if args.use_rce:
+		rceProb = target_reference_df["rce_prob"].values[eligible]
+		if not rceProb.sum() > 0:
+			sys.exit("None of the targets that are at least " + str(imin) + " bp long has an RCE above 0.")
+		rceSampler = samplers.AliasSampler(rceProb / rceProb.sum())
+
+	mvnTable = readmvnTable()
+	if not (targetLengths >= args.fragsize).any():
+		sys.exit("None of the targets is at least " + str(args.fragsize) + " bp long, the mean fragment length (-f), so the GC bias cannot be calibrated.")
+	random_streams.seedStreams(args.seed, random_streams.CALIBRATION_KEY)
+	gcVector = getFragmentUniform(abdlist, fetch, targetLengths, last, args.fragsize, GC_SAMPLES, None)
+	report.add("gc_calibration", time() - t2)
+#	print gcVector
+#	u1, u2, newSD, m1, m2 = generateMatrices(isd, isize, gcVector)
+
+	return {
+		"seqlist": seqlist,
+		"targetTags": targetTags,
+		"target_reference_df": target_reference_df,
+		"abdlist": abdlist,
+		"last": last,
+		"rceSampler": rceSampler,
+		"eligible": eligible,
+		"eligibleAbd": eligibleAbd,
+		"errModel": errModel,
+		"unAlign": modelIndex.get("un_align"),
+		"targetLengths": targetLengths,
+		"fetchTarget": fetch,
+		"mvnTable": mvnTable,
+		"gcVector": gcVector,
+		"gcSD": numpy.std(gcVector),
+	}
+
+
+def generateReads(args, shared, readstart, readend, subid, wread=None, wread2=None):
+	"""
+	Generate reads `readstart`..`readend` into the output files of `subid`.
 
-	last = abdlist[-1]
+	Args:
+		args: Parsed arguments of Wessim1.py or of this program.
+		shared: Dict returned by `loadShared`.
+		readstart: Number of the first read.
+		readend: Number of the last read.
+		subid: Worker id, appended to the output file names.
+		wread: File object to write the (first) reads to instead of the
+			output files of `subid`. It is left open.
+		wread2: File object for the second reads of pairs, with `wread`.
+	"""
+	isize = args.fragsize
+	isd = args.fragsd
+	imin = getMinFragment(args)
+
+	paired = args.paired_reads
+	readlength = args.readlength
+
+	read_name_prefix = args.read_name_prefix
+
+	targetTags = shared["targetTags"]
+	target_reference_df = shared["target_reference_df"]
 
-	outfile = args.outfile + "-" + str(subid)
 	compress = args.z
 	qualbase = args.qualbase
 	verbose = args.v
 
-	wread = None
-	wread2 = None
-	if paired and compress:
-		wread = gzip.open(outfile + "_1.fastq.gz", 'wb')
-		wread2 = gzip.open(outfile + "_2.fastq.gz", 'wb')
-	elif paired and not compress:
-		wread = open(outfile + "_1.fastq", 'w')
-		wread2 = open(outfile + "_2.fastq", 'w')
-	elif not paired and compress:
-		wread = gzip.open(outfile + ".fastq.gz", 'wb')
-	else:
-		wread = open(outfile + ".fastq", 'w')
-	processed = 0
-	totalseq = 1
-	first = True
+	ownfiles = wread is None
+	if ownfiles:
+		outnames = merge_outputs.outputNames(args.outfile, paired, compress, subid)
+		wread = bgzf.openOutput(outnames[0], compress, args.compress_level, args.compress_threads)
+		if paired:
+			wread2 = bgzf.openOutput(outnames[1], compress, args.compress_level, args.compress_threads)
 	dirtag = ('','+','-')
-	### Ignore first 5 lines of psl file (header)
+	records = fastq_records.RecordBuffer(wread, wread2)
 
+	errModel = shared["errModel"]
 	if paired:
-		mx1,mx2,insD1,insD2,delD1,delD2,intervals,gQualL,bQualL,iQualL,mates,rds,rdLenD = parseModel(model, paired, readlength)
-		m0=float(mates[0])
-		m1=float(mates[1])
-		rd0=float(rds[0])
-		rd1=float(rds[1])
-		unAlign0=(m0*rd1-m1*m0)/(rd0*rd1-m1*m0)
-		unAlign1=1.0-(unAlign0/(m0/rd0))
-		keys=intervals.keys()
-		keys.sort()
-		if isize=='emp':
-			inters=[]
-			for k in keys:
-				inters.append((k,intervals[k]))
-			interval=bisect_choiceTUP(inters)
-		#inserts1and2
-		insDict1=mkInserts(mx1,insD1)
-		insDict2=mkInserts(mx2,insD2)
-		#deletions1and2
-		delDict1=mkDels(mx1,delD1)
-		delDict2=mkDels(mx2,delD2)
-	else:
-		mx1,insD1,delD1,gQualL,bQualL,iQualL,readCount,rdLenD=parseModel(model, paired, readlength)
-		insDict=mkInserts(mx1,insD1)
-		#deletions
-		delDict=mkDels(mx1,delD1)
+		unAlign0, unAlign1 = shared["unAlign"]
 	gens=genRef('')
-	gQList=[]
-	for i in (gQualL):
-		gL=[]
-		keys=i.keys()
-		keys.sort()
-		for k in keys:
-			gL.append((chr(k+qualbase),i[k]))
-		gQList.append(bisect_choiceTUP(gL))
-	#choose bad quality bases
-	bQList=[]
-	for i in (bQualL):
-		bL=[]
-		keys=i.keys()
-		keys.sort()
-		for k in keys:
-			bL.append((chr(k+qualbase),i[k]))
-		bQList.append(bisect_choiceTUP(bL))
-	#choose qualities for inserts
-	iQList=[]
-	for i in (iQualL):
-		iL=[]
-		keys=i.keys()
-		keys.sort()
-		for k in keys:
-			iL.append((chr(k+qualbase),i[k]))
-		iQList.append(bisect_choiceTUP(iL))
-	#choose read length
-	if readlength=='d':
-		rdlog.info('Using empirical read length distribution')
-		lgth=[]
-		keys=rdLenD.keys()
-		keys.sort()
-		for k in keys:
-			lgth.append((k,rdLenD[k]))
-		RL=bisect_choiceTUP(lgth)
-	else:
-		RL=ln(readlength)
+	RL=ln(readlength)
 
-	mvnTable = readmvnTable()
-	gcVector = getFragmentUniform(abdlist, seqlist, last, isize, 1000, bind)
-#	print gcVector
-#	u1, u2, newSD, m1, m2 = generateMatrices(isd, isize, gcVector)
-	gcSD = numpy.std(gcVector)
+	mvnTable = shared["mvnTable"]
+	gcSD = shared["gcSD"]
 	newSD = isd * 2
 
+	# Forked workers inherit the state of the random number generators.
+	# Reseed them so that workers do not produce the same reads. With --seed
+	# the reads of a chunk depend only on the seed and its first read id.
+	random_streams.seedStreams(args.seed, readstart)
+
 	#
 	# Start generating reads
 	#
-	print("Generating reads")
-
-	# Determine number of reads to generate
-	num_reads = readend - readstart + 1
-
+	report = run_report.current()
+	targetLengths = shared["targetLengths"]
+	fetchTarget = shared["fetchTarget"]
+	eligible = shared["eligible"]
+	eligibleAbd = shared["eligibleAbd"]
 	if args.use_rce:
-		# Sample from the list of target regions proportional to the
-		# relative capture efficiency of the target region.
-		# `numpy.random.choice` is vectorized and thus we sample all the
-		# regions first.
-		#
-		# Approximately 10% of sampled fragments will fail. So we over-estimate
-		# the number of sampled target regions we need. We sample more below if
-		# needed.
-		sampled_target_region_inds = \
-			get_sampled_target_region_inds(
-				target_reference_df["pos"].tolist(),
-				target_reference_df["rce_prob"].tolist(),
-				int(num_reads * 1.2)
-			)
+		rceChunks = shared["rceSampler"].chunks(fragment_planner.PLAN_SIZE)
+	insertSizes = fragment_planner.InsertSizeTable(isize, isd, imin)
+	plan = []
+	planned = 0
+	emptyPlans = 0
 
 	count = 0
 	i = readstart
 	while i < readend + 1:
 
-		if args.use_rce:
-			# If we have run out of target regions to sample, we re-populate
-			# the list again.
-			if len(sampled_target_region_inds) == 0:
-				sampled_target_region_inds = \
-					get_sampled_target_region_inds(
-						target_reference_df["pos"].tolist(),
-						target_reference_df["rce_prob"].tolist(),
-						int(num_reads * 1.2)
-					)
-			target_region_ind = sampled_target_region_inds.pop()
-		else:
-			# Sample a random position from the entire genome. The closest
-			# target region will be identified using the `getIndex` function.
-			# Doing so means that larger target regions will be sampled more
-			# since it contains more positions. However, if the target regions
-			# are all nearly the same size, you shouldn't see a difference in
-			# the number of times a region is sampled.
-			pos = int(random.uniform(1, last))
-			target_region_ind = getIndex(abdlist, pos)
-
-		seq = seqlist[target_region_ind]
-		ref = seq[1]
-		refLen = len(ref)
-		header = seq[0]
-		headervalues = header.split("_")
-		fragment_chrom = headervalues[0]
-		fragment_start = int(headervalues[1])
-		fragment_end = int(headervalues[2])
-
-		if refLen < imin:
-			continue
-
-		# If using RCE, GC bias should already be captured. As such, we do not
-		# need to filter fragments out based on this.
-		if not args.use_rce:
-			# This seems to be a bug as the gccount == 0. If you change to
-			# `getGCCount(ref)`, you get gccount actually given sensible
-			# results. But if you use this code, then nearly all reads are
-			# rejected because keep == False from the `H2` function. For now,
-			# keep it as what it was in the original __sub_wessim1.py.
-			gccount = getGCCount(seq)
-			keep = H2(refLen, gccount, isize, newSD, isd, gcSD, mvnTable)
-			if not keep:
-				continue
+		# Collect a batch of error-free templates first. Sequencing errors are
+		# then added to the whole batch at once by `mkErrorsBatch`.
+		batch = []
+		t1 = time()
+		planning = 0.0
+		while len(batch) < min(batch_errors.BATCH_SIZE, readend + 1 - i):
+
+			# Targets, positions, strands and insert sizes are drawn for a
+			# whole chunk of fragments at once.
+			if planned == len(plan):
+				t2 = time()
+				if args.use_rce:
+					# Sample from the list of target regions proportional to
+					# the relative capture efficiency of the target region.
+					targets = eligible[next(rceChunks)]
+				else:
+					# Sample a random position from the entire genome. The
+					# closest target region to the right is picked, so larger
+					# target regions will be sampled more since they contain
+					# more positions.
+					targets = eligible[fragment_planner.drawTargets(
+						eligibleAbd, eligibleAbd[-1], fragment_planner.PLAN_SIZE)]
+				plan = fragment_planner.planFragments(
+					targets, targetLengths, readlength, paired, insertSizes)
+				report.count("rejected_insert", len(targets) - len(plan))
+				refLens = targetLengths[plan["target"]]
+				keep = numpy.ones(len(plan), dtype=bool)
+				t3 = time()
+				report.add("fragment_sampling", t3 - t2)
+				# If using RCE, GC bias should already be captured. As such, we
+				# do not need to filter fragments out based on this.
+				if not args.use_rce:
+					# This seems to be a bug as the gccount == 0. If you change
+					# to the GC count of the target, you get gccount actually
+					# given sensible results. But then nearly all reads are
+					# rejected because keep == False from the `H2` function. For
+					# now, keep it as what it was in the original
+					# __sub_wessim1.py (`getGCCount` of the (header, seq) tuple).
+					gccounts = numpy.zeros(len(plan), dtype=numpy.int64)
+					keep &= gc_bias.H2Batch(
+						refLens, gccounts, isize, newSD, isd, gcSD, mvnTable,
+						numpy.random.random_sample(len(plan)))
+					report.count("rejected_h2", len(plan) - int(keep.sum()))
+				plan = plan[keep].tolist()
+				planned = 0
+				report.add("h2", time() - t3)
+				planning += time() - t2
+				if not plan:
+					emptyPlans += 1
+					if emptyPlans == MAX_EMPTY_PLANS:
+						sys.exit("None of the last " + str(MAX_EMPTY_PLANS * fragment_planner.PLAN_SIZE) + " fragments was kept. They were rejected by the GC-bias filter or no insert size (-f, -d) fit into their target.")
+					continue
+				emptyPlans = 0
+			target_region_ind, frag_start, frag_len, frag_dir, frag_order, val = plan[planned]
+			planned += 1
+
+			# Only the template window is read from the target, which can be
+			# as large as a chromosome.
+			refLen = int(targetLengths[target_region_ind])
+			chrom_tag, fragment_start = targetTags[target_region_ind]
+
+			if not paired:
+				readLen=RL()
+				ref = fetchTarget(target_region_ind, frag_start, frag_start + readLen + 10)
+				read1,pos,dir=readGen1(ref,refLen,readLen,gens(),readLen,0,frag_dir,offset=frag_start)
+				batch.append((chrom_tag, fragment_start, read1, readLen, pos, dir))
+			else:
+				ln1 = RL()
+				ln2 = RL()
+
+				# Generate paired-end templates
+				ref = fetchTarget(target_region_ind, frag_start, frag_start + frag_len)
+				read1, pos1, dir1, len1, read2, pos2, dir2, len2 = \
+					readGenp2(ref, refLen, ln1, ln2, isize, isd, imin, frag_len, 0, frag_order, offset=frag_start)
+				batch.append((
+					chrom_tag, fragment_start, val, ln1, ln2,
+					read1, len1, pos1, dir1, read2, len2, pos2, dir2
+				))
+
+		t2 = time()
+		report.add("templates", t2 - t1 - planning)
 
 		if not paired:
-			readLen=RL()
-			read1,pos,dir,quals1=readGen1(ref,refLen,readLen,gens(),readLen,mx1,insDict,delDict,gQList,bQList,iQList,qualbase)
-			if read1==None or quals1==None:
-				continue
-			head1='@'+'r'+str(i) + read_name_prefix + fragment_chrom + "_" + str(fragment_start + pos + 1) + "_" + dirtag[dir]
+			templates, lengths = batch_errors.encodeReads([b[2] for b in batch])
+			bases, quals, outLen, ok = \
+				batch_errors.mkErrorsBatch(templates, lengths, [b[3] for b in batch], errModel)
 		else:
-			val = random.random()
-			ln1 = RL()
-			ln2 = RL()
-
-			# Generate paired-end reads
-			read1, pos1, dir1, quals1, read2, pos2, dir2, quals2 = \
-				readGenp2(
-					ref, refLen, ln1, ln2,
-					isize, isd, imin,
-					mx1, insDict1, delDict1, gQList, bQList, iQList, qualbase
-				)
-
-			if read1 == None or quals1 == None:
-				print("read1 failed")
-				continue
-			if read2 == None or quals2 == None:
-				print("read2 failed")
-				continue
-
-			p1 = fragment_chrom + "_" + str(fragment_start + pos1 + 1) + "_" + dirtag[dir1]
-			p2 = fragment_chrom + "_" + str(fragment_start + pos2 + 1) + "_" + dirtag[dir2]
-			if val > unAlign0+unAlign1:
-				pass
-			elif val > unAlign1:
-				read2='N'*ln2
-				quals2=chr(0+qualbase)*ln2
-				p2 = '*'
+			templates, lengths = batch_errors.encodeReads(
+				[b[5] for b in batch] + [b[9] for b in batch])
+			bases, quals, outLen, ok = batch_errors.mkErrorsBatch(
+				templates, lengths,
+				[b[6] for b in batch] + [b[10] for b in batch], errModel)
+		t3 = time()
+		report.add("mk_errors", t3 - t2)
+		written = count
+
+		for k in range(len(batch)):
+			if not paired:
+				if not ok[k]:
+					print "unexpected stop"
+					report.count("failed_errors")
+					continue
+				chrom_tag, fragment_start, _, readLen, pos, dir = batch[k]
+				read1 = bases[k, :outLen[k]].tostring()
+				quals1 = quals[k, :outLen[k]].tostring()
+				records.add("@r%d%s%s%d_%s" % (i, read_name_prefix, chrom_tag, fragment_start + pos + 1, dirtag[dir]), read1, quals1)
 			else:
-				read1='N'*ln1
-				quals1=chr(0+qualbase)*ln1
-				p1='*'
-			head1='@'+'r'+str(i)+read_name_prefix+ p1 + ":" + p2 + "/1"
-			head2='@'+'r'+str(i)+read_name_prefix+ p1 + ":" + p2 + "/2"
-
-		wread.write(head1 + '\n')
-		wread.write(read1.upper()+'\n')
-		wread.write('+\n')
-		wread.write(quals1+'\n')
+				chrom_tag, fragment_start, val, ln1, ln2, _, _, pos1, dir1, _, _, pos2, dir2 = batch[k]
+				k2 = k + len(batch)
+				if not ok[k]:
+					print("read1 failed")
+					report.count("failed_errors")
+					continue
+				if not ok[k2]:
+					print("read2 failed")
+					report.count("failed_errors")
+					continue
+				read1 = bases[k, :outLen[k]].tostring()
+				quals1 = quals[k, :outLen[k]].tostring()
+				read2 = bases[k2, :outLen[k2]].tostring()
+				quals2 = quals[k2, :outLen[k2]].tostring()
+
+				p1 = "%s%d_%s" % (chrom_tag, fragment_start + pos1 + 1, dirtag[dir1])
+				p2 = "%s%d_%s" % (chrom_tag, fragment_start + pos2 + 1, dirtag[dir2])
+				if val > unAlign0+unAlign1:
+					pass
+				elif val > unAlign1:
+					read2='N'*ln2
+					quals2=chr(0+qualbase)*ln2
+					p2 = '*'
+				else:
+					read1='N'*ln1
+					quals1=chr(0+qualbase)*ln1
+					p1='*'
+				name = "@r%d%s%s:%s" % (i, read_name_prefix, p1, p2)
+				records.addPair(name + "/1", read1, quals1, name + "/2", read2, quals2)
+			count+=1
+			i+=1
+		records.flush()
+		report.add("serialization", time() - t3)
+		report.count("reads", count - written)
+
+	if ownfiles:
+		wread.close()
 		if paired:
-			wread2.write(head2 + "\n")
-			wread2.write(read2.upper() + "\n")
-			wread2.write("+\n")
-			wread2.write(quals2 + "\n")
-		count+=1
-		i+=1
-		if count % 1000000 == 0 and count!=1:
-			t1 = time()
-			print "[subprocess " + str(subid) + "]: " + str(count) + " reads have been generated... in %f secs" % (t1-t0)
-
-	wread.close()
-	if paired:
-		wread2.close()
+			wread2.close()
 
 
 def pickonekey(matchkeys):
@@ -363,28 +490,30 @@ def getFragment(matchdic, key, mu, sigma, lower, bind):
 	pickedfragment = pickFragment(pickedproberegion, ins, bind)
 	return pickedfragment
 
-def getFragmentUniform(abdlist, seqlist, last, mu, total, bind):
+def getFragmentUniform(abdlist, fetch, targetLengths, last, mu, total, bind):
 	"""
+	Sample the GC counts of fragments drawn uniformly from the target space.
+
 	Parameters:
-		seqlist: List of sequences
+		abdlist: Cumulative lengths of the targets
+		fetch: Function (target, start, end) -> sequence of the fragment
+		targetLengths: Lengths of the targets
 		mu: Fragment size
-		total: Total number of target regions to sample
+		total: Number of fragments to sample
 	"""
+	abd = numpy.asarray(abdlist)
 	result = []
-	i = 0
-	while i < 1000:
-		pos = int(random.uniform(1, last))
-		ind = getIndex(abdlist, pos)
-		seq = seqlist[ind][1]
-		seqlen = len(seq)
-		if seqlen < mu:
-			continue
-		margin = seqlen - mu
-		start = random.randint(0, margin)
-		seq = seq[start: start+mu]
-		gcCount = getGCCount(seq)
-		result.append(gcCount)
-		i+=1
+	while len(result) < total:
+		n = total - len(result)
+		pos = numpy.random.uniform(1, last, n).astype(numpy.int64)
+		ind = numpy.searchsorted(abd, pos, side="right")
+		seqlen = targetLengths[ind]
+		keep = seqlen >= mu
+		ind = ind[keep]
+		margin = seqlen[keep] - mu
+		start = (numpy.random.random_sample(len(ind)) * (margin + 1)).astype(numpy.int64)
+		for t, s in zip(ind, start):
+			result.append(gc_index.countGC(fetch(t, s, s + mu)))
 	return result
 
 def getInsertLength(mu, sigma, lower):
@@ -462,7 +591,7 @@ def readSimpleSingle(ref, rlen, err):
 	rc = False
 	read = template[startloc:startloc + rlen]
 	if x > 1: # negative strand
-		read = comp(read)[::-1]
+		read = revcomp(read)
 		rc = True
 	qual = rlen * 'h'
 	rctag = "+"
@@ -472,14 +601,11 @@ def readSimpleSingle(ref, rlen, err):
 
 def comp(sequence):
 	""" complements a sequence, preserving case. Function imported from GemSim"""
-	d={'A':'T','T':'A','C':'G','G':'C','a':'t','t':'a','c':'g','g':'c','N':'N','n':'n'}
-	cSeq=''
-	for s in sequence:
-		if s in d.keys():
-			cSeq+=d[s]
-		else:
-			cSeq+='N'
-	return cSeq
+	return sequence.translate(_COMPLEMENT)
+
+def revcomp(sequence):
+	"""Reverse complement of a sequence, preserving case."""
+	return sequence.translate(_COMPLEMENT)[::-1]
 
 def usage():
 	print ">python x3.probestatistics reference.fa probe.fa probealign.psl readoutput.fastq.gz"
@@ -595,29 +721,43 @@ def ln(length):
 		return length
 	return val
 
-def readGen1(ref,refLen,readLen,genos,inter,mx1,insD1,delD1,gQ,bQ,iQ,qual):
-	"""Generates a random read of desired length from a reference."""
+def readGen1(ref,refLen,readLen,genos,inter,ind=None,dir=None,offset=0):
+	"""
+	Picks a random read template of desired length from a reference.
+
+	The template carries `extrabase` more bases than the read so that
+	deletions added by `mkErrors`/`mkErrorsBatch` can pull in the next bases.
+	The start `ind` and strand `dir` are drawn here unless they are given,
+	e.g. by `fragment_planner.planFragments`. `ref` can also be the bases of
+	the reference from `offset` on, with `ind` given relative to them; the
+	returned start is relative to the whole reference.
+	"""
 	extrabase = 10
 	margin = refLen - inter - 10
-	ind=random.randint(0,(margin-1))
-	dir=random.randint(1,2)
+	if ind is None:
+		ind=random.randint(0,(margin-1))
+	if dir is None:
+		dir=random.randint(1,2)
 	end=ind+inter + extrabase
 	read = ref[ind:end]
 	if dir==2:
-		cRef = comp(ref)[::-1]
-		read = cRef[refLen-end:refLen-ind]
+		# Same bases as comp(ref)[::-1][refLen-end:refLen-ind], without
+		# complementing the whole reference.
+		read = revcomp(read)
 	if genos!='':
 		read=mutate(read,ind,genos,refLen,1,readPlus,hd)
-	read,quals=mkErrors(read,readLen,mx1,insD1,delD1,gQ,bQ,iQ,qual)
 	if dir==2:
 		ind=ind + extrabase
-	return read, ind, dir, quals
+	return read, ind + offset, dir
 
-def readGenp2(ref, refLen, readLen1, readLen2, isize, isd, imin, mx1, insD1, delD1, gQ, bQ, iQ, qual):
+def readGenp2(ref, refLen, readLen1, readLen2, isize, isd, imin, insert_len=None, insert_start=None, pairorder=None, offset=0):
 	"""
 	This is a modified version of readGenp which allows for the random
 	generation of a DNA fragment inside a target region.
 
+	Sequencing errors are not added here. The returned read templates are
+	meant to be passed to `mkErrorsBatch` with the returned read lengths.
+
 	Args:
 		ref: Sequence of the target region.
 		refLen: Length of the target region.
@@ -627,6 +767,11 @@ def readGenp2(ref, refLen, readLen1, readLen2, isize, isd, imin, mx1, insD1, del
 		isd: Standard deviation of the insert size.
 		imin: Minimum value of the insert size. This is to ensure no insert size
 			is smaller than this.
+		insert_len, insert_start, pairorder: Insert size, insert start and
+			pair order planned by `fragment_planner.planFragments`. They are
+			drawn here if they are not given.
+		offset: Position of ref[0] in the target region, if `ref` holds only
+			the bases from there on. `insert_start` is relative to `ref`.
 	"""
 
 	#cRef = comp(ref)[::-1]
@@ -635,18 +780,19 @@ def readGenp2(ref, refLen, readLen1, readLen2, isize, isd, imin, mx1, insD1, del
 	# Determine the highest possible start position of read 1. This is to
 	# ensure that the starting position of the insert is never above this
 	# value.
-	max_start = -1
-	while max_start < 0:
-		insert_len = getInsertLength(isize, isd, imin)
-		max_start = refLen - insert_len + 1
+	if insert_len is None:
+		max_start = -1
+		while max_start < 0:
+			insert_len = getInsertLength(isize, isd, imin)
+			max_start = refLen - insert_len + 1
 
-	# Randomly choose a start position for the first read in the target region.
-	# This position will never be higer than the maxstart. This position will
-	# start site of your insert.
-	insert_start = random.randint(0, max_start)
+		# Randomly choose a start position for the first read in the target
+		# region. This position will never be higer than the maxstart. This
+		# position will start site of your insert.
+		insert_start = random.randint(0, max_start)
 
 	insert = ref[insert_start:(insert_start+insert_len)]
-	comp_insert = comp(insert)[::-1]
+	comp_insert = revcomp(insert)
 
 	# Direction of reads
 	dir1=1
@@ -660,22 +806,20 @@ def readGenp2(ref, refLen, readLen1, readLen2, isize, isd, imin, mx1, insD1, del
 	# Start position of read 1 and 2 with respect to the insert sequence,
 	# respectively
 	ind1 = 0
-	ind2 = insert_start + insert_len - readLen2
+	ind2 = offset + insert_start + insert_len - readLen2
 
 	read1 = insert[0:readLen1]
 	read2 = comp_insert[0:readLen2]
 
-	read1, quals1 = mkErrors(read1, readLen1, mx1, insD1, delD1, gQ, bQ, iQ, qual)
-	read2, quals2 = mkErrors(read2, readLen2, mx1, insD1, delD1, gQ, bQ, iQ, qual)
-	pairorder = random.randint(1,2)
+	if pairorder is None:
+		pairorder = random.randint(1,2)
 	if pairorder==1:
-		return read1, ind1, dir1, quals1, read2, ind2, dir2, quals2
+		return read1, ind1, dir1, readLen1, read2, ind2, dir2, readLen2
 	else:
-		return read2, ind2, dir2, quals2, read1, ind1, dir1, quals1
+		return read2, ind2, dir2, readLen2, read1, ind1, dir1, readLen1
 
 def readGenp(ref, refLen, readLen1, readLen2, genos, mx1, insD1, delD1, gQ, bQ, iQ, qual):
 	"""Generates a pair of reads from given DNA fragment."""
-	cRef = comp(ref)[::-1]
 	extrabase = 10
 	ind1 = 0
 	ind2 = refLen - readLen2
@@ -684,7 +828,8 @@ def readGenp(ref, refLen, readLen1, readLen2, genos, mx1, insD1, delD1, gQ, bQ,
 	dir1=1
 	dir2=2
 	read1 = ref[ind1:end1]
-	read2 = cRef[ind1:end1]
+	# The first end1 bases of comp(ref)[::-1].
+	read2 = revcomp(ref[max(refLen - end1, 0):])
 	read1, quals1 = mkErrors(read1, readLen1, mx1, insD1, delD1, gQ, bQ, iQ, qual)
 	read2, quals2 = mkErrors(read2, readLen2, mx1, insD1, delD1, gQ, bQ, iQ, qual)
 	pairorder = random.randint(1,2)
@@ -822,9 +967,9 @@ def mkErrors(read,readLen,mx,insD,delD,gQ,bQ,iQ,qual):
 					success=True
 					break
 				except:
-					bPos-1
-				if success==False:
-					qualslist.append(chr(2+qual))
+					bPos-=1
+			if success==False:
+				qualslist.append(chr(2+qual))
 		elif val>g:
 			read=read[:pos+3]+'C'+read[pos+4:]
 			bPos=pos-1
@@ -834,9 +979,9 @@ def mkErrors(read,readLen,mx,insD,delD,gQ,bQ,iQ,qual):
 					success=True
 					break
 				except:
-					bPos-1
-				if success==False:
-					qualslist.append(chr(2+qual))
+					bPos-=1
+			if success==False:
+				qualslist.append(chr(2+qual))
 		elif val>t:
 			read=read[:pos+3]+'G'+read[pos+4:]
 			bPos=pos-1
@@ -846,9 +991,9 @@ def mkErrors(read,readLen,mx,insD,delD,gQ,bQ,iQ,qual):
 					success=True
 					break
 				except:
-					bPos-1
-				if success==False:
-					qualslist.append(chr(2+qual))
+					bPos-=1
+			if success==False:
+				qualslist.append(chr(2+qual))
 		elif val>a:
 			read=read[:pos+3]+'T'+read[pos+4:]
 			bPos=pos-1
@@ -858,9 +1003,9 @@ def mkErrors(read,readLen,mx,insD,delD,gQ,bQ,iQ,qual):
 					success=True
 					break
 				except:
-					bPos-1
-				if success==False:
-					qualslist.append(chr(2+qual))
+					bPos-=1
+			if success==False:
+				qualslist.append(chr(2+qual))
 		else:
 			read=read[:pos+3]+'A'+read[pos+4:]
 			bPos=pos-1
@@ -870,9 +1015,9 @@ def mkErrors(read,readLen,mx,insD,delD,gQ,bQ,iQ,qual):
 					success=True
 					break
 				except:
-					bPos-1
-				if success==False:
-					qualslist.append(chr(2+qual))
+					bPos-=1
+			if success==False:
+				qualslist.append(chr(2+qual))
 		if index in delD:
 			delete=delD[index]()
 			read=read[:pos+4]+read[pos+delete+4:]
@@ -883,6 +1028,7 @@ def mkErrors(read,readLen,mx,insD,delD,gQ,bQ,iQ,qual):
 			read=read[:pos+4]+insert+read[pos+4:]
 			for i in insert:
 				iPos=pos-1
+				success=False
 				while iPos>=0:
 					try:
 						qualslist.append(iQ[iPos]())
@@ -890,8 +1036,8 @@ def mkErrors(read,readLen,mx,insD,delD,gQ,bQ,iQ,qual):
 						break
 					except:
 						iPos-=1
-					if success==False:
-						qualslist.append(chr(2+qual))
+				if success==False:
+					qualslist.append(chr(2+qual))
 			pos+=len(insert)
 		pos+=1
 		if (deleted == 'no') or (pos == len(read) - 4):
@@ -982,17 +1128,10 @@ def H(l, n, x, u1, u2, mvnpdf):
 	return toKeep
 
 def readmvnTable():
-	f = open(os.path.dirname(os.path.abspath(__file__)) + "/lib/mvnTable.txt")
-	context = f.read()
-	lines = context.split("\n")
-	mvnTable = []
-	for line in lines:
-		values = line.split("\t")
-		if len(values)<500:
-			continue
-		mvnTable.append(values)
-	f.close()
-	return mvnTable
+	"""
+	The normal pdf table of lib/mvnTable.txt, computed rather than parsed.
+	"""
+	return gc_bias.normalTable()
 
 def getIndex(abdlist, pos):
 	"""
@@ -1002,24 +1141,6 @@ def getIndex(abdlist, pos):
 	i = bisect.bisect_right(abdlist, pos)
 	return i
 
-def get_sampled_target_region_inds(target_ind_list, prob_list, num_to_sample):
-	"""
-	Parameters:
-		target_ind_list: List of target indices to sample
-		prob_list: List of probabilities that indicate how likely it is to
-			sample a target
-		num_to_sample: Number of target regions to sample
-	"""
-	out_list = \
-		numpy.random.choice(
-			target_ind_list,
-			num_to_sample,
-			p=prob_list,
-			replace=True
-		).tolist()
-
-	return out_list
-
 if __name__=="__main__":
 	main(sys.argv[1:])
 	sys.exit(0)
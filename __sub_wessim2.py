@@ -8,9 +8,32 @@ import numpy
 from time import time
 import argparse
 import math
+import os
+
+import batch_errors
+import bgzf
+import compile_model
+import fastq_records
+import gc_bias
+import gc_index
+import merge_outputs
+import random_streams
+import run_report
 
 inds={'A':0,'T':1,'G':2,'C':3,'N':4,'a':0,'t':1,'g':2,'c':3,'n':4}
 
+# Translation table of `comp`. Anything that is not a base becomes N.
+_COMPLEMENT = ['N'] * 256
+for _b, _c in zip('ATCGatcgNn', 'TAGCtagcNn'):
+	_COMPLEMENT[ord(_b)] = _c
+_COMPLEMENT = ''.join(_COMPLEMENT)
+
+# Number of fragments sampled for the GC calibration (`gcVector`).
+GC_SAMPLES = 10000
+
+# Fragments in a row that may be rejected before a worker gives up.
+MAX_EMPTY_DRAWS = 1000000
+
 def main(argv):
 	t0 = time()
 	parser = argparse.ArgumentParser(description='sub-wessim: a sub-program for Wessim2. (NOTE!) Do not run this program. Use "Wessim2.py" instead. ', prog='wessim2-sub', formatter_class=argparse.RawTextHelpFormatter)
@@ -35,52 +58,57 @@ def main(argv):
 	group3.add_argument('-i', metavar = 'INT', type=int, dest='processid', required=True, help='subprocess (i)d')
 	group3.add_argument('-M', metavar = 'FILE', dest='model', required=True, help='GemSim (M)odel file (.gzip)')
 	group3.add_argument('-t', help='do not care')
+	group3.add_argument('--compiled-model', metavar = 'DIR', dest='compiled_model', required=False, help='compiled model bundle (given by main process)')
+	group3.add_argument('--model-cache-dir', metavar = 'DIR', dest='model_cache_dir', required=False, help='directory holding compiled models')
 
 	group4 = parser.add_argument_group('Output options')
 	group4.add_argument('-o', metavar = 'FILE', dest='outfile', help='(o)utput file header. ".fastq.gz" or ".fastq" will be attached automatically. Output will be splitted into two files in paired-end mode', required=True)
-	group4.add_argument('-z', action='store_true', help='compress output with g(z)ip [false]')
+	group4.add_argument('-z', action='store_true', help='compress output with BGZF, a blocked g(z)ip format [false]')
+	group4.add_argument('--compress-level', metavar = 'INT', type=int, dest='compress_level', required=False, help='compression level of the BGZF output with -z [6]', default=6)
+	group4.add_argument('--compress-threads', metavar = 'INT', type=int, dest='compress_threads', required=False, help='compression threads per subprocess with -z, independent of -t [1]', default=1)
 	group4.add_argument('-q', metavar = 'INT', type=int, dest='qualbase', required=False, help='(q)uality score offset [33]', default=33)
 	group4.add_argument('-v', action='store_true', help='(v)erbose; print out intermediate messages.')
+	group4.add_argument('--seed', metavar = 'INT', type=int, dest='seed', required=False, help='seed of the random number generators (given by main process) [random]')
+
+	args = parser.parse_args(argv)
+
+	imin = getMinFragment(args)
+	if args.fragsize < imin:
+		print "too small mean fragment size (" + str(args.fragsize) + ") compared to minimum length (" + str(imin) + "). Increase it and try again."
+		sys.exit(0) 
+
+	# The error model is compiled once into a memory-mapped bundle (see
+	# compile_model.py). Normally the main process has already done this.
+	if args.compiled_model is None:
+		args.compiled_model = compile_model.compile_model(args.model, args.p, args.readlength, args.model_cache_dir)
 
-	args = parser.parse_args()
-	reffile = args.reference
+	shared = loadShared(args)
+	generateReads(args, shared, args.readstart, args.readend, args.processid)
+
+
+def getMinFragment(args):
+	"""Minimum fragment length, defaulting to read length + 20."""
+	if args.fragmin is None:
+		return args.readlength + 20
+	return args.fragmin
+
+
+def openReferences(reffile):
+	"""
+	Open the reference FASTA file, or all the files of a .meta description.
+
+	pysam file handles must not be shared between processes, so every worker
+	opens its own.
+
+	Returns:
+		A tuple (fref, frefs, metap, metamode). In meta mode `frefs` holds all
+		the references, `metap` their cumulative probabilities and `fref` the
+		last one.
+	"""
 	fref = None
 	frefs = []
 	metap = []
 	metamode = False
-	probefile = args.probe
-	alignfile = args.probeblat
-	
-	isize = args.fragsize
-	isd = args.fragsd
-	imin = args.fragmin
-	bind = args.bind
-	weight = args.weight
-	subid = args.processid
-
-	paired = args.p
-	readlength = args.readlength
-	readstart = args.readstart
-	readend = args.readend		
-	if imin==None:
-		if paired:
-			imin = readlength + 20
-		else:
-			imin = readlength + 20
-	if isize < imin:
-		print "too small mean fragment size (" + str(isize) + ") compared to minimum length (" + str(imin) + "). Increase it and try again."
-		sys.exit(0) 
-	model = args.model
-		
-	outfile = args.outfile + "-" + str(subid)
-	compress = args.z
-	qualbase = args.qualbase
-	verbose = args.v
-
-	matchdic = {}
-	countdic = {}
-	f1 = open(probefile)
-	f2 = open(alignfile)
 	if not reffile.endswith(".meta"):
 		fref = pysam.Fastafile(reffile)
 	else:
@@ -98,23 +126,53 @@ def main(argv):
 			metap.append(totalp)
 			metaline = metain.readline()
 		metain.close()
-	wread = None
-	wread2 = None
-	if paired and compress:
-		wread = gzip.open(outfile + "_1.fastq.gz", 'wb')
-		wread2 = gzip.open(outfile + "_2.fastq.gz", 'wb')
-	elif paired and not compress:
-		wread = open(outfile + "_1.fastq", 'w')
-		wread2 = open(outfile + "_2.fastq", 'w')
-	elif not paired and compress:
-		wread = gzip.open(outfile + ".fastq.gz", 'wb')
-	else:
-		wread = open(outfile + ".fastq", 'w')
+	return fref, frefs, metap, metamode
+
+
+# References opened by `workerReferences`, by process id and file name.
+# Entries inherited from the main program are not used by the workers.
+_references = {}
+
+
+def workerReferences(reffile):
+	"""
+	`openReferences` for the chunks generated by this process: the files are
+	opened by the first chunk and stay open until the process exits.
+	"""
+	key = (os.getpid(), reffile)
+	if key not in _references:
+		_references[key] = openReferences(reffile)
+	return _references[key]
+
+
+def loadShared(args):
+	"""
+	Load everything the read generation needs but does not modify.
+
+	Wessim2.py calls this once before forking its workers, which then share
+	the result copy-on-write.
+
+	Args:
+		args: Parsed arguments of Wessim2.py or of this program. The compiled
+			model bundle must be in `args.compiled_model`.
+
+	Returns:
+		A dict of the probe matches, the error model and the GC calibration.
+	"""
+	report = run_report.current()
+	t0 = time()
+	probefile = args.probe
+	alignfile = args.probeblat
+	weight = args.weight
+
+	matchdic = {}
+	countdic = {}
+	f1 = open(probefile)
+	f2 = open(alignfile)
 	line1 = f1.readline()
 	processed = 0
 	totalseq = 1
 	first = True
-	dirtag = ('','+','-')
 	### Ignore first 5 lines of psl file (header)
 	for i in range(0, 6):
 		line2 = f2.readline()
@@ -156,6 +214,8 @@ def main(argv):
 			matchdic[seqid] = [(pslscore, pslchrom, pslstart, pslend)]
 			first = False
 		line2 = f2.readline()
+	f1.close()
+	f2.close()
 	for seqid in matchdic.keys():
 		match = matchdic[seqid]
 		matchno = len(match)
@@ -168,151 +228,247 @@ def main(argv):
 	totalmatched = len(matchdic.keys())
 	countdic[0] = totalseq - totalmatched
 	matchkeys = matchdic.keys()
+	t1 = time()
+	report.add("target_load", t1 - t0)
 
-	if paired:
-		mx1,mx2,insD1,insD2,delD1,delD2,intervals,gQualL,bQualL,iQualL,mates,rds,rdLenD = parseModel(model, paired, readlength)
-		m0=float(mates[0])
-		m1=float(mates[1])
-		rd0=float(rds[0])
-		rd1=float(rds[1])
-		unAlign0=(m0*rd1-m1*m0)/(rd0*rd1-m1*m0)
-		unAlign1=1.0-(unAlign0/(m0/rd0))
-		keys=intervals.keys()
-		keys.sort()
-		if isize=='emp':
-			inters=[]
-			for k in keys:
-				inters.append((k,intervals[k]))
-			interval=bisect_choiceTUP(inters)
-		#inserts1and2
-		insDict1=mkInserts(mx1,insD1)
-		insDict2=mkInserts(mx2,insD2)
-		#deletions1and2
-		delDict1=mkDels(mx1,delD1)
-		delDict2=mkDels(mx2,delD2)
-	else:
-		mx1,insD1,delD1,gQualL,bQualL,iQualL,readCount,rdLenD=parseModel(model, paired, readlength)
-		insDict=mkInserts(mx1,insD1)
-		#deletions
-		delDict=mkDels(mx1,delD1)
-	gens=genRef('')
-	gQList=[]			 
-	for i in (gQualL):
-		gL=[]
-		keys=i.keys()
-		keys.sort()
-		for k in keys:
-			gL.append((chr(k+qualbase),i[k]))
-		gQList.append(bisect_choiceTUP(gL))
-	#choose bad quality bases
-	bQList=[]
-	for i in (bQualL):
-		bL=[]
-		keys=i.keys()
-		keys.sort()
-		for k in keys:
-			bL.append((chr(k+qualbase),i[k]))
-		bQList.append(bisect_choiceTUP(bL))
-	#choose qualities for inserts
-	iQList=[]
-	for i in (iQualL):
-		iL=[] 
-		keys=i.keys()
-		keys.sort()
-		for k in keys:
-			iL.append((chr(k+qualbase),i[k]))
-		iQList.append(bisect_choiceTUP(iL))
-	#choose read length
-	if readlength=='d':
-		rdlog.info('Using empirical read length distribution')
-		lgth=[]
-		keys=rdLenD.keys()
-		keys.sort()
-		for k in keys:
-			lgth.append((k,rdLenD[k]))
-		RL=bisect_choiceTUP(lgth)
-	else:
-		RL=ln(readlength)
+	modelArrays, modelIndex = compile_model.load_model(args.compiled_model)
+	errModel = batch_errors.BatchErrorModel(modelArrays, args.qualbase)
+	t2 = time()
+	report.add("model_load", t2 - t1)
 
 	mvnTable = readmvnTable()
-	
-	gcVector = getFragmentUniform(fref, matchkeys, matchdic, isize, 1000, bind)
+
+	fref, frefs, metap, metamode = openReferences(args.reference)
+	# Fragments lie within one insert length of a probe match. Inserts are
+	# drawn with twice the given standard deviation (see `generateReads`).
+	margin = args.fragsize + 8 * args.fragsd
+	windows = []
+	for match in matchdic.values():
+		for pslscore, pslchrom, pslstart, pslend in match:
+			windows.append((pslchrom, int(pslstart) - margin, int(pslend) + margin))
+	# The index takes a quarter of a byte per base of the merged windows.
+	gcWindows = gc_index.GCWindows(fref.fetch, windows)
+	report.count("gc_window_bytes", gcWindows.nbytes())
+	random_streams.seedStreams(args.seed, random_streams.CALIBRATION_KEY)
+	gcVector = getFragmentUniform(fref, matchkeys, matchdic, args.fragsize, GC_SAMPLES, args.bind, gcWindows)
+	report.add("gc_calibration", time() - t2)
+	for r in set(frefs + [fref]):
+		r.close()
 #	print gcVector
 #	u1, u2, newSD, m1, m2 = generateMatrices(isd, isize, gcVector)
-	gcSD = numpy.std(gcVector)
+
+	return {
+		"matchdic": matchdic,
+		"matchkeys": matchkeys,
+		"errModel": errModel,
+		"unAlign": modelIndex.get("un_align"),
+		"gcWindows": gcWindows,
+		"mvnTable": mvnTable,
+		"gcVector": gcVector,
+		"gcSD": numpy.std(gcVector),
+	}
+
+
+def generateReads(args, shared, readstart, readend, subid, wread=None, wread2=None):
+	"""
+	Generate reads `readstart`..`readend` into the output files of `subid`.
+
+	Args:
+		args: Parsed arguments of Wessim2.py or of this program.
+		shared: Dict returned by `loadShared`.
+		readstart: Number of the first read.
+		readend: Number of the last read.
+		subid: Worker id, appended to the output file names.
+		wread: File object to write the (first) reads to instead of the
+			output files of `subid`. It is left open.
+		wread2: File object for the second reads of pairs, with `wread`.
+	"""
+	isize = args.fragsize
+	isd = args.fragsd
+	imin = getMinFragment(args)
+	bind = args.bind
+
+	paired = args.p
+	readlength = args.readlength
+
+	compress = args.z
+	qualbase = args.qualbase
+	verbose = args.v
+
+	matchdic = shared["matchdic"]
+	matchkeys = shared["matchkeys"]
+	fref, frefs, metap, metamode = workerReferences(args.reference)
+	# In meta mode the sequence comes from one of several genomes, so its GC
+	# is counted from the sequence itself.
+	gcWindows = None if metamode else shared["gcWindows"]
+
+	ownfiles = wread is None
+	if ownfiles:
+		outnames = merge_outputs.outputNames(args.outfile, paired, compress, subid)
+		wread = bgzf.openOutput(outnames[0], compress, args.compress_level, args.compress_threads)
+		if paired:
+			wread2 = bgzf.openOutput(outnames[1], compress, args.compress_level, args.compress_threads)
+	dirtag = ('','+','-')
+	records = fastq_records.RecordBuffer(wread, wread2)
+
+	errModel = shared["errModel"]
+	if paired:
+		unAlign0, unAlign1 = shared["unAlign"]
+	gens=genRef('')
+	RL=ln(readlength)
+
+	mvnTable = shared["mvnTable"]
+	gcSD = shared["gcSD"]
 	newSD = isd*2
+
+	# Forked workers inherit the state of the random number generators.
+	# Reseed them so that workers do not produce the same reads. With --seed
+	# the reads of a chunk depend only on the seed and its first read id.
+	random_streams.seedStreams(args.seed, readstart)
 	
 	### Generate!
+	report = run_report.current()
+	emptyDraws = 0
 	count = 0
 	i = readstart
 	seq = ""
 	seqgenome = "g1"
 	while i < readend+1:
-		key = pickonekey(matchkeys)
-		fragment = getFragment(matchdic, key, isize, newSD, imin, bind)		
-	
-		fragment_chrom = fragment[0]
-		fragment_start = int(fragment[1])
-		fragment_end = int(fragment[2])
-		if fragment_start < 0:
-			continue
-		if metamode == True:
-			seq, seqgenome = getSequenceMeta(frefs, metap, fragment)
-		else:
-			seq = getSequence(fref, fragment)
-		if len(seq)<imin:
-			continue
-		gccount = getGCCount(seq)
-		keep = H2(len(seq), gccount, isize, newSD, isd, gcSD,mvnTable)
-		if not keep:
-			continue		
-		ref = seq
-		refLen=len(ref)
+		# Collect a batch of error-free templates, then add sequencing
+		# errors to all of them at once.
+		batch = []
+		need = min(batch_errors.BATCH_SIZE, readend + 1 - i)
+		while len(batch) < need:
+			# Draw candidate fragments for the rest of the batch, then
+			# decide on all of them at once whether to keep them.
+			t1 = time()
+			drawn = need - len(batch)
+			cands = []
+			for c in range(drawn):
+				key = pickonekey(matchkeys)
+				fragment = getFragment(matchdic, key, isize, newSD, imin, bind)
+
+				fragment_chrom = fragment[0]
+				fragment_start = int(fragment[1])
+				fragment_end = int(fragment[2])
+				if fragment_start < 0:
+					report.count("rejected_outside")
+					continue
+				if metamode == True:
+					seq, seqgenome = getSequenceMeta(frefs, metap, fragment)
+				else:
+					seq = getSequence(fref, fragment)
+				if len(seq)<imin:
+					report.count("rejected_short")
+					continue
+				cands.append((fragment_chrom, fragment_start, seq, seqgenome, fragment_end))
+			# The GC counts of the candidates are looked up per chromosome.
+			gccounts = numpy.zeros(len(cands), dtype=numpy.int64) - 1
+			if gcWindows is not None:
+				bychrom = {}
+				for c, cand in enumerate(cands):
+					bychrom.setdefault(cand[0], []).append(c)
+				for fragment_chrom, rows in bychrom.items():
+					gccounts[rows] = gcWindows.counts(fragment_chrom,
+						[cands[c][1] for c in rows], [cands[c][4] for c in rows])
+			for c in numpy.flatnonzero(gccounts < 0):
+				gccounts[c] = getGCCount(cands[c][2])
+			t2 = time()
+			report.add("fragment_sampling", t2 - t1)
+			keep = gc_bias.H2Batch(
+				[len(cand[2]) for cand in cands], gccounts,
+				isize, newSD, isd, gcSD, mvnTable, numpy.random.random_sample(len(cands)))
+			t3 = time()
+			report.add("h2", t3 - t2)
+			report.count("rejected_h2", len(cands) - int(keep.sum()))
+			if keep.any():
+				emptyDraws = 0
+			else:
+				emptyDraws += drawn
+				if emptyDraws >= MAX_EMPTY_DRAWS:
+					sys.exit("None of the last " + str(emptyDraws) + " fragments was kept. They were outside the reference, shorter than the minimum fragment length (-m) or rejected by the GC-bias filter.")
+
+			for k in numpy.flatnonzero(keep):
+				fragment_chrom, fragment_start, ref, seqgenome, _ = cands[k]
+				refLen=len(ref)
+				if not paired:
+					readLen=RL()
+					read1,pos,dir=readGen1(ref,refLen,readLen,gens(),readLen)
+					batch.append((fragment_chrom, fragment_start, seqgenome, read1, readLen, pos, dir))
+				else:
+					val=random.random()
+					ln1=RL()
+					ln2=RL()
+					inter = isize
+					read1,pos1,dir1,len1,read2,pos2,dir2,len2 = readGenp(ref,refLen,ln1,ln2,gens())
+					batch.append((
+						fragment_chrom, fragment_start, seqgenome, val, ln1, ln2,
+						read1, len1, pos1, dir1, read2, len2, pos2, dir2
+					))
+			report.add("templates", time() - t3)
+
+		t2 = time()
+		# The `mkErrors` of Wessim2 repeats the last quality only once.
 		if not paired:
-			readLen=RL()
-			read1,pos,dir,quals1=readGen1(ref,refLen,readLen,gens(),readLen,mx1,insDict,delDict,gQList,bQList,iQList,qualbase)
-			if read1==None or quals1==None:
-				continue
-			head1='@'+'r'+str(i)+'_from_' + seqgenome + ";" + fragment_chrom + "_" + str(fragment_start + pos + 1) + "_" + dirtag[dir]
+			templates, lengths = batch_errors.encodeReads([b[3] for b in batch])
+			bases, quals, outLen, ok = \
+				batch_errors.mkErrorsBatch(templates, lengths, [b[4] for b in batch], errModel, dupQuals=False)
 		else:
-			val=random.random()
-			ln1=RL()
-			ln2=RL()
-			inter = isize
-			read1,pos1,dir1,quals1,read2,pos2,dir2,quals2 = readGenp(ref,refLen,ln1,ln2,gens(),mx1,insDict1,delDict1,gQList,bQList,iQList,qualbase)
-			p1 = fragment_chrom + "_" + str(fragment_start + pos1 + 1) + "_" + dirtag[dir1]
-			p2 = fragment_chrom + "_" + str(fragment_start + pos2 + 1) + "_" + dirtag[dir2]
-			if val > unAlign0+unAlign1:
-				pass
-			elif val > unAlign1:
-				read2='N'*ln2
-				quals2=chr(0+qualbase)*ln2
-				p2 = '*'
+			templates, lengths = batch_errors.encodeReads(
+				[b[6] for b in batch] + [b[10] for b in batch])
+			bases, quals, outLen, ok = batch_errors.mkErrorsBatch(
+				templates, lengths,
+				[b[7] for b in batch] + [b[11] for b in batch], errModel,
+				dupQuals=False)
+		t3 = time()
+		report.add("mk_errors", t3 - t2)
+		written = count
+
+		for k in range(len(batch)):
+			if not paired:
+				if not ok[k]:
+					print "unexpected stop"
+					report.count("failed_errors")
+					continue
+				fragment_chrom, fragment_start, seqgenome, _, readLen, pos, dir = batch[k]
+				read1 = bases[k, :outLen[k]].tostring()
+				quals1 = quals[k, :outLen[k]].tostring()
+				records.add("@r%d_from_%s;%s_%d_%s" % (i, seqgenome, fragment_chrom, fragment_start + pos + 1, dirtag[dir]), read1, quals1)
 			else:
-				read1='N'*ln1
-				quals1=chr(0+qualbase)*ln1
-				p1='*'
-			head1='@'+'r'+str(i)+'_from_'+ seqgenome + ";" + p1 + ":" + p2 + "/1"
-			head2='@'+'r'+str(i)+'_from_'+ seqgenome + ";" + p1 + ":" + p2 + "/2"
-		wread.write(head1 + '\n')
-		wread.write(read1.upper()+'\n')
-		wread.write('+\n')
-		wread.write(quals1+'\n')
-		if paired:
-			wread2.write(head2 + "\n")
-			wread2.write(read2.upper() + "\n")
-			wread2.write("+\n")
-			wread2.write(quals2 + "\n")
-		count +=1
-		i+=1
-		if count % 1000000 == 0 and count!=0:
-			t1 = time()
-			print "[subprocess " + str(subid) + "]: " + str(count) + " reads have been generated... in %f secs" % (t1-t0)
+				fragment_chrom, fragment_start, seqgenome, val, ln1, ln2, _, _, pos1, dir1, _, _, pos2, dir2 = batch[k]
+				k2 = k + len(batch)
+				if not ok[k] or not ok[k2]:
+					print "unexpected stop"
+					report.count("failed_errors")
+					continue
+				read1 = bases[k, :outLen[k]].tostring()
+				quals1 = quals[k, :outLen[k]].tostring()
+				read2 = bases[k2, :outLen[k2]].tostring()
+				quals2 = quals[k2, :outLen[k2]].tostring()
+				p1 = "%s_%d_%s" % (fragment_chrom, fragment_start + pos1 + 1, dirtag[dir1])
+				p2 = "%s_%d_%s" % (fragment_chrom, fragment_start + pos2 + 1, dirtag[dir2])
+				if val > unAlign0+unAlign1:
+					pass
+				elif val > unAlign1:
+					read2='N'*ln2
+					quals2=chr(0+qualbase)*ln2
+					p2 = '*'
+				else:
+					read1='N'*ln1
+					quals1=chr(0+qualbase)*ln1
+					p1='*'
+				name = "@r%d_from_%s;%s:%s" % (i, seqgenome, p1, p2)
+				records.addPair(name + "/1", read1, quals1, name + "/2", read2, quals2)
+			count +=1
+			i+=1
+		records.flush()
+		report.add("serialization", time() - t3)
+		report.count("reads", count - written)
 
-	fref.close()
-	wread.close()
-	if paired:
-		wread2.close()
+	if ownfiles:
+		wread.close()
+		if paired:
+			wread2.close()
 
 
 def pickonekey(matchkeys):
@@ -346,12 +502,12 @@ def getFragment(matchdic, key, mu, sigma, lower, bind):
 	pickedfragment = pickFragment(pickedproberegion, ins, bind)	
 	return pickedfragment
 
-def getFragmentUniform(fref, matchkeys, matchdic, mu, total, bind):
+def getFragmentUniform(fref, matchkeys, matchdic, mu, total, bind, gcWindows=None):
 	result = []
 	ins = mu
 	i = 0
 	seq = ""
-	while i < 1000:
+	while i < total:
 		key = pickonekey(matchkeys)
 		match = matchdic[key]
 		pickedproberegion = pickproberegion(match)
@@ -361,10 +517,14 @@ def getFragmentUniform(fref, matchkeys, matchdic, mu, total, bind):
 		fragment_end = int(pickedfragment[2])
 		if fragment_start < 0:
 			continue
-		seq = getSequence(fref, pickedfragment)
-		if len(seq)<ins:
-			continue
-		gcCount = getGCCount(seq)
+		gcCount = None
+		if gcWindows is not None:
+			gcCount = gcWindows.count(fragment_chrom, fragment_start, fragment_end)
+		if gcCount is None:
+			seq = getSequence(fref, pickedfragment)
+			if len(seq)<ins:
+				continue
+			gcCount = getGCCount(seq)
 		result.append(gcCount)
 		i+=1
 	return result
@@ -432,7 +592,7 @@ def readSimpleSingle(ref, rlen, err):
 	rc = False
 	read = template[startloc:startloc + rlen]
 	if x > 1: # negative strand
-		read = comp(read)[::-1]
+		read = revcomp(read)
 		rc = True
 	qual = rlen * 'h'
 	rctag = "+"
@@ -442,14 +602,11 @@ def readSimpleSingle(ref, rlen, err):
 
 def comp(sequence):
 	""" complements a sequence, preserving case. Function imported from GemSim"""
-	d={'A':'T','T':'A','C':'G','G':'C','a':'t','t':'a','c':'g','g':'c','N':'N','n':'n'}
-	cSeq=''
-	for s in sequence:
-		if s in d.keys():
-			cSeq+=d[s]
-		else:
-			cSeq+='N'
-	return cSeq
+	return sequence.translate(_COMPLEMENT)
+
+def revcomp(sequence):
+	"""Reverse complement of a sequence, preserving case."""
+	return sequence.translate(_COMPLEMENT)[::-1]
 
 def usage():
 	print ">python x3.probestatistics reference.fa probe.fa probealign.psl readoutput.fastq.gz" 
@@ -565,8 +722,13 @@ def ln(length):
 		return length
 	return val
 
-def readGen1(ref,refLen,readLen,genos,inter,mx1,insD1,delD1,gQ,bQ,iQ,qual):
-	"""Generates a random read of desired length from a reference."""
+def readGen1(ref,refLen,readLen,genos,inter):
+	"""
+	Picks a random read template of desired length from a reference.
+
+	The template carries `extrabase` more bases than the read so that
+	deletions added by `mkErrorsBatch` can pull in the next bases.
+	"""
 	extrabase = 10
 	margin = refLen - inter - 10
 	ind=random.randint(0,(margin-1))
@@ -574,18 +736,17 @@ def readGen1(ref,refLen,readLen,genos,inter,mx1,insD1,delD1,gQ,bQ,iQ,qual):
 	end=ind+inter + extrabase
 	read = ref[ind:end]
 	if dir==2:
-		cRef = comp(ref)[::-1]
-		read = cRef[refLen-end:refLen-ind]
+		# Same bases as comp(ref)[::-1][refLen-end:refLen-ind], without
+		# complementing the whole reference.
+		read = revcomp(read)
 	if genos!='':
 		read=mutate(read,ind,genos,refLen,1,readPlus,hd)
-	read,quals=mkErrors(read,readLen,mx1,insD1,delD1,gQ,bQ,iQ,qual)
 	if dir==2:
 		ind=ind + extrabase
-	return read, ind, dir, quals
+	return read, ind, dir
 
-def readGenp(ref, refLen, readLen1, readLen2, genos, mx1, insD1, delD1, gQ, bQ, iQ, qual):
-	"""Generates a pair of reads from given DNA fragment."""
-	cRef = comp(ref)[::-1]
+def readGenp(ref, refLen, readLen1, readLen2, genos):
+	"""Picks the templates of a pair of reads from given DNA fragment."""
 	extrabase = 10
 	ind1 = 0
 	ind2 = refLen - readLen2 
@@ -594,14 +755,13 @@ def readGenp(ref, refLen, readLen1, readLen2, genos, mx1, insD1, delD1, gQ, bQ,
 	dir1=1
 	dir2=2
 	read1 = ref[ind1:end1]
-	read2 = cRef[ind1:end1]
-	read1, quals1 = mkErrors(read1, readLen1, mx1, insD1, delD1, gQ, bQ, iQ, qual)
-	read2, quals2 = mkErrors(read2, readLen2, mx1, insD1, delD1, gQ, bQ, iQ, qual)
+	# The first end1 bases of comp(ref)[::-1].
+	read2 = revcomp(ref[max(refLen - end1, 0):])
 	pairorder = random.randint(1,2)
 	if pairorder==1:
-		return read1, ind1, dir1, quals1, read2, ind2, dir2, quals2
+		return read1, ind1, dir1, readLen1, read2, ind2, dir2, readLen2
 	else:
-		return read2, ind2, dir2, quals2, read1, ind1, dir1, quals1
+		return read2, ind2, dir2, readLen2, read1, ind1, dir1, readLen1
 
 def readGen2(reference,cRef,pos,dir,readLen,genos,inter,mx2,insD2,delD2,gQ,bQ,iQ,qual):
 	"""Generates the 2nd read of a random pair of reads."""
@@ -731,9 +891,9 @@ def mkErrors(read,readLen,mx,insD,delD,gQ,bQ,iQ,qual):
 					success=True
 					break
 				except:
-					bPos-1
-				if success==False:
-					qualslist.append(chr(2+qual))
+					bPos-=1
+			if success==False:
+				qualslist.append(chr(2+qual))
 		elif val>g:
 			read=read[:pos+3]+'C'+read[pos+4:]
 			bPos=pos-1
@@ -743,9 +903,9 @@ def mkErrors(read,readLen,mx,insD,delD,gQ,bQ,iQ,qual):
 					success=True
 					break
 				except:
-					bPos-1
-				if success==False:
-					qualslist.append(chr(2+qual))
+					bPos-=1
+			if success==False:
+				qualslist.append(chr(2+qual))
 		elif val>t:
 			read=read[:pos+3]+'G'+read[pos+4:]
 			bPos=pos-1
@@ -755,9 +915,9 @@ def mkErrors(read,readLen,mx,insD,delD,gQ,bQ,iQ,qual):
 					success=True
 					break
 				except:
-					bPos-1
-				if success==False:
-					qualslist.append(chr(2+qual))
+					bPos-=1
+			if success==False:
+				qualslist.append(chr(2+qual))
 		elif val>a:
 			read=read[:pos+3]+'T'+read[pos+4:] 
 			bPos=pos-1
@@ -767,9 +927,9 @@ def mkErrors(read,readLen,mx,insD,delD,gQ,bQ,iQ,qual):
 					success=True
 					break
 				except:
-					bPos-1
-				if success==False:
-					qualslist.append(chr(2+qual))
+					bPos-=1
+			if success==False:
+				qualslist.append(chr(2+qual))
 		else:
 			read=read[:pos+3]+'A'+read[pos+4:]
 			bPos=pos-1
@@ -779,9 +939,9 @@ def mkErrors(read,readLen,mx,insD,delD,gQ,bQ,iQ,qual):
 					success=True
 					break
 				except:
-					bPos-1
-				if success==False:
-					qualslist.append(chr(2+qual))
+					bPos-=1
+			if success==False:
+				qualslist.append(chr(2+qual))
 		if index in delD:
 			delete=delD[index]()
 			read=read[:pos+4]+read[pos+delete+4:]
@@ -790,6 +950,7 @@ def mkErrors(read,readLen,mx,insD,delD,gQ,bQ,iQ,qual):
 			read=read[:pos+4]+insert+read[pos+4:]
 			for i in insert:
 				iPos=pos-1
+				success=False
 				while iPos>=0:
 					try:
 						qualslist.append(iQ[iPos]())
@@ -797,8 +958,8 @@ def mkErrors(read,readLen,mx,insD,delD,gQ,bQ,iQ,qual):
 						break
 					except:
 						iPos-=1
-					if success==False:
-						qualslist.append(chr(2+qual))
+				if success==False:
+					qualslist.append(chr(2+qual))
 			pos+=len(insert)
 		pos+=1
 	qualslist.append(qualslist[-1])
@@ -883,17 +1044,10 @@ def H(l, n, x, u1, u2, mvnpdf):
 	return toKeep 
 	
 def readmvnTable():
-	f = open("lib/mvnTable.txt")
-	context = f.read()
-	lines = context.split("\n")
-	mvnTable = []
-	for line in lines:
-		values = line.split("\t")
-		if len(values)<500:
-			continue
-		mvnTable.append(values)
-	f.close()
-	return mvnTable
+	"""
+	The normal pdf table of lib/mvnTable.txt, computed rather than parsed.
+	"""
+	return gc_bias.normalTable()
 	
 if __name__=="__main__":
 	main(sys.argv[1:])
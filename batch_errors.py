@@ -0,0 +1,433 @@
+"""
+Batch error engine for Wessim.
+
+This is a vectorized replacement for the per-read `mkErrors` loop found in
+__sub_wessim1.py and __sub_wessim2.py. Instead of rebuilding a Python string
+for every base, a whole batch of fragments is held as a uint8 matrix of base
+codes and the GemSim substitution, indel and quality draws are made with
+NumPy across the batch, one read position at a time.
+
+The per-read semantics of `mkErrors` (context keys, the position offset
+introduced by inserts, the duplicated quality values and the "unexpected
+stop" failure) are reproduced so that the output is statistically equivalent
+to the legacy path.
+"""
+
+import numpy
+
+import samplers
+
+# Base codes, in the same order as `inds` in the sub-programs.
+BASES = 'ATGCN'
+N_CODE = 4
+
+# Number of fragments handed to `mkErrorsBatch` at once by the sub-programs.
+BATCH_SIZE = 10000
+
+_ENCODE = numpy.empty(256, dtype=numpy.uint8)
+_ENCODE.fill(N_CODE)
+for _i, _b in enumerate(BASES):
+	_ENCODE[ord(_b)] = _i
+	_ENCODE[ord(_b.lower())] = _i
+_DECODE = numpy.frombuffer(BASES.encode('ascii'), dtype=numpy.uint8)
+
+
+def encodeReads(seqs, width=None):
+	"""
+	Encode a list of sequences into a padded matrix of base codes.
+
+	Args:
+		seqs: List of sequence strings.
+		width: Number of columns of the matrix [longest sequence].
+
+	Returns:
+		A tuple of the uint8 code matrix (padded with N) and the int64 array
+		of sequence lengths.
+	"""
+	lengths = numpy.array([len(s) for s in seqs], dtype=numpy.int64)
+	if width is None:
+		width = int(lengths.max()) if len(seqs) else 0
+	codes = numpy.empty((len(seqs), width), dtype=numpy.uint8)
+	codes.fill(N_CODE)
+	if len(seqs):
+		joined = numpy.frombuffer(''.join(seqs).encode('ascii'), dtype=numpy.uint8)
+		mask = numpy.arange(width)[None, :] < lengths[:, None]
+		codes[mask] = _ENCODE[joined]
+	return codes, lengths
+
+
+def contextCode(pos, d1, d2, d3, d4, d5):
+	"""Flat integer code of a GemSim context (position x 5^5 neighbourhood)."""
+	return ((((pos * 5 + d1) * 5 + d2) * 5 + d3) * 5 + d4) * 5 + d5
+
+
+def keyToCode(key):
+	"""Convert a dotted GemSim context key ('12.0.3.1.4.2') to its code."""
+	v = [int(x) for x in key.split('.')]
+	return contextCode(v[0], v[1], v[2], v[3], v[4], v[5])
+
+
+def _cumulativeRows(rows):
+	"""
+	Pad a list of weight lists into a matrix of cumulative probabilities.
+
+	Every row ends in exactly 1.0, so a uniform draw in [0, 1) always falls
+	inside it. A row without any weight always picks its first entry.
+	"""
+	width = max([len(r) for r in rows] + [1])
+	cum = numpy.ones((len(rows), width))
+	for j, r in enumerate(rows):
+		if len(r):
+			c = numpy.cumsum(numpy.maximum(numpy.asarray(r, dtype=float), 0.0))
+			if c[-1] > 0:
+				cum[j, :len(c) - 1] = c[:-1] / c[-1]
+	return cum
+
+
+def _drawRows(cum, rows, rnd):
+	"""Bisect uniform draws into the cumulative probability rows `rows`."""
+	return (cum[rows] <= rnd[:, None]).sum(axis=1)
+
+
+def compileQualities(qualL, default, npos=None):
+	"""
+	Compile a GemSim per-position quality list into alias tables.
+
+	The legacy closures walk backwards from the requested position until a
+	usable distribution is found, and fall back to a constant quality when
+	none is. That walk is resolved here, once, by giving every position its
+	own table, so a draw never has to look anywhere else.
+
+	Args:
+		qualL: List of {quality: count} dictionaries, one per read position.
+		default: Quality used when no position at or before the requested
+			one has a distribution.
+		npos: Number of positions to compile [len(qualL)].
+
+	Returns:
+		A tuple of the alias probability, alias index and quality value
+		matrices, with one row per position.
+	"""
+	if npos is None:
+		npos = max(len(qualL), 1)
+	dists = []
+	last = ([default], [1.0])
+	for p in range(npos):
+		if p < len(qualL):
+			d = qualL[p]
+			keys = sorted(k for k in d if float(d[k]) > 0)
+			if len(keys):
+				last = (keys, [float(d[k]) for k in keys])
+		dists.append(last)
+	width = max(len(v) for v, w in dists)
+	prob = numpy.ones((npos, width))
+	alias = numpy.zeros((npos, width), dtype=numpy.int32)
+	vals = numpy.zeros((npos, width), dtype=numpy.int64)
+	for p, (v, w) in enumerate(dists):
+		if p > 0 and dists[p - 1] is dists[p]:
+			prob[p], alias[p], vals[p] = prob[p - 1], alias[p - 1], vals[p - 1]
+			continue
+		prob[p], alias[p] = samplers.aliasTable(w + [0.0] * (width - len(w)))
+		vals[p, :len(v)] = v
+	return prob, alias, vals
+
+
+def compileModel(mx, insD, delD, gQualL, bQualL, iQualL, readlen=None):
+	"""
+	Compile a parsed GemSim model into the arrays used by `BatchErrorModel`.
+
+	Args:
+		mx: GemSim substitution matrix (6-level nested list of count arrays).
+		insD: GemSim insertion dictionary keyed by dotted context.
+		delD: GemSim deletion dictionary keyed by dotted context.
+		gQualL, bQualL, iQualL: Per-position quality dictionaries for good,
+			bad and inserted bases.
+		readlen: If given, positions that a read of this length never
+			reaches are left out.
+
+	Returns:
+		A dictionary of named NumPy arrays.
+	"""
+	counts = numpy.asarray(mx, dtype=float)
+	if readlen is not None:
+		counts = counts[:readlen + 1]
+	npos = counts.shape[0]
+	counts = counts.reshape(-1, 6)
+	tot = counts[:, 5]
+
+	def usable(key):
+		return int(key.split('.', 1)[0]) < npos
+
+	# Substitutions: cumulative probabilities of calling A, T, G, C and N in
+	# each context, indexed by `contextCode`. A context that was never
+	# observed gets -1 so that it never produces an error.
+	subCum = numpy.cumsum(counts[:, :5], axis=1)
+	subCum /= numpy.where(tot == 0, 1.0, tot)[:, None]
+	subCum[tot == 0] = -1.0
+	arrays = {'subCum': subCum.astype(numpy.float32)}
+
+	# Indels live in small tables of their own. `delRow`/`insRow` map a
+	# context code to its row in them, or to -1 for contexts without indels.
+	#
+	# Deletions: the weight of "no deletion" is the context total minus
+	# the weights of the listed deletion lengths, as in `mkDels`.
+	keys = sorted([k for k in delD if usable(k)], key=keyToCode)
+	arrays['delRow'] = numpy.empty(len(counts), dtype=numpy.int32)
+	arrays['delRow'].fill(-1)
+	rows = []
+	for j, k in enumerate(keys):
+		arrays['delRow'][keyToCode(k)] = j
+		rows.append([tot[keyToCode(k)] - sum(delD[k])] + list(delD[k]))
+	arrays['delCum'] = _cumulativeRows(rows)
+
+	# Insertions: the "no insertion" option keeps the full context total
+	# as its weight, as in `mkInserts`.
+	keys = sorted([k for k in insD if usable(k)], key=keyToCode)
+	arrays['insRow'] = numpy.empty(len(counts), dtype=numpy.int32)
+	arrays['insRow'].fill(-1)
+	strings = ['']
+	stringId = {'': 0}
+	rows = []
+	opts = []
+	for j, k in enumerate(keys):
+		arrays['insRow'][keyToCode(k)] = j
+		ins = sorted(insD[k].keys())
+		for s in ins:
+			if s not in stringId:
+				stringId[s] = len(strings)
+				strings.append(s)
+		rows.append([insD[k][s] for s in ins] + [tot[keyToCode(k)]])
+		opts.append([stringId[s] for s in ins] + [0])
+	arrays['insCum'] = _cumulativeRows(rows)
+	arrays['insOpt'] = numpy.zeros(arrays['insCum'].shape, dtype=numpy.int32)
+	for j, o in enumerate(opts):
+		arrays['insOpt'][j, :len(o)] = o
+	insLen = numpy.array([len(s) for s in strings], dtype=numpy.int64)
+	arrays['insLen'] = insLen
+	arrays['insStart'] = numpy.concatenate(([0], numpy.cumsum(insLen)[:-1])).astype(numpy.int64)
+	arrays['insCodes'] = _ENCODE[numpy.frombuffer(''.join(strings).encode('ascii') + b'N', dtype=numpy.uint8)]
+
+	for name, qualL, default in (('gQ', gQualL, 30), ('bQ', bQualL, 2), ('iQ', iQualL, 2)):
+		prob, alias, vals = compileQualities(qualL, default, readlen)
+		arrays[name + 'Prob'] = prob
+		arrays[name + 'Alias'] = alias
+		arrays[name + 'Values'] = vals
+	return arrays
+
+
+class QualitySampler(object):
+	"""Per-position quality sampler over the tables from `compileQualities`."""
+
+	def __init__(self, prob, alias, values):
+		self.prob = prob
+		self.alias = alias
+		self.values = values
+
+	def draw(self, pos, rng):
+		"""Draw one quality value for each of the 0-based positions `pos`."""
+		pos = numpy.minimum(pos, len(self.prob) - 1)
+		idx = samplers.aliasDraw(self.prob[pos], self.alias[pos], rng.random_sample(len(pos)))
+		return self.values[pos, idx]
+
+	def drawBlock(self, n, length, rng):
+		"""
+		Draw the qualities of positions 0..length-1 for `n` reads at once.
+
+		Returns:
+			An (n, length) matrix of quality values.
+		"""
+		pos = numpy.minimum(numpy.arange(length), len(self.prob) - 1)
+		k = self.prob.shape[1]
+		u = rng.random_sample((n, length)) * k
+		col = numpy.minimum(u.astype(numpy.int64), k - 1)
+		idx = numpy.where(u - col < self.prob[pos, col], col, self.alias[pos, col])
+		return self.values[pos, idx]
+
+
+class BatchErrorModel(object):
+	"""
+	GemSim error model in array form for use with `mkErrorsBatch`.
+
+	Args:
+		arrays: Dictionary of arrays from `compileModel`. They may be
+			memory-mapped from a compiled model bundle.
+		qual: Quality score offset.
+	"""
+
+	def __init__(self, arrays, qual):
+		self.subCum = arrays['subCum']
+		self.npos = self.subCum.shape[0] // 3125
+		for name in ('delRow', 'delCum', 'insRow', 'insCum', 'insOpt', 'insLen', 'insStart', 'insCodes'):
+			setattr(self, name, arrays[name])
+		self.gQ = QualitySampler(arrays['gQProb'], arrays['gQAlias'], arrays['gQValues'])
+		self.bQ = QualitySampler(arrays['bQProb'], arrays['bQAlias'], arrays['bQValues'])
+		self.iQ = QualitySampler(arrays['iQProb'], arrays['iQAlias'], arrays['iQValues'])
+		self.qual = qual
+
+	def drawInserts(self, ctx, rng):
+		"""Draw an insert string id for each context (0 is no insert)."""
+		out = numpy.zeros(len(ctx), dtype=numpy.int64)
+		rows = self.insRow[ctx]
+		hit = numpy.nonzero(rows >= 0)[0]
+		if len(hit):
+			idx = _drawRows(self.insCum, rows[hit], rng.random_sample(len(hit)))
+			out[hit] = self.insOpt[rows[hit], idx]
+		return out
+
+	def drawDeletions(self, ctx, rng):
+		"""Draw a deletion length for each context."""
+		out = numpy.zeros(len(ctx), dtype=numpy.int64)
+		rows = self.delRow[ctx]
+		hit = numpy.nonzero(rows >= 0)[0]
+		if len(hit):
+			out[hit] = _drawRows(self.delCum, rows[hit], rng.random_sample(len(hit)))
+		return out
+
+	def drawSubstitutions(self, ctx, rng):
+		"""
+		Draw the called base for each context.
+
+		Returns:
+			An array of base codes, or -1 where the base is called correctly.
+		"""
+		cum = self.subCum[ctx]
+		val = rng.random_sample(len(ctx))
+		called = (val[:, None] > cum[:, :4]).sum(axis=1)
+		return numpy.where(val > cum[:, 4], -1, called)
+
+
+def _put(buf, rows, col, values):
+	"""Write `values` at (rows, col) where col still falls inside `buf`."""
+	keep = col < buf.shape[1]
+	buf[rows[keep], col[keep]] = values[keep]
+
+
+def mkErrorsBatch(reads, lengths, readLen, model, rng=numpy.random, dupQuals=True):
+	"""
+	Add random sequencing errors to a batch of reads.
+
+	Args:
+		reads: uint8 matrix of base codes, one template per row. Each row
+			should hold the bases the read is cut from, plus any extra bases
+			that deletions may pull in.
+		lengths: Number of valid bases in each row of `reads`.
+		readLen: Read length, either a scalar or one value per row.
+		model: A `BatchErrorModel`.
+		rng: Source of randomness (`numpy.random` or a `RandomState`).
+		dupQuals: Repeat the last quality after every base without a
+			deletion, like the `mkErrors` of Wessim1. If False, it is
+			repeated once at the end, like the `mkErrors` of Wessim2.
+
+	Returns:
+		A tuple (bases, quals, outLen, ok). `bases` and `quals` are uint8
+		ASCII matrices of width max(readLen) and `outLen` holds the length of
+		each read. `ok` is False for the reads that the legacy `mkErrors`
+		would have rejected with "unexpected stop".
+	"""
+	n = reads.shape[0]
+	lengths = numpy.asarray(lengths, dtype=numpy.int64)
+	readLen = numpy.zeros(n, dtype=numpy.int64) + readLen
+	width = int(readLen.max()) if n else 0
+	bases = numpy.empty((n, width), dtype=numpy.uint8)
+	bases.fill(N_CODE)
+	quals = numpy.zeros((n, width), dtype=numpy.int64)
+	if n == 0:
+		return _DECODE[bases], quals.astype(numpy.uint8), lengths, numpy.zeros(0, dtype=bool)
+
+	# A leading insert may be drawn in front of the first base.
+	first = reads[:, 0].astype(numpy.int64)
+	ins0 = model.drawInserts(contextCode(0, 4, 4, 4, 4, first), rng)
+	ins0Len = model.insLen[ins0]
+	hist = numpy.zeros((n, 4), dtype=numpy.int64) + N_CODE
+	for k in range(int(ins0Len.max())):
+		has = numpy.nonzero(ins0Len > k)[0]
+		code = model.insCodes[model.insStart[ins0[has]] + k]
+		_put(bases, has, numpy.zeros(len(has), dtype=numpy.int64) + k, code)
+		_put(quals, has, numpy.zeros(len(has), dtype=numpy.int64) + k,
+			model.iQ.draw(numpy.zeros(len(has), dtype=numpy.int64), rng))
+		hist[has, :3] = hist[has, 1:]
+		hist[has, 3] = code
+
+	# Context registers: d1 is the current base, d2-d4 precede it and d5
+	# follows it. They shift exactly like in `mkErrors`.
+	d1 = hist[:, 3].copy()
+	d2 = hist[:, 2].copy()
+	d3 = hist[:, 1].copy()
+	d4 = hist[:, 0].copy()
+	d5 = first.copy()
+	pos = ins0Len + 1
+	cur = numpy.zeros(n, dtype=numpy.int64)
+	nb = ins0Len.copy()
+	nq = ins0Len.copy()
+
+	# Good qualities of every position are drawn for the whole batch up
+	# front; the few bad ones are drawn as errors happen.
+	good = model.gQ.drawBlock(n, width, rng)
+
+	while True:
+		act = numpy.nonzero((pos <= readLen) & (cur + 1 < lengths))[0]
+		if not len(act):
+			break
+		p = pos[act]
+		c = cur[act]
+		d4[act] = d3[act]
+		d3[act] = d2[act]
+		d2[act] = d1[act]
+		d1[act] = d5[act]
+		d5[act] = reads[act, c + 1]
+		ctx = contextCode(numpy.minimum(p, model.npos - 1), d1[act], d2[act], d3[act], d4[act], d5[act])
+
+		# Substitution of the current base, with a good or bad quality.
+		called = model.drawSubstitutions(ctx, rng)
+		bad = called >= 0
+		base = numpy.where(bad, called, reads[act, c])
+		q = good[act, p - 1]
+		q[bad] = model.bQ.draw(p[bad] - 1, rng)
+		_put(bases, act, nb[act], base)
+		_put(quals, act, nq[act], q)
+		nb[act] += 1
+		nq[act] += 1
+
+		# Deletion of the following bases.
+		dlen = model.drawDeletions(ctx, rng)
+		cur[act] += dlen
+
+		# Insertion after the current base. Inserted bases are not
+		# themselves mutated, but shift the model position.
+		ins = model.drawInserts(ctx, rng)
+		ilen = model.insLen[ins]
+		for k in range(int(ilen.max())):
+			j = numpy.nonzero(ilen > k)[0]
+			r = act[j]
+			_put(bases, r, nb[r] + k, model.insCodes[model.insStart[ins[j]] + k])
+			_put(quals, r, nq[r] + k, model.iQ.draw(p[j] - 1, rng))
+		nb[act] += ilen
+		nq[act] += ilen
+		pos[act] += ilen + 1
+		cur[act] += 1
+
+		# `mkErrors` of Wessim1 repeats the last quality unless a deletion
+		# was made.
+		if dupQuals:
+			dup = (dlen == 0) | (cur[act] == lengths[act] - 1)
+			r = act[dup]
+			last = quals[r, numpy.minimum(nq[r] - 1, width - 1)]
+			_put(quals, r, nq[r], last)
+			nq[r] += 1
+
+	if not dupQuals:
+		r = numpy.nonzero(nq > 0)[0]
+		last = quals[r, numpy.minimum(nq[r] - 1, width - 1)]
+		_put(quals, r, nq[r], last)
+		nq[r] += 1
+
+	# The untouched remainder of the template follows the processed bases.
+	readOut = numpy.minimum(readLen, nb + numpy.maximum(lengths - cur, 0))
+	col = numpy.arange(width)[None, :]
+	r, k = numpy.nonzero((col >= nb[:, None]) & (col < readOut[:, None]))
+	bases[r, k] = reads[r, numpy.minimum(cur[r] + k - nb[r], reads.shape[1] - 1)]
+
+	ok = readOut == numpy.minimum(readLen, nq)
+	bases = _DECODE[bases]
+	quals = (quals + model.qual).astype(numpy.uint8)
+	return bases, quals, readOut, ok
@@ -0,0 +1,517 @@
+#!/usr/bin/env python2
+"""
+Benchmarks Wessim1.py and Wessim2.py on synthetic inputs
+
+Everything the simulators need is generated offline into a work directory: a
+reference genome with a varying GC content, a BED file of exome-like
+targets (and the target FASTA, abd file and store made from it by
+get_region_vector.py), probes with their BLAT matches for Wessim2, and small
+single-end and paired-end models in the GemSim pickle format.
+
+Each case is then run for every number of subprocesses requested, and its
+reads per second, startup time (until the first read is on disk) and peak
+RSS (of the largest process) are written as JSON, so that versions can be
+compared.
+"""
+
+import os
+import argparse
+import sys
+import gzip
+import cPickle
+import json
+import multiprocessing
+import platform
+import shutil
+import subprocess
+import tempfile
+from time import time, sleep, strftime, localtime
+
+import numpy
+import pysam
+
+import compile_model
+import get_region_vector
+
+__script_examples__="""
+Examples:
+
+    Run all cases with 1, 2 and 4 subprocesses and save the results:
+        {scriptname} \\
+                --threads 1 2 4 \\
+                --output bench.json
+
+    Run only the paired-end cases of Wessim1 with more reads:
+        {scriptname} \\
+                --cases w1-pe w1-pe-rce w1-pe-z \\
+                --num-reads 1000000
+
+""".format(scriptname = sys.argv[0])
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Benchmark cases: (program, options).
+CASES = {
+    "w1-se": ("Wessim1.py", []),
+    "w1-pe": ("Wessim1.py", ["--paired-reads"]),
+    "w1-pe-rce": ("Wessim1.py", ["--paired-reads", "--use-rce"]),
+    "w1-pe-z": ("Wessim1.py", ["--paired-reads", "-z"]),
+    "w1-pe-store": ("Wessim1.py", ["--paired-reads", "--store"]),
+    "w2-se": ("Wessim2.py", []),
+    "w2-pe": ("Wessim2.py", ["-p"]),
+}
+
+# Seconds between checks of a running case.
+POLL_INTERVAL = 0.01
+
+
+def main(args):
+    """
+    Main function
+
+    Args:
+        args: A list of arguments from the CLI
+
+    Returns:
+        None
+    """
+    parameters = parse_args(args)
+    unknown = [case for case in parameters.cases if case not in CASES]
+    if unknown:
+        print >> sys.stderr, "Unknown cases: " + " ".join(unknown)
+        sys.exit(1)
+
+    work_dir = parameters.work_dir
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix = "wessim-bench.")
+    elif not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+
+    try:
+        print >> sys.stderr, "Generating fixtures in " + work_dir
+        fixtures = make_fixtures(
+            work_dir,
+            parameters.genome_size,
+            parameters.num_targets,
+            parameters.read_length,
+            parameters.seed
+        )
+
+        results = []
+        for case in parameters.cases:
+            for threads in parameters.threads:
+                print >> sys.stderr, "Running %s with -t %d" % (case, threads)
+                result = run_case(
+                    case, fixtures, work_dir, threads,
+                    parameters.num_reads, parameters.read_length,
+                    parameters.seed
+                )
+                print >> sys.stderr, "    %.0f reads/sec, startup %.2f secs, peak RSS %.1f MB" % (
+                    result["reads_per_sec"], result["startup_secs"],
+                    result["peak_rss_mb"])
+                results.append(result)
+    finally:
+        if parameters.work_dir is None and not parameters.keep:
+            shutil.rmtree(work_dir)
+
+    report = {
+        "version": get_region_vector.get_version(),
+        "date": strftime("%Y-%m-%d %H:%M:%S", localtime()),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "cpus": cpu_count(),
+        "num_reads": parameters.num_reads,
+        "read_length": parameters.read_length,
+        "genome_size": parameters.genome_size,
+        "num_targets": parameters.num_targets,
+        "seed": parameters.seed,
+        "results": results
+    }
+    if parameters.output == "-":
+        json.dump(report, sys.stdout, indent = 2, sort_keys = True)
+        print
+    else:
+        with open(parameters.output, "w") as f:
+            json.dump(report, f, indent = 2, sort_keys = True)
+
+
+def parse_args(args):
+    """
+    Parse the command line arguments into a dict object.
+
+    Args:
+        args: Arguments from the CLI
+
+    Returns:
+        A dict object with the argument -> value pairs taken from the CLI.
+    """
+    parser = argparse.ArgumentParser(
+        description = __doc__,
+        epilog = __script_examples__,
+        formatter_class = argparse.RawDescriptionHelpFormatter
+    )
+
+    parser.add_argument(
+        "--cases",
+        help = "Cases to run [all: %(default)s]",
+        nargs = "+",
+        default = sorted(CASES.keys())
+    )
+
+    parser.add_argument(
+        "-t", "--threads",
+        help = "Numbers of subprocesses (-t) to run every case with [%(default)s]",
+        type = int,
+        nargs = "+",
+        default = [1, 2, 4]
+    )
+
+    parser.add_argument(
+        "-n", "--num-reads",
+        help = "Number of reads per run [%(default)s]",
+        type = int,
+        default = 200000
+    )
+
+    parser.add_argument(
+        "-l", "--read-length",
+        help = "Read length (bp) [%(default)s]",
+        type = int,
+        default = 100
+    )
+
+    parser.add_argument(
+        "--genome-size",
+        help = "Length of each of the two synthetic chromosomes [%(default)s]",
+        type = int,
+        default = 2000000
+    )
+
+    parser.add_argument(
+        "--num-targets",
+        help = "Number of synthetic targets [%(default)s]",
+        type = int,
+        default = 2000
+    )
+
+    parser.add_argument(
+        "--seed",
+        help = "Seed of the fixtures and of the runs (--seed) [%(default)s]",
+        type = int,
+        default = 1
+    )
+
+    parser.add_argument(
+        "--work-dir",
+        help = "Directory for the fixtures and outputs. It is kept [a "
+            "temporary directory, removed afterwards]"
+    )
+
+    parser.add_argument(
+        "--keep",
+        help = "Keep the temporary work directory",
+        action = "store_true"
+    )
+
+    parser.add_argument(
+        "-o", "--output",
+        help = "JSON file the results are written to [stdout]",
+        default = "-"
+    )
+
+    return parser.parse_args(args)
+
+
+def cpu_count():
+    """Number of CPUs, or None if it cannot be determined."""
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return None
+
+
+def make_reference(path, genome_size, rng):
+    """
+    Write a reference of two chromosomes and index it with faidx.
+
+    The GC content changes every 10 kb, so that the GC calibration and the
+    GC-bias filter have something to work with.
+
+    Returns:
+        A dict of chromosome name -> sequence.
+    """
+    block = 10000
+    chroms = {}
+    with open(path, "w") as f:
+        for name in ("chr1", "chr2"):
+            parts = []
+            for start in range(0, genome_size, block):
+                gc = rng.uniform(0.3, 0.65)
+                p = [(1 - gc) / 2, (1 - gc) / 2, gc / 2, gc / 2]
+                n = min(block, genome_size - start)
+                parts.append("".join(rng.choice(list("ATGC"), n, p = p)))
+            seq = "".join(parts)
+            chroms[name] = seq
+            f.write(">" + name + "\n")
+            for i in range(0, len(seq), 60):
+                f.write(seq[i:i + 60] + "\n")
+    pysam.faidx(path)
+    return chroms
+
+
+def make_targets(path, chroms, num_targets, rng):
+    """
+    Write a BED file of non-overlapping, exome-like targets.
+
+    Their lengths range from shorter than a fragment to a few hundred bases,
+    as exons do.
+
+    Returns:
+        A list of (chrom, start, end) targets.
+    """
+    targets = []
+    per_chrom = num_targets // len(chroms)
+    for name in sorted(chroms):
+        spacing = len(chroms[name]) // (per_chrom + 1)
+        for k in range(per_chrom):
+            length = int(rng.randint(80, 600))
+            start = k * spacing + int(rng.randint(1, max(spacing - length, 2)))
+            targets.append((name, start, start + length))
+    with open(path, "w") as f:
+        for chrom, start, end in targets:
+            f.write("%s\t%d\t%d\n" % (chrom, start, end))
+    return targets
+
+
+def add_rce(abd_file, rng):
+    """
+    Replace the placeholder RCE values of an abd file by random ones.
+
+    get_region_vector.py only writes RCE values of 1.
+    """
+    with open(abd_file) as f:
+        lengths = [line.split("\t")[0] for line in f if line.strip()]
+    with open(abd_file, "w") as f:
+        for length in lengths:
+            f.write("%s\t%.3f\n" % (length, rng.lognormal(0, 0.5)))
+
+
+def make_probes(probe_file, psl_file, chroms, targets, probe_length = 120):
+    """
+    Write one probe per target, and a PSL file of their exact matches.
+
+    The probe FASTA has one sequence line per probe, as Wessim2 expects.
+    """
+    with open(probe_file, "w") as fa, open(psl_file, "w") as psl:
+        psl.write("psLayout version 3\n\n")
+        psl.write("match\tmis-\trep.\tN's\tQ gap\tQ gap\tT gap\tT gap\tstrand\tQ\tQ\tQ\tQ\tT\tT\tT\tT\tblock\tblockSizes\tqStarts\ttStarts\n")
+        psl.write("\tmatch\tmatch\t\tcount\tbases\tcount\tbases\t\tname\tsize\tstart\tend\tname\tsize\tstart\tend\tcount\n")
+        psl.write("-" * 159 + "\n")
+        for k, (chrom, start, end) in enumerate(targets):
+            name = "probe%d" % (k + 1)
+            pend = min(start + probe_length, end)
+            seq = chroms[chrom][start:pend]
+            fa.write(">" + name + "\n" + seq + "\n")
+            n = pend - start
+            psl.write("\t".join(str(v) for v in (
+                n, 0, 0, 0, 0, 0, 0, 0, "+", name, n, 0, n,
+                chrom, len(chroms[chrom]), start, pend, 1,
+                "%d," % n, "0,", "%d," % start
+            )) + "\n")
+
+
+def make_model(path, paired, read_length, rng):
+    """
+    Write a small error model in the GemSim pickle format.
+
+    Bases are miscalled at about 1% and indels are found in a sample of the
+    contexts. Qualities drop along the read.
+    """
+    npos = read_length + 2
+    # mx[pos][d1][d2][d3][d4][d5] holds the counts of the calls A, T, G, C
+    # and N of the base d1 in its context, and their total.
+    mx = numpy.zeros((npos, 5, 5, 5, 5, 5, 6), dtype = numpy.int64)
+    for base in range(5):
+        counts = [3, 3, 3, 3, 1]
+        if base < 4:
+            counts[base] = 990
+        mx[:, base, :, :, :, :, :5] = counts
+    mx[..., 5] = mx[..., :5].sum(axis = -1)
+
+    ins_d = {}
+    del_d = {}
+    for pos in range(1, npos):
+        for k in range(20):
+            key = ".".join(str(v) for v in [pos] + list(rng.randint(0, 4, 5)))
+            ins_d[key] = {"A": 2, "TT": 1}
+            key = ".".join(str(v) for v in [pos] + list(rng.randint(0, 4, 5)))
+            del_d[key] = [2, 1]
+
+    g_qual = []
+    b_qual = []
+    i_qual = []
+    for pos in range(npos):
+        top = 40 - 10 * pos // npos
+        g_qual.append(dict((q, int(rng.randint(1, 100))) for q in range(top - 10, top + 1)))
+        b_qual.append(dict((q, int(rng.randint(1, 100))) for q in range(2, 20)))
+        i_qual.append(dict((q, int(rng.randint(1, 100))) for q in range(2, 20)))
+
+    if paired:
+        objects = [
+            read_length, mx, mx, ins_d, ins_d, del_d, del_d,
+            dict((size, 1) for size in range(100, 400)),
+            g_qual, b_qual, i_qual,
+            # About 1% of the pairs have an unaligned mate.
+            [10, 10], [1000, 1000],
+            {read_length: 1000}
+        ]
+    else:
+        objects = [
+            read_length, mx, ins_d, del_d, g_qual, b_qual, i_qual,
+            1000, {read_length: 1000}
+        ]
+    f = gzip.open(path, "wb")
+    for obj in objects:
+        cPickle.dump(obj, f, cPickle.HIGHEST_PROTOCOL)
+    f.close()
+
+
+def make_fixtures(work_dir, genome_size, num_targets, read_length, seed):
+    """
+    Generate all the inputs of the benchmark cases into `work_dir`.
+
+    Returns:
+        A dict of fixture name -> path.
+    """
+    rng = numpy.random.RandomState(seed)
+    fixtures = {
+        "reference": os.path.join(work_dir, "reference.fa"),
+        "bed": os.path.join(work_dir, "targets.bed"),
+        "target_fasta": os.path.join(work_dir, "targets.fa"),
+        "target_abd": os.path.join(work_dir, "targets.abd"),
+        "target_store": os.path.join(work_dir, "targets.store"),
+        "probes": os.path.join(work_dir, "probes.fa"),
+        "psl": os.path.join(work_dir, "probes.psl"),
+        "model_se": os.path.join(work_dir, "model_s.gzip"),
+        "model_pe": os.path.join(work_dir, "model_p.gzip"),
+        "model_cache": os.path.join(work_dir, "model_cache"),
+    }
+    chroms = make_reference(fixtures["reference"], genome_size, rng)
+    targets = make_targets(fixtures["bed"], chroms, num_targets, rng)
+    if os.path.isdir(fixtures["target_store"]):
+        shutil.rmtree(fixtures["target_store"])
+    # Keep stdout for the JSON report.
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        get_region_vector.main([
+            "--fasta-file", fixtures["reference"],
+            "--target-bed-file", fixtures["bed"],
+            "--target-fasta-file", fixtures["target_fasta"],
+            "--target-abd-file", fixtures["target_abd"],
+            "--target-store", fixtures["target_store"],
+        ])
+    finally:
+        sys.stdout = stdout
+    add_rce(fixtures["target_abd"], rng)
+    make_probes(fixtures["probes"], fixtures["psl"], chroms, targets)
+    make_model(fixtures["model_se"], False, read_length, rng)
+    make_model(fixtures["model_pe"], True, read_length, rng)
+
+    # Compile the models now, so that no case pays for it.
+    for model, paired in ((fixtures["model_se"], False), (fixtures["model_pe"], True)):
+        compile_model.compile_model(model, paired, read_length, fixtures["model_cache"])
+    return fixtures
+
+
+def case_command(case, fixtures, outfile, threads, num_reads, read_length, seed):
+    """Command line of a benchmark case."""
+    program, options = CASES[case]
+    paired = "--paired-reads" in options or "-p" in options
+    command = [
+        sys.executable, os.path.join(SCRIPT_DIR, program),
+        "-n", str(num_reads),
+        "-l", str(read_length),
+        "-M", fixtures["model_pe"] if paired else fixtures["model_se"],
+        "-t", str(threads),
+        "-o", outfile,
+        "--seed", str(seed),
+        "--model-cache-dir", fixtures["model_cache"],
+    ]
+    if program == "Wessim1.py":
+        if "--store" in options:
+            command += ["--target-store", fixtures["target_store"]]
+        else:
+            command += [
+                "--target-fasta-file", fixtures["target_fasta"],
+                "--target-abd-file", fixtures["target_abd"],
+            ]
+    else:
+        command += [
+            "-R", fixtures["reference"],
+            "-P", fixtures["probes"],
+            "-B", fixtures["psl"],
+        ]
+    return command + [option for option in options if option != "--store"]
+
+
+def run_case(case, fixtures, work_dir, threads, num_reads, read_length, seed):
+    """
+    Run one benchmark case and measure it.
+
+    The peak RSS is the largest maximum resident set size of the program and
+    its subprocesses, as reported by wait4.
+
+    Returns:
+        A dict of the measurements.
+    """
+    outfile = os.path.join(work_dir, "%s-t%d" % (case, threads))
+    command = case_command(case, fixtures, outfile, threads, num_reads, read_length, seed)
+    program, options = CASES[case]
+    first = outfile + ("_1" if "--paired-reads" in options or "-p" in options else "")
+    first += ".fastq.gz" if "-z" in options else ".fastq"
+    if os.path.exists(first):
+        os.remove(first)
+
+    with open(outfile + ".log", "w") as log:
+        t0 = time()
+        process = subprocess.Popen(command, stdout = log, stderr = subprocess.STDOUT)
+        startup = None
+        while True:
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid != 0:
+                break
+            if startup is None and os.path.exists(first) and os.path.getsize(first) > 0:
+                startup = time() - t0
+            sleep(POLL_INTERVAL)
+        wall = time() - t0
+    # Mark the process as finished for the subprocess module.
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    if startup is None:
+        startup = wall
+
+    result = {
+        "case": case,
+        "program": program,
+        "options": options,
+        "threads": threads,
+        "reads": num_reads,
+        "returncode": process.returncode,
+        "wall_secs": wall,
+        "startup_secs": startup,
+        "reads_per_sec": num_reads / wall if process.returncode == 0 else 0.0,
+        "generation_reads_per_sec": num_reads / max(wall - startup, 1e-9) if process.returncode == 0 else 0.0,
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_mb": usage.ru_maxrss / 1024.0,
+        "log": outfile + ".log",
+    }
+    if process.returncode != 0:
+        print >> sys.stderr, "    failed with exit status %d, see %s" % (process.returncode, result["log"])
+    return result
+
+
+# If this script has been called directly (and not imported by another), run the
+# 'main' function with the command line arguments:
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,132 @@
+"""
+Multithreaded BGZF writer for Wessim's FASTQ output
+
+BGZF is the blocked gzip format of samtools/htslib: a series of gzip members
+of at most 64 KB each, followed by an empty end-of-file block. Any gzip reader
+can read it, and tools such as `bgzip`/`htsfile` can index it. The blocks are
+independent, so they are compressed on a pool of threads (zlib releases the
+GIL) and written out in order.
+"""
+
+import functools
+import struct
+import zlib
+from multiprocessing.pool import ThreadPool
+
+# Uncompressed bytes per block. This is what htslib uses, so that even
+# incompressible data fits into the 64 KB limit of a block.
+BLOCK_SIZE = 0xff00
+
+DEFAULT_LEVEL = 6
+
+# The empty block that ends every BGZF file.
+EOF_MARKER = (
+	"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00"
+	"\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+)
+
+
+def compressBlock(data, level=DEFAULT_LEVEL):
+	"""Compress at most `BLOCK_SIZE` bytes into one BGZF block."""
+	c = zlib.compressobj(level, zlib.DEFLATED, -15)
+	cdata = c.compress(data) + c.flush()
+	bsize = len(cdata) + 25
+	header = struct.pack("<4BI2BH2BHH", 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2, bsize)
+	footer = struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+	return header + cdata + footer
+
+
+def compressChunk(data, level=DEFAULT_LEVEL, pool=None):
+	"""
+	Compress `data` into BGZF blocks, without the end-of-file block.
+
+	Chunks compressed separately can be concatenated in any grouping; the
+	file only needs `EOF_MARKER` at the very end.
+
+	Args:
+		data: Data to compress.
+		level: zlib compression level.
+		pool: Optional thread pool to compress the blocks on.
+	"""
+	blocks = [data[start:start + BLOCK_SIZE] for start in range(0, len(data), BLOCK_SIZE)]
+	if pool is None:
+		return "".join([compressBlock(block, level) for block in blocks])
+	return "".join(pool.map(functools.partial(compressBlock, level=level), blocks))
+
+
+class BgzfWriter(object):
+	"""
+	File object writing BGZF, with the blocks compressed by `threads` threads.
+
+	Only `write` and `close` are supported. Blocks are written to the file in
+	the order of the data, whatever the order in which they are compressed.
+	`filename` can also be an open file object such as stdout, which is
+	flushed but not closed by `close`.
+	"""
+
+	def __init__(self, filename, level=DEFAULT_LEVEL, threads=1):
+		self.level = level
+		self.threads = threads
+		self.ownfile = not hasattr(filename, "write")
+		self.fileobj = open(filename, "wb") if self.ownfile else filename
+		self.buffer = []
+		self.buffered = 0
+		self.pending = []
+		# The pool is started with the first block, so that processes can be
+		# forked after opening the writer without inheriting its threads.
+		self.pool = None
+
+	def write(self, data):
+		self.buffer.append(data)
+		self.buffered += len(data)
+		if self.buffered >= BLOCK_SIZE:
+			self._flushBlocks(False)
+
+	def _flushBlocks(self, final):
+		data = "".join(self.buffer)
+		end = len(data) if final else len(data) - len(data) % BLOCK_SIZE
+		for start in range(0, end, BLOCK_SIZE):
+			self._submit(data[start:min(start + BLOCK_SIZE, end)])
+		self.buffer = [data[end:]]
+		self.buffered = len(data) - end
+
+	def _submit(self, block):
+		if self.threads <= 1:
+			self.fileobj.write(compressBlock(block, self.level))
+			return
+		if self.pool is None:
+			self.pool = ThreadPool(self.threads)
+		self.pending.append(self.pool.apply_async(compressBlock, (block, self.level)))
+		# Keep a bounded number of blocks in flight.
+		while len(self.pending) > 4 * self.threads:
+			self.fileobj.write(self.pending.pop(0).get())
+
+	def close(self):
+		if self.fileobj is None:
+			return
+		self._flushBlocks(True)
+		for result in self.pending:
+			self.fileobj.write(result.get())
+		self.pending = []
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+		self.fileobj.write(EOF_MARKER)
+		if self.ownfile:
+			self.fileobj.close()
+		else:
+			self.fileobj.flush()
+		self.fileobj = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+def openOutput(filename, compress, level=DEFAULT_LEVEL, threads=1):
+	"""Open a FASTQ output file, as BGZF if `compress` is set."""
+	if compress:
+		return BgzfWriter(filename, level, threads)
+	return open(filename, "w")
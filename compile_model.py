@@ -0,0 +1,273 @@
+#!/usr/bin/env python2
+"""
+Compiles a GemSim error model into a memory-mappable bundle for Wessim
+
+Unpickling a GemSim model and building the error tables from it takes a few
+seconds and a private copy of the model in every process. A compiled bundle
+is a directory of .npy arrays plus an index.json file. It is cached on disk,
+keyed by the model's SHA-1 and the read length, so each model is compiled only
+once. Workers memory-map the arrays and share their pages.
+"""
+
+import os
+import argparse
+import sys
+import gzip
+import cPickle
+import hashlib
+import json
+import shutil
+import tempfile
+
+import numpy
+
+import batch_errors
+
+# Bump this when the layout of a bundle changes so that stale bundles are
+# recompiled instead of being loaded.
+BUNDLE_FORMAT = 3
+
+__script_examples__="""
+Examples:
+
+    Compile a paired-end model for 100bp reads into the default cache:
+        {scriptname} \\
+                --model GemSIM_v1.6/models/ill100v4_p.gzip \\
+                --read-length 100 \\
+                --paired-reads
+
+""".format(scriptname = sys.argv[0])
+
+def main(args):
+    """
+    Main function
+
+    Args:
+        args: A list of arguments from the CLI
+
+    Returns:
+        None
+    """
+    parameters = parse_args(args)
+    bundle_dir = compile_model(
+        parameters.model,
+        parameters.paired_reads,
+        parameters.read_length,
+        parameters.cache_dir
+    )
+    print bundle_dir
+
+
+def parse_args(args):
+    """
+    Parse the command line arguments into a dict object.
+
+    Args:
+        args: Arguments from the CLI
+
+    Returns:
+        A dict object with the argument -> value pairs taken from the CLI.
+    """
+    parser = argparse.ArgumentParser(
+        description = __doc__,
+        epilog = __script_examples__,
+        formatter_class = argparse.RawDescriptionHelpFormatter
+    )
+
+    parser.add_argument(
+        "-M", "--model",
+        help = "GemSim model file (.gzip)",
+        required = True
+    )
+
+    parser.add_argument(
+        "-l", "--read-length",
+        help = "Read length (bp) the model will be used for",
+        type = int,
+        required = True
+    )
+
+    parser.add_argument(
+        "-p", "--paired-reads",
+        help = "The model is a paired-end model",
+        action = "store_true"
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        help = "Directory holding compiled models [%(default)s]",
+        default = get_cache_dir()
+    )
+
+    return parser.parse_args(args)
+
+
+def get_cache_dir(cache_dir=None):
+    """
+    Get the directory compiled models are cached in.
+
+    Args:
+        cache_dir: Directory requested on the command line, if any. Otherwise
+            $WESSIM_CACHE or ~/.cache/wessim is used.
+
+    Returns:
+        The cache directory path.
+    """
+    if cache_dir:
+        return cache_dir
+    return os.environ.get(
+        "WESSIM_CACHE",
+        os.path.join(os.path.expanduser("~"), ".cache", "wessim")
+    )
+
+
+def model_hash(model_file):
+    """
+    Compute the SHA-1 of a model file.
+
+    Args:
+        model_file: Path to the GemSim model file
+
+    Returns:
+        The hex digest of the file contents.
+    """
+    sha1 = hashlib.sha1()
+    with open(model_file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def read_gemsim_model(model_file, paired):
+    """
+    Unpickle a GemSim model.
+
+    The objects are stored one after another in the gzip file, in the same
+    order as read by `parseModel` in the sub-programs.
+
+    Args:
+        model_file: Path to the GemSim model file
+        paired: Whether the model is a paired-end model
+
+    Returns:
+        A dict of the model objects.
+    """
+    if paired:
+        names = [
+            "model_read_len", "mx1", "mx2", "insD1", "insD2", "delD1", "delD2",
+            "intD", "gQualL", "bQualL", "iQualL", "mates", "rds", "rdLenD"
+        ]
+    else:
+        names = [
+            "model_read_len", "mx1", "insD1", "delD1", "gQualL", "bQualL",
+            "iQualL", "readCount", "rdLenD"
+        ]
+    model = {}
+    f = gzip.open(model_file, "rb")
+    for name in names:
+        model[name] = cPickle.load(f)
+    f.close()
+    return model
+
+
+def compile_model(model_file, paired, readlen, cache_dir=None):
+    """
+    Compile a GemSim model into the cache, unless it is already there.
+
+    Args:
+        model_file: Path to the GemSim model file
+        paired: Whether the model is a paired-end model
+        readlen: Read length the model will be used for
+        cache_dir: Directory holding compiled models
+
+    Returns:
+        The path of the compiled model bundle.
+    """
+    cache_dir = get_cache_dir(cache_dir)
+    key = "{sha1}-l{readlen}-{mode}-v{version}".format(
+        sha1 = model_hash(model_file),
+        readlen = readlen,
+        mode = "p" if paired else "s",
+        version = BUNDLE_FORMAT
+    )
+    bundle_dir = os.path.join(cache_dir, key)
+    if os.path.isfile(os.path.join(bundle_dir, "index.json")):
+        return bundle_dir
+
+    model = read_gemsim_model(model_file, paired)
+    if readlen > model["model_read_len"]:
+        print "Inappropriate read length chosen for model. Maximum for this model: " + str(model["model_read_len"])
+        sys.exit(1)
+
+    arrays = batch_errors.compileModel(
+        model["mx1"], model["insD1"], model["delD1"],
+        model["gQualL"], model["bQualL"], model["iQualL"],
+        readlen
+    )
+
+    index = {
+        "format": BUNDLE_FORMAT,
+        "model_file": os.path.abspath(model_file),
+        "read_length": readlen,
+        "model_read_length": model["model_read_len"],
+        "paired": paired,
+        "arrays": sorted(arrays.keys())
+    }
+    if paired:
+        # Fractions of pairs with an unaligned first or second mate
+        m0 = float(model["mates"][0])
+        m1 = float(model["mates"][1])
+        rd0 = float(model["rds"][0])
+        rd1 = float(model["rds"][1])
+        un_align0 = (m0*rd1-m1*m0)/(rd0*rd1-m1*m0)
+        un_align1 = 1.0-(un_align0/(m0/rd0))
+        index["un_align"] = [un_align0, un_align1]
+
+    # Write into a temporary directory first and move it into place, so that
+    # concurrent runs never see a half-written bundle.
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+    tmp_dir = tempfile.mkdtemp(prefix = key + ".", dir = cache_dir)
+    for name, array in arrays.items():
+        numpy.save(os.path.join(tmp_dir, name + ".npy"), array)
+    with open(os.path.join(tmp_dir, "index.json"), "w") as f:
+        json.dump(index, f, indent = 2, sort_keys = True)
+    try:
+        os.rename(tmp_dir, bundle_dir)
+    except OSError:
+        # Another process compiled the same model in the meantime
+        shutil.rmtree(tmp_dir)
+    return bundle_dir
+
+
+def load_model(bundle_dir):
+    """
+    Open a compiled model bundle.
+
+    The arrays are memory-mapped read-only, so processes opening the same
+    bundle share its pages.
+
+    Args:
+        bundle_dir: Path of a bundle created by `compile_model`
+
+    Returns:
+        A tuple of the dict of arrays and the index dict.
+    """
+    with open(os.path.join(bundle_dir, "index.json")) as f:
+        index = json.load(f)
+    arrays = {}
+    for name in index["arrays"]:
+        arrays[name] = numpy.load(
+            os.path.join(bundle_dir, name + ".npy"), mmap_mode = "r"
+        )
+    return arrays, index
+
+
+# If this script has been called directly (and not imported by another), run the
+# 'main' function with the command line arguments:
+if __name__ == "__main__":
+    main(sys.argv[1:])
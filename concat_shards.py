@@ -0,0 +1,99 @@
+#!/usr/bin/env python2
+"""
+Joins the outputs of the shards of a Wessim simulation
+
+Wessim1.py and Wessim2.py --shard i/N generate shard i of the N shards of a
+simulation, e.g. one per array job on separate nodes. Given the same --seed,
+joining the outputs of shards 1..N gives exactly the output of the whole
+simulation run on one node. The shards are concatenated byte by byte, without
+decompressing them, and are kept.
+"""
+
+import argparse
+import sys
+
+import merge_outputs
+
+__script_examples__="""
+Examples:
+
+    Join the paired-end, compressed outputs of 3 shards into result_1.fastq.gz
+    and result_2.fastq.gz:
+        {scriptname} \\
+                --output result \\
+                --paired-reads \\
+                -z \\
+                shard1 shard2 shard3
+
+""".format(scriptname = sys.argv[0])
+
+
+def main(args):
+    """
+    Main function
+
+    Args:
+        args: A list of arguments from the CLI
+
+    Returns:
+        None
+    """
+    parameters = parse_args(args)
+    finals = merge_outputs.mergeShards(
+        parameters.output,
+        parameters.shards,
+        parameters.paired_reads,
+        parameters.z
+    )
+    for final in finals:
+        print final
+
+
+def parse_args(args):
+    """
+    Parse the command line arguments into a dict object.
+
+    Args:
+        args: Arguments from the CLI
+
+    Returns:
+        A dict object with the argument -> value pairs taken from the CLI.
+    """
+    parser = argparse.ArgumentParser(
+        description = __doc__,
+        epilog = __script_examples__,
+        formatter_class = argparse.RawDescriptionHelpFormatter
+    )
+
+    parser.add_argument(
+        "shards",
+        help = "Output file headers (-o) of shards 1..N, in order",
+        nargs = "+"
+    )
+
+    parser.add_argument(
+        "-o", "--output",
+        help = "Output file header of the joined files",
+        required = True
+    )
+
+    parser.add_argument(
+        "-p", "--paired-reads",
+        help = "The shards are paired-end reads in two files each "
+            "(not --interleaved)",
+        action = "store_true"
+    )
+
+    parser.add_argument(
+        "-z",
+        help = "The shards are compressed (-z)",
+        action = "store_true"
+    )
+
+    return parser.parse_args(args)
+
+
+# If this script has been called directly (and not imported by another), run the
+# 'main' function with the command line arguments:
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,728 @@
+#!/usr/bin/env python2
+"""
+Checks that the optimized read generation is statistically equivalent to the
+legacy code
+
+The legacy per-read code paths are still in __sub_wessim1.py and
+__sub_wessim2.py. Both the legacy and the optimized path of each stage are
+run on the synthetic fixtures of bench.py, and the distributions they
+produce are compared:
+
+    substitutions   per-position substitution counts (mkErrors of Wessim1
+                    vs batch_errors.mkErrorsBatch)
+    indels          reads with insertions, deletions or both, and reads
+                    dropped with "unexpected stop" (same engines)
+    qualities       histogram of the quality characters at every read
+                    position (same engines)
+    substitutions-wessim2, indels-wessim2, qualities-wessim2
+                    the same for the mkErrors of Wessim2 vs mkErrorsBatch
+                    as Wessim2 calls it
+    inserts         insert sizes (the getInsertLength retry loop of
+                    readGenp2 vs fragment_planner.InsertSizeTable)
+    targets         reads per target, drawn by length (getIndex over all
+                    targets, discarding those too short for a fragment, vs
+                    fragment_planner.drawTargets over the eligible targets)
+    targets-rce     reads per target, drawn by RCE (numpy.random.choice over
+                    all targets, discarding the short ones, vs
+                    samplers.AliasSampler over the eligible targets)
+    gc              GC counts of the fragments kept by the GC-bias filter,
+                    and the number rejected (H2 with lib/mvnTable.txt vs
+                    gc_bias.H2Batch)
+
+Reads are random, so the outputs cannot be compared byte by byte. Each pair
+of histograms is compared with a chi-square test of homogeneity instead,
+after merging neighbouring bins until every expected count is at least 5.
+A check fails if its p-value is below --alpha divided by the number of
+checks (Bonferroni). The report is written as JSON and the exit status is 1
+if any check failed.
+"""
+
+import os
+import argparse
+import sys
+import json
+import math
+import random
+import shutil
+import tempfile
+from time import strftime, localtime
+
+import numpy
+
+import batch_errors
+import bench
+import compile_model
+import fragment_planner
+import gc_bias
+import get_region_vector
+import samplers
+import __sub_wessim1 as sub_wessim1
+import __sub_wessim2 as sub_wessim2
+
+__script_examples__="""
+Examples:
+
+    Run all checks and save the report:
+        {scriptname} \\
+                --output equivalence.json
+
+    Run the checks of the error engine with more reads:
+        {scriptname} \\
+                --checks substitutions indels qualities \\
+                --num-reads 100000
+
+""".format(scriptname = sys.argv[0])
+
+CHECKS = [
+    "substitutions", "indels", "qualities",
+    "substitutions-wessim2", "indels-wessim2", "qualities-wessim2",
+    "inserts", "targets", "targets-rce", "gc",
+]
+
+# Bins of the quality characters at each read position.
+QUAL_BINS = 128
+
+# Smallest expected count of a bin in the chi-square test.
+MIN_EXPECTED = 5.0
+
+
+def main(args):
+    """
+    Main function
+
+    Args:
+        args: A list of arguments from the CLI
+
+    Returns:
+        None
+    """
+    parameters = parse_args(args)
+    unknown = [check for check in parameters.checks if check not in CHECKS]
+    if unknown:
+        print >> sys.stderr, "Unknown checks: " + " ".join(unknown)
+        sys.exit(1)
+
+    work_dir = parameters.work_dir
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix = "wessim-equivalence.")
+    elif not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+
+    # Keep stdout for the JSON report; the legacy code prints to it.
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        print "Generating fixtures in " + work_dir
+        fixtures = bench.make_fixtures(
+            work_dir,
+            parameters.genome_size,
+            parameters.num_targets,
+            parameters.read_length,
+            parameters.seed
+        )
+        histograms = run_checks(parameters, fixtures)
+    finally:
+        sys.stdout = stdout
+        if parameters.work_dir is None and not parameters.keep:
+            shutil.rmtree(work_dir)
+
+    threshold = parameters.alpha / len(histograms)
+    results = []
+    for name in parameters.checks:
+        legacy, new = histograms[name]
+        result = compare(legacy, new, threshold)
+        result["check"] = name
+        results.append(result)
+        print >> sys.stderr, "%-21s %s  p = %.3g, chi2 = %.1f, df = %d, TV distance = %.4f" % (
+            name, "PASS" if result["pass"] else "FAIL", result["p_value"],
+            result["statistic"], result["df"], result["tv_distance"])
+
+    passed = all(result["pass"] for result in results)
+    report = {
+        "version": get_region_vector.get_version(),
+        "date": strftime("%Y-%m-%d %H:%M:%S", localtime()),
+        "numpy": numpy.__version__,
+        "num_reads": parameters.num_reads,
+        "num_draws": parameters.num_draws,
+        "read_length": parameters.read_length,
+        "genome_size": parameters.genome_size,
+        "num_targets": parameters.num_targets,
+        "seed": parameters.seed,
+        "alpha": parameters.alpha,
+        "threshold": threshold,
+        "pass": passed,
+        "results": results
+    }
+    if parameters.output == "-":
+        json.dump(report, sys.stdout, indent = 2, sort_keys = True)
+        print
+    else:
+        with open(parameters.output, "w") as f:
+            json.dump(report, f, indent = 2, sort_keys = True)
+    if not passed:
+        sys.exit(1)
+
+
+def parse_args(args):
+    """
+    Parse the command line arguments into a dict object.
+
+    Args:
+        args: Arguments from the CLI
+
+    Returns:
+        A dict object with the argument -> value pairs taken from the CLI.
+    """
+    parser = argparse.ArgumentParser(
+        description = __doc__,
+        epilog = __script_examples__,
+        formatter_class = argparse.RawDescriptionHelpFormatter
+    )
+
+    parser.add_argument(
+        "--checks",
+        help = "Checks to run [all: %(default)s]",
+        nargs = "+",
+        default = CHECKS
+    )
+
+    parser.add_argument(
+        "-n", "--num-reads",
+        help = "Number of reads given sequencing errors by each engine "
+            "[%(default)s]",
+        type = int,
+        default = 20000
+    )
+
+    parser.add_argument(
+        "--num-draws",
+        help = "Number of targets, insert sizes and GC-bias decisions drawn "
+            "by each path [%(default)s]",
+        type = int,
+        default = 200000
+    )
+
+    parser.add_argument(
+        "--alpha",
+        help = "Significance level of all the checks together [%(default)s]",
+        type = float,
+        default = 0.001
+    )
+
+    parser.add_argument(
+        "-l", "--read-length",
+        help = "Read length (bp) [%(default)s]",
+        type = int,
+        default = 100
+    )
+
+    parser.add_argument(
+        "--fragsize",
+        help = "Mean fragment size (-f) [%(default)s]",
+        type = int,
+        default = 200
+    )
+
+    parser.add_argument(
+        "--fragsd",
+        help = "Standard deviation of the fragment size (-d) [%(default)s]",
+        type = int,
+        default = 50
+    )
+
+    parser.add_argument(
+        "--genome-size",
+        help = "Length of each of the two synthetic chromosomes [%(default)s]",
+        type = int,
+        default = 2000000
+    )
+
+    parser.add_argument(
+        "--num-targets",
+        help = "Number of synthetic targets [%(default)s]",
+        type = int,
+        default = 2000
+    )
+
+    parser.add_argument(
+        "--seed",
+        help = "Seed of the fixtures and of both paths [%(default)s]",
+        type = int,
+        default = 1
+    )
+
+    parser.add_argument(
+        "--work-dir",
+        help = "Directory for the fixtures. It is kept [a temporary "
+            "directory, removed afterwards]"
+    )
+
+    parser.add_argument(
+        "--keep",
+        help = "Keep the temporary work directory",
+        action = "store_true"
+    )
+
+    parser.add_argument(
+        "-o", "--output",
+        help = "JSON file the report is written to [stdout]",
+        default = "-"
+    )
+
+    return parser.parse_args(args)
+
+
+def chi2_sf(x, df):
+    """
+    Survival function of the chi-square distribution.
+
+    This is the regularized upper incomplete gamma function Q(df/2, x/2),
+    computed by its series or its continued fraction.
+    """
+    if x <= 0:
+        return 1.0
+    a = df / 2.0
+    x = x / 2.0
+    lead = math.exp(-x + a * math.log(x) - math.lgamma(a))
+    if x < a + 1:
+        term = total = 1.0 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1.0 - lead * total)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1.0 / tiny
+    d = 1.0 / b
+    h = d
+    for i in range(1, 10000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        if abs(d) < tiny:
+            d = tiny
+        c = b + an / c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return lead * h
+
+
+def merge_bins(legacy, new):
+    """
+    Merge neighbouring bins until all expected counts are at least
+    MIN_EXPECTED.
+
+    Returns:
+        Two lists of counts of the merged bins.
+    """
+    n_legacy = float(sum(legacy))
+    n_new = float(sum(new))
+    share = min(n_legacy, n_new) / (n_legacy + n_new)
+    merged_legacy = []
+    merged_new = []
+    acc_legacy = acc_new = 0
+    for a, b in zip(legacy, new):
+        acc_legacy += a
+        acc_new += b
+        if (acc_legacy + acc_new) * share >= MIN_EXPECTED:
+            merged_legacy.append(acc_legacy)
+            merged_new.append(acc_new)
+            acc_legacy = acc_new = 0
+    if acc_legacy + acc_new > 0:
+        if merged_legacy:
+            merged_legacy[-1] += acc_legacy
+            merged_new[-1] += acc_new
+        else:
+            merged_legacy.append(acc_legacy)
+            merged_new.append(acc_new)
+    return merged_legacy, merged_new
+
+
+def compare(legacy, new, threshold):
+    """
+    Chi-square test of homogeneity of two histograms over the same bins.
+
+    Returns:
+        A dict of the test statistic, degrees of freedom, p-value, total
+        variation distance of the two distributions and whether the
+        p-value is at least `threshold`.
+    """
+    legacy = [int(v) for v in legacy]
+    new = [int(v) for v in new]
+    n_legacy = float(sum(legacy))
+    n_new = float(sum(new))
+    tv = 0.5 * sum(abs(a / n_legacy - b / n_new) for a, b in zip(legacy, new))
+    merged_legacy, merged_new = merge_bins(legacy, new)
+    statistic = 0.0
+    for a, b in zip(merged_legacy, merged_new):
+        total = a + b
+        for observed, n in ((a, n_legacy), (b, n_new)):
+            expected = total * n / (n_legacy + n_new)
+            statistic += (observed - expected) ** 2 / expected
+    df = len(merged_legacy) - 1
+    p_value = chi2_sf(statistic, df) if df > 0 else 1.0
+    return {
+        "legacy_total": int(n_legacy),
+        "new_total": int(n_new),
+        "bins": len(legacy),
+        "merged_bins": len(merged_legacy),
+        "statistic": statistic,
+        "df": df,
+        "p_value": p_value,
+        "tv_distance": tv,
+        "pass": p_value >= threshold
+    }
+
+
+def seed_both(seed):
+    """Seed `random` (legacy paths) and `numpy.random` (optimized paths)."""
+    random.seed(seed)
+    numpy.random.seed(seed)
+
+
+def load_targets(fixtures):
+    """
+    Read the target sequences and the abd file of the fixtures.
+
+    Returns:
+        A tuple of the list of target sequences, the cumulative lengths and
+        the RCE sampling probabilities.
+    """
+    seqs = []
+    with open(fixtures["target_fasta"]) as f:
+        for line in f:
+            if not line.startswith(">"):
+                seqs.append(line.strip())
+    abdlist = []
+    rce = []
+    with open(fixtures["target_abd"]) as f:
+        for line in f:
+            if line.strip():
+                values = line.split("\t")
+                abdlist.append(int(values[0]))
+                rce.append(float(values[1]))
+    rce = numpy.array(rce)
+    return seqs, abdlist, rce / rce.sum()
+
+
+def legacy_mvn_table():
+    """lib/mvnTable.txt, parsed as the legacy readmvnTable did."""
+    path = os.path.join(bench.SCRIPT_DIR, "lib", "mvnTable.txt")
+    table = []
+    with open(path) as f:
+        for line in f.read().split("\n"):
+            values = line.split("\t")
+            if len(values) < 500:
+                continue
+            table.append(values)
+    return table
+
+
+def legacy_qualities(legacy, qual_list, qualbase):
+    """Quality choosers of every position, as the legacy main built them."""
+    choosers = []
+    for quals in qual_list:
+        items = [(chr(k + qualbase), quals[k]) for k in sorted(quals.keys())]
+        choosers.append(legacy.bisect_choiceTUP(items))
+    return choosers
+
+
+def edits(template, read, window = 4):
+    """
+    Find the edits turning `template` into `read`, greedily.
+
+    A mismatch followed by `window` matching bases is a substitution, and
+    otherwise a shift of up to 3 bases that makes the next `window` bases
+    match is an insertion or deletion. Both engines are judged the same
+    way, so ambiguous edits do not bias the comparison.
+
+    Returns:
+        A tuple of the read positions of the substitutions, the number of
+        insertions and the number of deletions.
+    """
+    subs = []
+    ins = dels = 0
+    i = j = 0
+    while i < len(read) and j < len(template):
+        if read[i] == template[j]:
+            i += 1
+            j += 1
+            continue
+        if read[i + 1:i + 1 + window] == template[j + 1:j + 1 + window]:
+            subs.append(i)
+            i += 1
+            j += 1
+            continue
+        for d in range(1, 4):
+            if read[i:i + window] == template[j + d:j + d + window]:
+                dels += 1
+                j += d
+                break
+            if read[i + d:i + d + window] == template[j:j + window]:
+                ins += 1
+                i += d
+                break
+        else:
+            subs.append(i)
+            i += 1
+            j += 1
+    return subs, ins, dels
+
+
+def error_histograms(templates, reads, read_length):
+    """
+    Histograms of the substitutions, indels and qualities of `reads`.
+
+    Args:
+        templates: Template of each read.
+        reads: (read, quals) of each template, or None if it was dropped.
+
+    Returns:
+        A dict of check name -> histogram.
+    """
+    subs = [0] * read_length
+    indels = [0] * 5
+    # Qualities by position, so that shifted or repeated qualities show.
+    quals = [0] * (read_length * QUAL_BINS)
+    for template, read in zip(templates, reads):
+        if read is None:
+            indels[4] += 1
+            continue
+        bases, qualities = read
+        positions, ins, dels = edits(template, bases)
+        for p in positions:
+            subs[p] += 1
+        indels[(ins > 0) + 2 * (dels > 0)] += 1
+        for p, q in enumerate(qualities[:read_length]):
+            quals[p * QUAL_BINS + ord(q)] += 1
+    # The last bin counts the bases without a substitution, so that the
+    # rate is compared and not only where substitutions are.
+    subs.append(len(reads) * read_length - sum(subs))
+    return {"substitutions": subs, "indels": indels, "qualities": quals}
+
+
+def run_errors(parameters, fixtures, seqs, legacy, dup_quals):
+    """
+    Add sequencing errors to the same templates with both engines.
+
+    Args:
+        legacy: Module of the legacy `mkErrors`, `__sub_wessim1` or
+            `__sub_wessim2`.
+        dup_quals: `dupQuals` of `mkErrorsBatch` as the program of `legacy`
+            passes it.
+    """
+    read_length = parameters.read_length
+    qualbase = 33
+    # Templates as readGen1 cuts them: the read and 10 more bases.
+    rng = numpy.random.RandomState(parameters.seed)
+    long_enough = [s for s in seqs if len(s) >= read_length + 10]
+    templates = []
+    for k in rng.randint(0, len(long_enough), parameters.num_reads):
+        seq = long_enough[k]
+        start = rng.randint(0, len(seq) - read_length - 10 + 1)
+        templates.append(seq[start:start + read_length + 10])
+
+    mx, ins_d, del_d, g_qual, b_qual, i_qual, _, _ = legacy.parseModel(
+        fixtures["model_se"], False, read_length)
+    ins_dict = legacy.mkInserts(mx, ins_d)
+    del_dict = legacy.mkDels(mx, del_d)
+    g_q = legacy_qualities(legacy, g_qual, qualbase)
+    b_q = legacy_qualities(legacy, b_qual, qualbase)
+    i_q = legacy_qualities(legacy, i_qual, qualbase)
+    seed_both(parameters.seed)
+    old = []
+    for template in templates:
+        read, quals = legacy.mkErrors(
+            template, read_length, mx, ins_dict, del_dict, g_q, b_q, i_q, qualbase)
+        old.append(None if read is None else (read, quals))
+
+    bundle = compile_model.compile_model(
+        fixtures["model_se"], False, read_length, fixtures["model_cache"])
+    arrays, index = compile_model.load_model(bundle)
+    model = batch_errors.BatchErrorModel(arrays, qualbase)
+    seed_both(parameters.seed)
+    new = []
+    for start in range(0, len(templates), batch_errors.BATCH_SIZE):
+        batch = templates[start:start + batch_errors.BATCH_SIZE]
+        codes, lengths = batch_errors.encodeReads(batch)
+        bases, quals, out_len, ok = batch_errors.mkErrorsBatch(
+            codes, lengths, read_length, model, dupQuals = dup_quals)
+        for k in range(len(batch)):
+            if not ok[k]:
+                new.append(None)
+            else:
+                new.append((bases[k, :out_len[k]].tostring(),
+                    quals[k, :out_len[k]].tostring()))
+
+    old = error_histograms(templates, old, read_length)
+    new = error_histograms(templates, new, read_length)
+    return dict((name, (old[name], new[name])) for name in old)
+
+
+def run_inserts(parameters, lengths, imin):
+    """Draw insert sizes for the same targets with both paths."""
+    isize = parameters.fragsize
+    isd = parameters.fragsd
+    rng = numpy.random.RandomState(parameters.seed)
+    eligible = lengths[lengths >= imin]
+    ref_lens = eligible[rng.randint(0, len(eligible), parameters.num_draws)]
+
+    # The retry loop of readGenp2.
+    seed_both(parameters.seed)
+    legacy = []
+    for ref_len in ref_lens:
+        max_start = -1
+        while max_start < 0:
+            insert_len = sub_wessim1.getInsertLength(isize, isd, imin)
+            max_start = ref_len - insert_len + 1
+        legacy.append(insert_len)
+
+    seed_both(parameters.seed)
+    table = fragment_planner.InsertSizeTable(isize, isd, imin)
+    new = table.draw(ref_lens + 1, numpy.random.random_sample(len(ref_lens)))
+
+    top = int(max(max(legacy), new.max())) + 1
+    return (numpy.bincount(legacy, minlength = top)[imin:],
+        numpy.bincount(new, minlength = top)[imin:])
+
+
+def run_targets(parameters, abdlist, lengths, imin):
+    """
+    Draw targets that can hold a fragment in proportion to their lengths
+    with both paths.
+    """
+    last = abdlist[-1]
+    seed_both(parameters.seed)
+    legacy = []
+    while len(legacy) < parameters.num_draws:
+        target = sub_wessim1.getIndex(abdlist, int(random.uniform(1, last)))
+        if lengths[target] >= imin:
+            legacy.append(target)
+
+    seed_both(parameters.seed)
+    eligible, eligible_abd = fragment_planner.eligibleTargets(
+        abdlist, lengths, imin)
+    new = eligible[fragment_planner.drawTargets(
+        eligible_abd, eligible_abd[-1], parameters.num_draws)]
+    return (numpy.bincount(legacy, minlength = len(abdlist)),
+        numpy.bincount(new, minlength = len(abdlist)))
+
+
+def run_targets_rce(parameters, rce_prob, lengths, imin):
+    """
+    Draw targets that can hold a fragment in proportion to their RCE with
+    both paths.
+    """
+    seed_both(parameters.seed)
+    legacy = numpy.zeros(0, dtype = numpy.int64)
+    while len(legacy) < parameters.num_draws:
+        drawn = numpy.random.choice(
+            numpy.arange(len(rce_prob)), parameters.num_draws, p = rce_prob,
+            replace = True)
+        legacy = numpy.concatenate((legacy, drawn[lengths[drawn] >= imin]))
+    legacy = legacy[:parameters.num_draws]
+
+    # The alias table of __sub_wessim1.loadShared.
+    seed_both(parameters.seed)
+    eligible = numpy.flatnonzero(lengths >= imin)
+    eligible_prob = rce_prob[eligible]
+    sampler = samplers.AliasSampler(eligible_prob / eligible_prob.sum())
+    new = eligible[sampler.draw(parameters.num_draws)]
+    return (numpy.bincount(legacy, minlength = len(rce_prob)),
+        numpy.bincount(new, minlength = len(rce_prob)))
+
+
+def run_gc(parameters, seqs, lengths, imin):
+    """
+    Filter the same candidate fragments for GC bias with both paths.
+
+    As in Wessim2, the length and GC count of each fragment are passed to
+    the filter.
+    """
+    isize = parameters.fragsize
+    isd = parameters.fragsd
+    rng = numpy.random.RandomState(parameters.seed)
+    eligible = numpy.flatnonzero(lengths >= imin)
+    targets = eligible[rng.randint(0, len(eligible), parameters.num_draws)]
+    plan = fragment_planner.planFragments(
+        targets, lengths, parameters.read_length, True,
+        fragment_planner.InsertSizeTable(isize, isd, imin), rng)
+    frag_lens = plan["length"]
+    gc = numpy.array([
+        sub_wessim1.getGCCount(seqs[t][s:s + l])
+        for t, s, l in zip(plan["target"], plan["start"], frag_lens)
+    ], dtype = numpy.int64)
+    gc_sd = numpy.std(gc)
+    new_sd = isd * 2
+
+    seed_both(parameters.seed)
+    table = legacy_mvn_table()
+    legacy_keep = numpy.array([
+        sub_wessim1.H2(int(l), int(n), isize, new_sd, isd, gc_sd, table)
+        for l, n in zip(frag_lens, gc)
+    ], dtype = bool)
+
+    seed_both(parameters.seed)
+    new_keep = gc_bias.H2Batch(
+        frag_lens, gc, isize, new_sd, isd, gc_sd, gc_bias.normalTable(),
+        numpy.random.random_sample(len(gc)))
+
+    # Kept fragments by GC count, and the rejected ones in the last bin.
+    top = int(gc.max()) + 1
+    histograms = []
+    for keep in (legacy_keep, new_keep):
+        counts = numpy.bincount(gc[keep], minlength = top).tolist()
+        histograms.append(counts + [int((~keep).sum())])
+    return histograms[0], histograms[1]
+
+
+def run_checks(parameters, fixtures):
+    """
+    Run the legacy and optimized paths of the checks in `parameters`.
+
+    Returns:
+        A dict of check name -> (legacy histogram, new histogram).
+    """
+    seqs, abdlist, rce_prob = load_targets(fixtures)
+    lengths = numpy.array([len(s) for s in seqs], dtype = numpy.int64)
+    imin = parameters.read_length + 20
+    checks = set(parameters.checks)
+    histograms = {}
+    for program, suffix, legacy, dup_quals in (
+            ("Wessim1", "", sub_wessim1, True),
+            ("Wessim2", "-wessim2", sub_wessim2, False)):
+        names = set(name + suffix for name in ("substitutions", "indels", "qualities"))
+        if checks & names:
+            print "Adding sequencing errors to %d reads as %s" % (
+                parameters.num_reads, program)
+            pairs = run_errors(parameters, fixtures, seqs, legacy, dup_quals)
+            for name, pair in pairs.items():
+                if name + suffix in checks:
+                    histograms[name + suffix] = pair
+    if "inserts" in checks:
+        print "Drawing insert sizes"
+        histograms["inserts"] = run_inserts(parameters, lengths, imin)
+    if "targets" in checks:
+        print "Drawing targets by length"
+        histograms["targets"] = run_targets(parameters, abdlist, lengths, imin)
+    if "targets-rce" in checks:
+        print "Drawing targets by RCE"
+        histograms["targets-rce"] = run_targets_rce(
+            parameters, rce_prob, lengths, imin)
+    if "gc" in checks:
+        print "Filtering fragments for GC bias"
+        histograms["gc"] = run_gc(parameters, seqs, lengths, imin)
+    return histograms
+
+
+# If this script has been called directly (and not imported by another), run the
+# 'main' function with the command line arguments:
+if __name__ == "__main__":
+    main(sys.argv[1:])
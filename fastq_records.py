@@ -0,0 +1,42 @@
+"""
+Chunked FASTQ record serializer for the Wessim generation loop
+
+Records are collected as strings and written with one `write` call per
+output file and chunk, instead of four calls per read.
+"""
+
+# Format of one FASTQ record.
+RECORD = "%s\n%s\n+\n%s\n"
+
+
+class RecordBuffer(object):
+	"""
+	Collects FASTQ records for one or two output files.
+
+	If `wread2` is the same object as `wread` (interleaved output), both reads
+	of a pair go into the same buffer, one after the other.
+	"""
+
+	def __init__(self, wread, wread2=None):
+		self.wread = wread
+		self.wread2 = wread2
+		self.records1 = []
+		self.records2 = self.records1 if wread2 is wread else []
+
+	def add(self, head, read, qual):
+		"""Add a single-end read."""
+		self.records1.append(RECORD % (head, read, qual))
+
+	def addPair(self, head1, read1, qual1, head2, read2, qual2):
+		"""Add both reads of a pair."""
+		self.records1.append(RECORD % (head1, read1, qual1))
+		self.records2.append(RECORD % (head2, read2, qual2))
+
+	def flush(self):
+		"""Write the collected records, one write per file."""
+		if self.records1:
+			self.wread.write("".join(self.records1))
+			del self.records1[:]
+		if self.records2:
+			self.wread2.write("".join(self.records2))
+			del self.records2[:]
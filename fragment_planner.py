@@ -0,0 +1,145 @@
+"""
+Batch fragment planner.
+
+The read generation loop used to draw every fragment with a handful of
+`random` calls: a uniform position and a bisect for the target, a retry loop
+over `random.gauss` for the insert size, another retry loop until the insert
+fits into the target, and `randint`s for the start, strand and pair order.
+`planFragments` makes all of these draws for a chunk of fragments at once
+with NumPy and returns them as a structured array, which the read generators
+consume row by row.
+
+Insert sizes are drawn from the integer distribution of `getInsertLength`
+(int() of a normal draw of at least `lower`), truncated to what fits into the
+target, by inverting a precomputed CDF. No draw is ever rejected.
+"""
+
+import math
+
+import numpy
+
+# Number of fragments planned at once.
+PLAN_SIZE = 10000
+
+# Insert size drawn by `InsertSizeTable.draw` when no size fits.
+NO_LENGTH = -1
+
+FRAGMENT_DTYPE = numpy.dtype([
+	("target", numpy.int64),
+	("start", numpy.int64),
+	("length", numpy.int64),
+	("dir", numpy.int8),
+	("pairorder", numpy.int8),
+	("val", numpy.float64),
+])
+
+
+def drawTargets(abd, last, n, rng=numpy.random):
+	"""
+	Draw `n` targets with probabilities proportional to their lengths.
+
+	This is `getIndex(abdlist, int(random.uniform(1, last)))`, vectorized.
+
+	Args:
+		abd: Cumulative target lengths (`abdlist`).
+		last: Total target length, abd[-1].
+		n: Number of targets to draw.
+	"""
+	pos = rng.uniform(1, last, n).astype(numpy.int64)
+	return numpy.searchsorted(numpy.asarray(abd), pos, side="right")
+
+
+def eligibleTargets(abd, targetLengths, lower):
+	"""
+	The targets that can hold a fragment of `lower` bases.
+
+	Drawing with `drawTargets` over their cumulative lengths is the same as
+	drawing over all targets and discarding those shorter than `lower`.
+
+	Returns:
+		A tuple of the indices of the eligible targets and their cumulative
+		lengths.
+	"""
+	eligible = numpy.flatnonzero(numpy.asarray(targetLengths) >= lower)
+	abdLengths = numpy.diff(numpy.concatenate(([0], numpy.asarray(abd, dtype=numpy.int64))))
+	return eligible, numpy.cumsum(abdLengths[eligible])
+
+
+class InsertSizeTable(object):
+	"""
+	Distribution of insert sizes int(gauss(mu, sigma)) >= `lower`.
+
+	`draw` truncates it to a maximum length per draw, so that the insert
+	always fits into its target.
+	"""
+
+	def __init__(self, mu, sigma, lower):
+		self.lower = lower
+		if sigma == 0:
+			# gauss(mu, 0) is always mu.
+			self.cdf = numpy.zeros(max(int(mu), lower) - lower + 1)
+			self.cdf[-1] = 1.0
+			return
+		upper = max(int(mu + 10 * sigma) + 1, lower)
+		ks = range(lower, upper + 2)
+		cdf = [0.5 * (1.0 + math.erf((k - mu) / (sigma * math.sqrt(2.0)))) for k in ks]
+		# P(int(g) == k) for k = lower..upper, cumulated.
+		self.cdf = numpy.cumsum(numpy.diff(cdf))
+
+	def draw(self, maxlen, rnd):
+		"""
+		Draw insert sizes of at most `maxlen` each.
+
+		Args:
+			maxlen: Array of the largest allowed size of each draw.
+			rnd: Uniform numbers in [0, 1), one per draw.
+
+		Returns:
+			The sizes, with `NO_LENGTH` where no size of at most `maxlen` can
+			be drawn, e.g. below the mean with a standard deviation of 0.
+		"""
+		top = numpy.minimum(maxlen - self.lower, len(self.cdf) - 1)
+		mass = numpy.where(top >= 0, self.cdf[numpy.maximum(top, 0)], 0.0)
+		length = numpy.searchsorted(self.cdf, rnd * mass, side="right") + self.lower
+		return numpy.where(mass > 0, length, NO_LENGTH)
+
+
+def planFragments(targets, targetLengths, readlength, paired, insertSizes=None, rng=numpy.random):
+	"""
+	Draw the fragment of each of `targets`.
+
+	Single-end rows hold the read start (as `readGen1`) and strand. Paired
+	rows hold the insert start and length (as `readGenp2`), the pair order
+	and the uniform number deciding on unaligned mates. Single-end rows of
+	targets that are too short are planned anyway and must be skipped by the
+	caller. Paired rows of targets that no insert size fits into are dropped,
+	as the retry loop of `readGenp2` never gets out of them.
+
+	Args:
+		targets: Array of target indices.
+		targetLengths: Lengths of all the targets.
+		readlength: Read length.
+		paired: Plan paired-end fragments.
+		insertSizes: `InsertSizeTable`, for paired-end fragments.
+
+	Returns:
+		A `FRAGMENT_DTYPE` array with one row per target, but for the dropped
+		ones.
+	"""
+	n = len(targets)
+	plan = numpy.zeros(n, dtype=FRAGMENT_DTYPE)
+	plan["target"] = targets
+	refLen = numpy.asarray(targetLengths)[targets]
+	if not paired:
+		margin = numpy.maximum(refLen - readlength - 10, 1)
+		plan["start"] = (rng.random_sample(n) * margin).astype(numpy.int64)
+		plan["dir"] = rng.randint(1, 3, n)
+	else:
+		length = insertSizes.draw(refLen + 1, rng.random_sample(n))
+		plan["length"] = length
+		plan["start"] = (rng.random_sample(n) * numpy.maximum(refLen - length + 2, 1)).astype(numpy.int64)
+		plan["dir"] = 1
+		plan["pairorder"] = rng.randint(1, 3, n)
+		plan["val"] = rng.random_sample(n)
+		plan = plan[length != NO_LENGTH]
+	return plan
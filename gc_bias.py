@@ -0,0 +1,68 @@
+"""
+Vectorized GC-bias acceptance.
+
+`lib/mvnTable.txt` holds a single row: the standard normal pdf at 0.00,
+0.01, ..., 5.00. `normalTable` computes the same row from the pdf instead of
+parsing it, and `H2Batch` applies the `H2` acceptance test of the
+sub-programs to whole arrays of fragments.
+
+The arithmetic of `getProb` is reproduced operation by operation, including
+Python 2 integer division on integer lengths, so that a fragment is kept
+with exactly the probability `H2` gives it.
+"""
+
+import math
+
+import numpy
+
+# Table entries per unit of |z|, and the |z| at which the table is cut.
+STEPS = 100
+CUTOFF = 5.0
+
+
+def normalTable():
+	"""
+	The standard normal pdf at 0, 1/STEPS, ..., CUTOFF.
+
+	Returns:
+		A float64 array of shape (1, CUTOFF * STEPS + 1), laid out like the
+		rows of lib/mvnTable.txt.
+	"""
+	z = numpy.arange(int(CUTOFF * STEPS) + 1) / float(STEPS)
+	return (numpy.exp(-0.5 * z * z) / math.sqrt(2 * math.pi)).reshape(1, -1)
+
+
+def _lookup(z, mvnpdf):
+	"""pdf of `z` in the table, as `mvnpdf[0][int(cut(z)*100)]`."""
+	k = (numpy.minimum(numpy.abs(z), CUTOFF) * STEPS).astype(numpy.int64)
+	return mvnpdf[0][k]
+
+
+def getProbBatch(l, n, x, sd, gcSD, alpha, mvnpdf):
+	"""`getProb` of arrays of target lengths `l` and GC counts `n`."""
+	p1 = _lookup((l-x)/sd, mvnpdf)
+	p2 = _lookup((n-(x/2+(l-x)*alpha))/(l*gcSD/x), mvnpdf)
+	return p1 * p2
+
+
+def H2Batch(l, n, x, sd1, sd2, gcSD, mvnpdf, rnd):
+	"""
+	Decide on many fragments at once whether to keep them, as `H2` does.
+
+	Args:
+		l: int64 array of lengths.
+		n: int64 array of GC counts.
+		x: Fragment size.
+		sd1, sd2: Standard deviations of the two models compared.
+		gcSD: Standard deviation of the GC calibration.
+		mvnpdf: Table from `normalTable`.
+		rnd: Uniform numbers in [0, 1), one per fragment.
+
+	Returns:
+		A boolean keep mask.
+	"""
+	l = numpy.asarray(l, dtype=numpy.int64)
+	n = numpy.asarray(n, dtype=numpy.int64)
+	bp = getProbBatch(l, n, x, sd1, gcSD, .5, mvnpdf)
+	ap = getProbBatch(l, n, x, sd2, gcSD, 9/7, mvnpdf)
+	return ap/bp > rnd
@@ -0,0 +1,167 @@
+"""
+Prefix-sum GC indices.
+
+`getGCCount` walks a fragment base by base. With the cumulative number of G/C
+bases of a sequence precomputed, the GC count of any slice is the difference
+of two entries, and many slices can be looked up at once with NumPy.
+
+A plain prefix sum takes 4 bytes per base. `GCBits` keeps the G/C bases as
+bits instead, 32 to a word, with the cumulative count only before every
+word, which is a quarter of a byte per base. The count before a position is
+that of its word plus the bits of the word in front of it.
+
+`GCWindows` covers the reference windows around the probe matches of
+Wessim2, where fragments are drawn. Wessim1 only counts the fragments of its
+GC calibration, with `countGC`, so that it does not index all its targets.
+"""
+
+import numpy
+
+# Bases per word of `GCBits`.
+WORD_BASES = 32
+
+_IS_GC = numpy.zeros(256, dtype=numpy.uint8)
+for _b in 'GCgc':
+	_IS_GC[ord(_b)] = 1
+
+
+def _asCodes(seq):
+	"""View a sequence string or uint8 array as a uint8 array."""
+	if isinstance(seq, numpy.ndarray):
+		return seq
+	return numpy.frombuffer(seq, dtype=numpy.uint8)
+
+
+def _popcount(v):
+	"""Number of set bits of every element of a uint32 array."""
+	v = v - ((v >> 1) & 0x55555555)
+	v = (v & 0x33333333) + ((v >> 2) & 0x33333333)
+	v = (v + (v >> 4)) & 0x0F0F0F0F
+	return (v * 0x01010101) >> 24
+
+
+def countGC(seq):
+	"""GC count of a sequence string or uint8 array of its characters."""
+	return int(_IS_GC[_asCodes(seq)].sum())
+
+
+class GCBits(object):
+	"""
+	Cumulative GC counts of a sequence, in a quarter of a byte per base.
+	"""
+
+	def __init__(self, seq):
+		"""
+		Args:
+			seq: Sequence string, or uint8 array of its characters.
+		"""
+		codes = _asCodes(seq)
+		self.length = len(codes)
+		# One word more than needed, so that the end of the sequence always
+		# falls into a word.
+		nwords = len(codes) // WORD_BASES + 1
+		bits = numpy.zeros(nwords * WORD_BASES, dtype=numpy.uint8)
+		bits[:len(codes)] = _IS_GC[codes]
+		# The first base of a word is its highest bit.
+		self.words = numpy.packbits(bits).view(">u4").astype(numpy.uint32)
+		dtype = numpy.uint32 if len(codes) < 2 ** 32 else numpy.int64
+		self.before = numpy.zeros(nwords, dtype=dtype)
+		numpy.cumsum(_popcount(self.words[:-1]), dtype=dtype, out=self.before[1:])
+
+	def cumulative(self, x):
+		"""GC counts of seq[:x] for an array of positions `x`."""
+		x = numpy.asarray(x, dtype=numpy.int64)
+		w = x // WORD_BASES
+		r = (x % WORD_BASES).astype(numpy.uint32)
+		partial = _popcount(self.words[w] >> ((WORD_BASES - r) % WORD_BASES))
+		return self.before[w].astype(numpy.int64) + numpy.where(r > 0, partial, 0)
+
+	def nbytes(self):
+		"""Memory taken by the index."""
+		return self.words.nbytes + self.before.nbytes
+
+
+class GCWindows(object):
+	"""
+	GC index of reference windows, e.g. around the probe matches of Wessim2.
+
+	Overlapping windows are merged, so every fragment lies in at most one
+	window. The windows of a chromosome are indexed together by one
+	`GCBits`, a quarter of a byte per base of the merged windows. Fragments
+	that do not lie entirely in a window have to be counted from their
+	sequence.
+	"""
+
+	def __init__(self, fetch, windows):
+		"""
+		Args:
+			fetch: Function (chrom, start, end) -> sequence string, e.g. the
+				`fetch` method of a pysam Fastafile.
+			windows: List of (chrom, start, end) windows.
+		"""
+		self.starts = {}
+		self.ends = {}
+		self.offsets = {}
+		self.bits = {}
+		bychrom = {}
+		for chrom, start, end in windows:
+			bychrom.setdefault(chrom, []).append((max(start, 0), end))
+		for chrom, intervals in bychrom.items():
+			intervals.sort()
+			merged = [list(intervals[0])]
+			for start, end in intervals[1:]:
+				if start <= merged[-1][1]:
+					merged[-1][1] = max(merged[-1][1], end)
+				else:
+					merged.append([start, end])
+			starts, ends, offsets, seqs = [], [], [], []
+			offset = 0
+			for start, end in merged:
+				seq = fetch(chrom, start, end)
+				starts.append(start)
+				# The reference can end before the window does.
+				ends.append(start + len(seq))
+				offsets.append(offset)
+				offset += len(seq)
+				seqs.append(seq)
+			self.starts[chrom] = numpy.array(starts, dtype=numpy.int64)
+			self.ends[chrom] = numpy.array(ends, dtype=numpy.int64)
+			self.offsets[chrom] = numpy.array(offsets, dtype=numpy.int64)
+			self.bits[chrom] = GCBits("".join(seqs))
+
+	def nbytes(self):
+		"""Memory taken by the indices of all the windows."""
+		return sum(bits.nbytes() for bits in self.bits.values())
+
+	def counts(self, chrom, starts, ends):
+		"""
+		GC counts of the fragments chrom:starts-ends.
+
+		Args:
+			chrom: Chromosome of all the fragments.
+			starts, ends: Arrays of the fragment coordinates.
+
+		Returns:
+			An int64 array of the GC counts, with -1 for the fragments that
+			are not in a window.
+		"""
+		starts = numpy.asarray(starts, dtype=numpy.int64)
+		ends = numpy.asarray(ends, dtype=numpy.int64)
+		result = numpy.zeros(len(starts), dtype=numpy.int64) - 1
+		wstarts = self.starts.get(chrom)
+		if wstarts is None or not len(starts):
+			return result
+		w = numpy.searchsorted(wstarts, starts, side="right") - 1
+		inside = (w >= 0) & (starts <= ends)
+		inside &= ends <= self.ends[chrom][numpy.maximum(w, 0)]
+		w = w[inside]
+		shift = self.offsets[chrom][w] - wstarts[w]
+		bits = self.bits[chrom]
+		result[inside] = (bits.cumulative(ends[inside] + shift) -
+			bits.cumulative(starts[inside] + shift))
+		return result
+
+	def count(self, chrom, start, end):
+		"""GC count of chrom:start-end, or None if it is not in a window."""
+		n = int(self.counts(chrom, [start], [end])[0])
+		return None if n < 0 else n
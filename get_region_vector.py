@@ -1,6 +1,9 @@
 #!/usr/bin/env python2
 """
 Generates a FASTA file from a set of regions
+
+Optionally also writes the regions as a packed, memory-mappable target store
+(see target_store.py) for Wessim1.py --target-store.
 """
 
 import os
@@ -9,6 +12,8 @@ import sys
 import subprocess
 import pysam
 
+import target_store
+
 __author__ = "Fong Chun Chan <fongchun@alumni.ubc.ca>"
 __script_examples__="""
 Examples:
@@ -48,6 +53,9 @@ def main(args):
     # Output files
     wfa = open(parameters.target_fasta_file, 'w')
     wabd = open(parameters.target_abd_file, 'w')
+    store = None
+    if parameters.target_store:
+        store = target_store.TargetStoreWriter(parameters.target_store)
 
     # Running sum of the target space length
     abd = 0
@@ -81,9 +89,15 @@ def main(args):
             else:
                 # If there are no RCE values to use, then we just output 1 as a
                 # placeholder
+                target_rce = 1
                 wabd.write(str(abd) + "\t" + str(1) + "\n")
 
+            if store is not None:
+                store.add(chrom, start, end, x, target_rce)
+
     f.close()
+    if store is not None:
+        store.close()
     wfa.close()
     wabd.close()
 
@@ -143,6 +157,13 @@ def parse_args(args):
         required = True
     )
 
+    parser.add_argument(
+        "--target-store",
+        help = "Directory of the packed target store that will be generated "
+            "(optional)",
+        required = False
+    )
+
     parser.add_argument(
         "--slack",
         help = "Slack margin of the given boundaries [%(default)s]",
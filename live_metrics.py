@@ -0,0 +1,235 @@
+"""
+Live progress of a run, for `--metrics-port` and `--status-file`.
+
+After every chunk, a worker sends its counters (reads generated, fragments
+rejected, ...) to the main program over a queue. The main program also
+counts the reads it has written, and serves the totals, the rate in reads
+per second, the estimated time left and, for every worker, how long ago it
+last finished a chunk and how far it is behind the others:
+
+	* as Prometheus text on http://127.0.0.1:PORT/metrics, and
+	* as JSON in a status file, rewritten every `--status-interval` seconds.
+
+Like the reports of `run_report`, the queue is module state set up by the
+main program before it forks the workers, which inherit it. Unless `start`
+was called, `enabled` is False and `send` does nothing.
+"""
+
+import BaseHTTPServer
+import json
+import multiprocessing
+import os
+import Queue
+import threading
+from time import time
+
+# Queue of (worker id, time, counters) from the workers.
+_queue = None
+
+
+def enabled():
+	"""Whether the workers should send their progress."""
+	return _queue is not None
+
+
+def send(subid, counters):
+	"""Send the counters of worker `subid` to the main program."""
+	if _queue is not None:
+		_queue.put((subid, time(), dict(counters)))
+
+
+def rejected(counters):
+	"""Number of rejected fragments and failed reads in `counters`."""
+	return sum(n for name, n in counters.items()
+		if name.startswith("rejected_") or name == "failed_errors")
+
+
+class _Worker(object):
+	"""What the main program knows about the progress of one worker."""
+
+	def __init__(self):
+		self.generated = 0
+		self.rejected = 0
+		self.updated = None
+
+
+class Monitor(object):
+	"""
+	Collects the progress of the workers and publishes it.
+
+	Args:
+		chunks: (readstart, readend) ranges of the chunks, as returned by
+			`stream_writer.planChunks`, in the order they are written.
+		workers: Number of workers.
+		port: Port of the HTTP endpoint on 127.0.0.1, or None.
+		status: Path of the status file, or None.
+		interval: Seconds between two writes of the status file.
+	"""
+
+	def __init__(self, chunks, workers, port=None, status=None, interval=10.0):
+		self.chunks = chunks
+		self.total = sum(end - start + 1 for start, end in chunks)
+		self.workers = [_Worker() for t in range(0, workers)]
+		self.written = 0
+		self.port = port
+		self.status = status
+		self.interval = interval
+		self.lock = threading.Lock()
+		self.queue = multiprocessing.Queue()
+		self.consumed = 0
+		self.started = time()
+		self.done = False
+		self.server = None
+		self.thread = None
+
+	def start(self):
+		"""Start taking progress from the workers. Call it before forking them."""
+		global _queue
+		_queue = self.queue
+		if self.port is not None:
+			monitor = self
+
+			class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+				def do_GET(self):
+					if self.path.split("?")[0] not in ("/", "/metrics"):
+						self.send_error(404)
+						return
+					body = monitor.prometheus()
+					self.send_response(200)
+					self.send_header("Content-Type", "text/plain; version=0.0.4")
+					self.send_header("Content-Length", str(len(body)))
+					self.end_headers()
+					self.wfile.write(body)
+
+				def log_message(self, *args):
+					pass
+
+			self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", self.port), Handler)
+			server = threading.Thread(target=self.server.serve_forever)
+			server.daemon = True
+			server.start()
+		self.thread = threading.Thread(target=self._collect)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _collect(self):
+		"""Thread taking the progress messages off the queue."""
+		last = time()
+		while not self.done:
+			try:
+				subid, when, counters = self.queue.get(True, min(self.interval, 1.0))
+			except Queue.Empty:
+				pass
+			else:
+				with self.lock:
+					self._update(subid, when, counters)
+			if self.status is not None and time() - last >= self.interval:
+				self.writeStatus()
+				last = time()
+
+	def _update(self, subid, when, counters):
+		w = self.workers[subid - 1]
+		w.generated = counters.get("reads", 0)
+		w.rejected = rejected(counters)
+		w.updated = when
+
+	def consumer(self, consume):
+		"""Wrap `consume` of `worker_pool.runWorkers` to count the reads written."""
+		def counted(chunk):
+			consume(chunk)
+			with self.lock:
+				start, end = self.chunks[self.consumed]
+				self.written += end - start + 1
+				self.consumed += 1
+		return counted
+
+	def snapshot(self):
+		"""The progress of the run and of every worker, as a dict."""
+		with self.lock:
+			now = time()
+			elapsed = now - self.started
+			total = self.total
+			generated = sum(w.generated for w in self.workers)
+			rate = generated / elapsed if elapsed > 0 else 0.0
+			eta = None
+			if rate > 0:
+				eta = max(total - generated, 0) / rate
+			# Workers take chunks as they go, so they all generate about the
+			# same number of reads unless one is slower. A worker's lag is how
+			# many reads it is behind the average worker.
+			mean = float(generated) / len(self.workers)
+			workers = []
+			for t, w in enumerate(self.workers):
+				workers.append({
+					"worker": t + 1,
+					"reads_generated": w.generated,
+					"rejected": w.rejected,
+					"lag_reads": max(int(mean) - w.generated, 0),
+					"secs_since_update": now - (w.updated if w.updated is not None else self.started),
+				})
+			return {
+				"done": self.done,
+				"elapsed_secs": elapsed,
+				"reads_total": total,
+				"reads_generated": generated,
+				"reads_written": self.written,
+				"rejected": sum(w.rejected for w in self.workers),
+				"reads_per_sec": rate,
+				"eta_secs": eta,
+				"workers": workers,
+			}
+
+	def prometheus(self):
+		"""The snapshot in the Prometheus text exposition format."""
+		s = self.snapshot()
+		lines = []
+
+		def metric(name, kind, doc, values):
+			lines.append("# HELP wessim_%s %s" % (name, doc))
+			lines.append("# TYPE wessim_%s %s" % (name, kind))
+			for labels, value in values:
+				lines.append("wessim_%s%s %s" % (name, labels, repr(float(value))))
+
+		metric("reads_total", "gauge", "Reads to generate.", [("", s["reads_total"])])
+		metric("reads_generated", "counter", "Reads generated.", [("", s["reads_generated"])])
+		metric("reads_written", "counter", "Reads written to the output.", [("", s["reads_written"])])
+		metric("rejected", "counter", "Fragments rejected and reads dropped.", [("", s["rejected"])])
+		metric("reads_per_second", "gauge", "Reads generated per second since the start.", [("", s["reads_per_sec"])])
+		if s["eta_secs"] is not None:
+			metric("eta_seconds", "gauge", "Estimated seconds until all reads are generated.", [("", s["eta_secs"])])
+		metric("done", "gauge", "1 once all reads are written.", [("", int(s["done"]))])
+		for field, name, kind, doc in (
+				("reads_generated", "worker_reads_generated", "counter", "Reads generated by the worker."),
+				("rejected", "worker_rejected", "counter", "Fragments rejected and reads dropped by the worker."),
+				("lag_reads", "worker_lag_reads", "gauge", "Reads the worker is behind the average worker."),
+				("secs_since_update", "worker_seconds_since_update", "gauge", "Seconds since the worker last finished a chunk.")):
+			metric(name, kind, doc,
+				[('{worker="%d"}' % w["worker"], w[field]) for w in s["workers"]])
+		return "\n".join(lines) + "\n"
+
+	def writeStatus(self):
+		"""Replace the status file with the current snapshot."""
+		tmp = self.status + ".tmp"
+		with open(tmp, "w") as f:
+			json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+		os.rename(tmp, self.status)
+
+	def close(self):
+		"""Stop collecting, write the last status file and stop the endpoint."""
+		global _queue
+		self.done = True
+		if self.thread is not None:
+			self.thread.join()
+		# Progress still queued by the workers is taken in here.
+		while True:
+			try:
+				subid, when, counters = self.queue.get_nowait()
+			except Queue.Empty:
+				break
+			self._update(subid, when, counters)
+		if self.status is not None:
+			self.writeStatus()
+		if self.server is not None:
+			self.server.shutdown()
+			self.server.server_close()
+		_queue = None
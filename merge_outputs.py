@@ -0,0 +1,117 @@
+"""
+Output file names, and the merge of the FASTQ files of several runs
+
+The outputs of the shards of a `--shard i/N` simulation are joined by
+concat_shards.py at the byte level: concatenated gzip members are a valid
+gzip file, so compressed parts are neither decompressed nor compressed
+again. The end-of-file blocks of BGZF parts are dropped so that the merged
+file has only one.
+"""
+
+import os
+
+import bgzf
+
+# Size of the buffer used when the parts cannot be copied with sendfile.
+COPY_BUFFER = 4 * 1024 * 1024
+
+
+def outputNames(outfile, paired, compress, subid=None):
+	"""
+	File names of the final output, or of the output of worker `subid`.
+
+	Returns:
+		A list with one name for single-end reads and two for paired reads.
+	"""
+	if subid is not None:
+		outfile = outfile + "-" + str(subid)
+	suffix = ".fastq.gz" if compress else ".fastq"
+	if paired:
+		return [outfile + "_1" + suffix, outfile + "_2" + suffix]
+	return [outfile + suffix]
+
+
+def _copyFile(src, dst, size):
+	"""Append the first `size` bytes of file object `src` to file object `dst`."""
+	sendfile = getattr(os, "sendfile", None)
+	if sendfile is not None:
+		dst.flush()
+		offset = 0
+		try:
+			while offset < size:
+				sent = sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+				if sent == 0:
+					break
+				offset += sent
+			return
+		except OSError:
+			# sendfile is not supported for these files. Copy the rest below.
+			src.seek(offset)
+			size -= offset
+	while size > 0:
+		data = src.read(min(COPY_BUFFER, size))
+		if not data:
+			break
+		dst.write(data)
+		size -= len(data)
+
+
+def _partSize(rfile, trailer):
+	"""Size of an open part without `trailer`, if the part ends with it."""
+	size = os.fstat(rfile.fileno()).st_size
+	if trailer and size >= len(trailer):
+		rfile.seek(size - len(trailer))
+		if rfile.read() == trailer:
+			size -= len(trailer)
+		rfile.seek(0)
+	return size
+
+
+def concatenateFiles(parts, dest, remove=True, trailer=None):
+	"""
+	Join `parts` byte by byte into `dest`.
+
+	Args:
+		parts: Names of the files to join, in order.
+		dest: Name of the joined file. It is overwritten.
+		remove: Delete the parts afterwards.
+		trailer: Bytes that end every part, such as the BGZF end-of-file
+			block. They are dropped from the parts and written once at the
+			end.
+	"""
+	if remove and len(parts) == 1:
+		os.rename(parts[0], dest)
+		return
+	with open(dest, "wb") as wfile:
+		for part in parts:
+			with open(part, "rb") as rfile:
+				_copyFile(rfile, wfile, _partSize(rfile, trailer))
+		if trailer:
+			wfile.write(trailer)
+	if remove:
+		for part in parts:
+			os.remove(part)
+
+
+def mergeShards(outfile, shards, paired, compress):
+	"""
+	Join the outputs of the shards of a `--shard i/N` simulation.
+
+	The shards are kept. Their BGZF end-of-file blocks are dropped, so the
+	joined files are identical to those of the whole simulation run at once.
+
+	Args:
+		outfile: Output file header of the joined files.
+		shards: Output file headers of shards 1..N, in order.
+		paired: Join the two files of paired reads. Interleaved shards are a
+			single file each.
+		compress: The shards are BGZF-compressed.
+
+	Returns:
+		The names of the joined files.
+	"""
+	finals = outputNames(outfile, paired, compress)
+	for i, final in enumerate(finals):
+		parts = [outputNames(shard, paired, compress)[i] for shard in shards]
+		concatenateFiles(parts, final, remove=False, trailer=bgzf.EOF_MARKER if compress else None)
+	return finals
@@ -0,0 +1,64 @@
+"""
+Reproducible random number streams.
+
+Without `--seed`, every call of `seedStreams` reseeds `random` and
+`numpy.random` from the operating system, as forked workers must not share
+the state they inherited. With `--seed`, the state is derived from the seed
+and a key instead. The workers key it by the first read id of each chunk,
+and chunks always cover the same read ids (see `stream_writer.planChunks`),
+so a read comes out the same whatever the number of workers and whichever
+worker takes its chunk, and any chunk can be regenerated on its own.
+
+NumPy's `Generator`/PCG64 streams need NumPy 1.17, which does not support
+Python 2. Both generators are seeded through `RandomState` instead, whose
+Mersenne Twister is initialized from the whole (seed, key) array.
+"""
+
+import binascii
+import random
+
+import numpy
+
+# Keys of streams that are not read chunks. Read ids start at 1.
+CALIBRATION_KEY = 0
+
+
+def _words(values):
+	"""
+	Split non-negative integers into 32-bit words, lowest first.
+
+	Every integer is preceded by its number of words, so that different
+	tuples never give the same array.
+	"""
+	words = []
+	for v in values:
+		v = int(v)
+		if v < 0:
+			raise ValueError("seeds and keys must not be negative: %d" % v)
+		parts = [v & 0xffffffff]
+		v >>= 32
+		while v:
+			parts.append(v & 0xffffffff)
+			v >>= 32
+		words.append(len(parts))
+		words.extend(parts)
+	return words
+
+
+def seedStreams(seed, key):
+	"""
+	Seed `random` and `numpy.random` for the stream `key` of `seed`.
+
+	Args:
+		seed: Value of `--seed`, or None to seed from the operating system.
+		key: Non-negative integer naming the stream, e.g. the first read id
+			of a chunk.
+	"""
+	if seed is None:
+		random.seed()
+		numpy.random.seed()
+		return
+	state = numpy.random.RandomState(_words([seed, key]))
+	numpy.random.set_state(state.get_state())
+	# 128 bits for the generator of `random`.
+	random.seed(int(binascii.hexlify(state.bytes(16)), 16))
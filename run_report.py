@@ -0,0 +1,200 @@
+"""
+Per-stage timers and counters, and the JSON run report of `--report`.
+
+The main program and every worker record the wall time spent in each hot
+stage (model load, target load, GC calibration, fragment sampling, GC-bias
+filter, sequencing errors, serialization, compression and the merge into
+the output) and count reads and rejections. Workers write their records to
+`<report>.worker<t>.json`, and the main program writes them all to
+`<report>` with a summary that adds them up.
+
+Code being measured asks `current()` for the report of its process. Unless
+`start` was called, that is a `NullReport`, which records nothing, so the
+hooks cost next to nothing when no report is asked for. Workers always start
+one, as their counters are also printed at the end and sent to the live
+metrics; they write it to a file only with `--report`.
+"""
+
+import json
+import resource
+from time import time
+
+
+class _NullStage(object):
+	"""Context manager that does nothing."""
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+_NULL_STAGE = _NullStage()
+
+
+class NullReport(object):
+	"""Report that records nothing."""
+
+	enabled = False
+
+	def stage(self, name):
+		return _NULL_STAGE
+
+	def add(self, name, secs, calls=1):
+		pass
+
+	def count(self, name, n=1):
+		pass
+
+
+class _Stage(object):
+	"""Context manager adding the time spent in it to a stage of a report."""
+
+	def __init__(self, report, name):
+		self.report = report
+		self.name = name
+
+	def __enter__(self):
+		self.t0 = time()
+		return self
+
+	def __exit__(self, *exc):
+		self.report.add(self.name, time() - self.t0)
+		return False
+
+
+class StageReport(object):
+	"""
+	Times of the stages and counters of one process.
+
+	Args:
+		name: Name of the process in the report, e.g. "worker 3".
+	"""
+
+	enabled = True
+
+	def __init__(self, name):
+		self.name = name
+		self.stages = {}
+		self.counters = {}
+		self.extra = {}
+		self.started = time()
+
+	def stage(self, name):
+		"""Context manager timing stage `name`."""
+		return _Stage(self, name)
+
+	def add(self, name, secs, calls=1):
+		"""Add `secs` seconds spent in `calls` calls of stage `name`."""
+		stage = self.stages.get(name)
+		if stage is None:
+			stage = self.stages[name] = [0.0, 0]
+		stage[0] += secs
+		stage[1] += calls
+
+	def count(self, name, n=1):
+		"""Add `n` to counter `name`."""
+		self.counters[name] = self.counters.get(name, 0) + n
+
+	def asDict(self):
+		"""The report as a dict that can be written as JSON."""
+		report = {
+			"name": self.name,
+			"wall_secs": time() - self.started,
+			"peak_rss_mb": peakRss(),
+			"stages": dict((name, {"secs": secs, "calls": calls})
+				for name, (secs, calls) in self.stages.items()),
+			"counters": dict(self.counters),
+		}
+		report.update(self.extra)
+		return report
+
+
+_current = NullReport()
+
+
+def current():
+	"""The report of this process."""
+	return _current
+
+
+def start(name):
+	"""
+	Start recording the report of this process.
+
+	Workers call this after they are forked, so that they do not go on with
+	the report of the main program.
+	"""
+	global _current
+	_current = StageReport(name)
+	return _current
+
+
+def peakRss(who=resource.RUSAGE_SELF):
+	"""
+	Peak resident set size in MB.
+
+	Args:
+		who: resource.RUSAGE_SELF, or RUSAGE_CHILDREN for the largest of
+			the subprocesses waited for.
+	"""
+	# ru_maxrss is in kilobytes on Linux.
+	return resource.getrusage(who).ru_maxrss / 1024.0
+
+
+def workerReportName(report, subid):
+	"""File name of the report of worker `subid`."""
+	return "%s.worker%d.json" % (report, subid)
+
+
+def workerProfileName(report, subid):
+	"""File name of the cProfile statistics of worker `subid`."""
+	return "%s.worker%d.prof" % (report, subid)
+
+
+def writeJSON(path, data):
+	"""Write `data` to `path` as JSON."""
+	with open(path, "w") as f:
+		json.dump(data, f, indent=2, sort_keys=True)
+
+
+def summarize(reports):
+	"""
+	Add up the stages and counters of several process reports.
+
+	The seconds of a stage are summed over the processes, and `fraction` is
+	their share of the seconds of all the stages.
+	"""
+	stages = {}
+	counters = {}
+	for report in reports:
+		for name, stage in report["stages"].items():
+			total = stages.setdefault(name, {"secs": 0.0, "calls": 0})
+			total["secs"] += stage["secs"]
+			total["calls"] += stage["calls"]
+		for name, n in report["counters"].items():
+			counters[name] = counters.get(name, 0) + n
+	secs = sum(stage["secs"] for stage in stages.values())
+	for stage in stages.values():
+		stage["fraction"] = stage["secs"] / secs if secs > 0 else 0.0
+	return {"stages": stages, "counters": counters}
+
+
+def writeRunReport(path, report, threadnumber):
+	"""
+	Write the run report: the main program's, the workers' and a summary.
+
+	Args:
+		path: Value of `--report`.
+		report: `StageReport` of the main program.
+		threadnumber: Number of workers.
+	"""
+	main = report.asDict()
+	workers = []
+	for t in range(0, threadnumber):
+		with open(workerReportName(path, t + 1)) as f:
+			workers.append(json.load(f))
+	summary = summarize([main] + workers)
+	summary["wall_secs"] = main["wall_secs"]
+	summary["peak_rss_mb"] = max([main["peak_rss_mb"]] + [w["peak_rss_mb"] for w in workers])
+	writeJSON(path, {"main": main, "workers": workers, "summary": summary})
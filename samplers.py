@@ -0,0 +1,98 @@
+"""
+Alias-method samplers.
+
+Walker's alias method turns a discrete distribution over K outcomes into two
+tables of length K, after which every draw costs O(1): one uniform picks a
+column and a comparison picks either the column or its alias. Unlike the
+`bisect_choice` closures of the sub-programs, draws are vectorized over
+NumPy arrays.
+"""
+
+import numpy
+
+
+def aliasTable(weights):
+	"""
+	Build the alias table of a discrete distribution (Vose's algorithm).
+
+	Args:
+		weights: Non-negative weights of the K outcomes. They do not have to
+			sum to one, but at least one of them must be positive.
+
+	Returns:
+		A tuple (prob, alias) of a float64 and an int32 array of length K.
+	"""
+	w = numpy.asarray(weights, dtype=float)
+	k = len(w)
+	scaled = (w * k / w.sum()).tolist()
+	prob = numpy.ones(k)
+	alias = numpy.arange(k, dtype=numpy.int32)
+	small = [i for i in range(k) if scaled[i] < 1.0]
+	large = [i for i in range(k) if scaled[i] >= 1.0]
+	while small and large:
+		s = small.pop()
+		l = large.pop()
+		prob[s] = scaled[s]
+		alias[s] = l
+		scaled[l] = scaled[l] + scaled[s] - 1.0
+		if scaled[l] < 1.0:
+			small.append(l)
+		else:
+			large.append(l)
+	# Whatever is left over is 1 up to rounding errors.
+	return prob, alias
+
+
+def aliasDraw(prob, alias, rnd):
+	"""
+	Draw outcomes from one or more alias tables.
+
+	Args:
+		prob, alias: Alias tables, either 1-D or 2-D with one table per row.
+		rnd: Uniform numbers in [0, 1), one per draw.
+
+	Returns:
+		The drawn outcome indices. For 2-D tables, draw j is made from the
+		table in row j of `prob` and `alias`.
+	"""
+	k = prob.shape[-1]
+	u = rnd * k
+	col = numpy.minimum(u.astype(numpy.int64), k - 1)
+	frac = u - col
+	if prob.ndim == 1:
+		return numpy.where(frac < prob[col], col, alias[col])
+	rows = numpy.arange(len(col))
+	return numpy.where(frac < prob[rows, col], col, alias[rows, col])
+
+
+class AliasSampler(object):
+	"""
+	Sampler of a fixed discrete distribution.
+
+	Args:
+		weights: Non-negative weights of the outcomes.
+	"""
+
+	def __init__(self, weights):
+		self.prob, self.alias = aliasTable(weights)
+
+	def draw(self, n, rng=numpy.random):
+		"""Draw `n` outcome indices."""
+		return aliasDraw(self.prob, self.alias, rng.random_sample(n))
+
+	def chunks(self, size, total=None, rng=numpy.random):
+		"""
+		Yield draws in arrays of `size` outcome indices.
+
+		Only one chunk is held at a time, however many draws are made.
+
+		Args:
+			size: Number of draws per chunk.
+			total: Total number of draws; the last chunk may be shorter.
+				Chunks are yielded forever if it is None.
+		"""
+		while total is None or total > 0:
+			n = size if total is None else min(size, total)
+			yield self.draw(n, rng)
+			if total is not None:
+				total -= n
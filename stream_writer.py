@@ -0,0 +1,410 @@
+"""
+Ordered streaming of FASTQ records from the Wessim workers to one writer
+
+The reads are split into chunks of `CHUNK_READS` consecutive read ids. The
+main process hands them out to the workers on demand, as tasks of one or
+more consecutive chunks on a queue shared by all workers, so a worker that
+is slowed down by rejections or a busy core simply takes fewer chunks (see
+`ChunkScheduler`). A worker generates each chunk into memory and sends it
+back. The main process puts the chunks back into read-id order and writes
+them straight into the final files. The output is in read-id order, nothing
+is written twice, and the first reads are on disk while the rest are still
+being generated. Every chunk is generated from its own random stream (see
+`random_streams`), so with `--seed` the output does not depend on which
+worker generated which chunk.
+
+With `--interleaved`, both reads of a pair go one after the other into one
+stream, which can be stdout (`-o -`) or a named pipe, so that an aligner can
+read them while the simulation runs. No more than a fixed number of chunks
+are handed out ahead of the writer, which keeps the memory use fixed when
+the reader is slower than the workers.
+
+With `-z`, every worker compresses its own chunks in a background thread,
+so compression is spread over the workers and overlaps with generation.
+"""
+
+import cProfile
+import os
+import Queue
+import stat
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
+from time import time
+
+import bgzf
+import live_metrics
+import merge_outputs
+import run_report
+
+# Reads per chunk handed from a worker to the writer. Chunks are also the
+# units of the random streams, so changing this changes the reads of a seed.
+CHUNK_READS = 10000
+
+# Seconds of work a task should take at the observed rate of the workers.
+TASK_SECS = 5.0
+
+# Chunks that may be handed out ahead of the writer, per worker. A task is
+# at most half of this, so that a worker can take its next task while the
+# writer waits for the others.
+WINDOW_CHUNKS = 6
+
+# A worker prints its progress every time it has generated this many reads.
+PROGRESS_READS = 1000000
+
+
+class ChunkBuffer(object):
+	"""File-like object that collects what is written to it in memory."""
+
+	def __init__(self):
+		self.parts = []
+
+	def write(self, data):
+		self.parts.append(data)
+
+	def getvalue(self):
+		"""Return everything written so far and empty the buffer."""
+		value = "".join(self.parts)
+		self.parts = []
+		return value
+
+	def close(self):
+		pass
+
+
+def planChunks(readnumber, chunkreads=CHUNK_READS, readstart=1):
+	"""
+	Split reads `readstart`..`readnumber` into chunks.
+
+	Chunks start at read ids 1, 1 + `chunkreads`, ... whatever `readstart`
+	is, as long as it is one of these, so the chunks of a shard (see
+	`shardRange`) are the chunks of the whole simulation.
+
+	Returns:
+		A list of the (readstart, readend) ranges of the chunks, in read-id
+		order.
+	"""
+	chunks = []
+	for start in range(readstart, readnumber + 1, chunkreads):
+		chunks.append((start, min(start + chunkreads - 1, readnumber)))
+	return chunks
+
+
+def parseShard(text):
+	"""
+	Parse a `--shard` value "i/N", with 1 <= i <= N.
+
+	Returns:
+		A tuple (i, N).
+
+	Raises:
+		ValueError: If `text` is not such a value.
+	"""
+	try:
+		shard, shards = [int(v) for v in text.split("/")]
+	except ValueError:
+		raise ValueError("expected i/N, got %r" % text)
+	if not 1 <= shard <= shards:
+		raise ValueError("expected 1 <= i <= N, got %r" % text)
+	return shard, shards
+
+
+def shardRange(readnumber, shard, shards, chunkreads=CHUNK_READS):
+	"""
+	Read ids of shard `shard` of `shards` of a simulation of `readnumber` reads.
+
+	The chunks of the simulation are split into `shards` contiguous runs of
+	nearly equal length. The outputs of shards 1..`shards`, concatenated,
+	are the output of the whole simulation run at once (with `--seed`).
+
+	Returns:
+		A tuple (readstart, readend). The shard is empty if readstart >
+		readend, which happens when there are fewer chunks than shards.
+	"""
+	nchunks = (readnumber + chunkreads - 1) // chunkreads
+	first = (shard - 1) * nchunks // shards
+	last = shard * nchunks // shards
+	return first * chunkreads + 1, min(last * chunkreads, readnumber)
+
+
+class ChunkScheduler(object):
+	"""
+	Hands out chunks to the workers on demand and puts them back in order.
+
+	Used as the scheduler of `worker_pool.runWorkers`. A task is a list of
+	(index, readstart, readend) of consecutive chunks, sized so that it takes
+	about `TASK_SECS` at the rate the workers have reached so far, and
+	smaller towards the end, so that the workers finish together: no task
+	is more than half of a fair share of the chunks left. Results are
+	(index, chunk) and are released in index order. At most `window` chunks
+	are handed out ahead of the writer.
+
+	Args:
+		chunks: (readstart, readend) ranges from `planChunks`.
+		workers: Number of workers.
+		window: Chunks handed out ahead of the writer [WINDOW_CHUNKS per
+			worker].
+	"""
+
+	def __init__(self, chunks, workers, window=None):
+		self.chunks = chunks
+		self.workers = workers
+		self.window = window if window is not None else WINDOW_CHUNKS * workers
+		self.issued = 0
+		self.written = 0
+		self.pending = {}
+		self.started = None
+		self.closed = False
+
+	def taskSize(self):
+		"""Number of chunks of the next task."""
+		size = 1
+		done = self.written + len(self.pending)
+		elapsed = time() - self.started
+		if done > 0 and elapsed > 0:
+			perWorker = done / elapsed / self.workers
+			size = max(int(TASK_SECS * perWorker), 1)
+		left = len(self.chunks) - self.issued
+		size = min(size, max(left // (2 * self.workers), 1), max(self.window // 2, 1))
+		return min(size, left)
+
+	def fill(self, tasks):
+		"""Put tasks on `tasks` until the window is full, and None for every
+		worker once all chunks are handed out."""
+		if self.started is None:
+			self.started = time()
+		while self.issued < len(self.chunks):
+			end = self.issued + self.taskSize()
+			if end - self.written > self.window:
+				break
+			tasks.put([(k,) + tuple(self.chunks[k]) for k in range(self.issued, end)])
+			self.issued = end
+		if self.issued == len(self.chunks) and not self.closed:
+			for t in range(0, self.workers):
+				tasks.put(None)
+			self.closed = True
+
+	def collect(self, result):
+		"""Take the result of a chunk and return the chunks now due, in order."""
+		index, chunk = result
+		self.pending[index] = chunk
+		due = []
+		while self.written in self.pending:
+			due.append(self.pending.pop(self.written))
+			self.written += 1
+		return due
+
+	def finished(self):
+		"""Whether all chunks have been released."""
+		return self.written == len(self.chunks)
+
+
+class ChunkCompressor(threading.Thread):
+	"""
+	Background thread of a worker that compresses and sends its chunks.
+
+	The generation thread hands each finished (index, chunk) over with `put`
+	and goes on with the next one while this thread compresses the last one
+	into BGZF blocks and puts it on the queue to the writer. zlib releases the GIL, so
+	both run at the same time. At most one chunk waits for the thread, so a
+	worker holds at most two chunks in memory.
+	"""
+
+	def __init__(self, queue, level, threads):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.queue = queue
+		self.level = level
+		self.threads = threads
+		self.handoff = Queue.Queue(1)
+		self.busy = 0.0
+		self.error = None
+
+	def put(self, chunk):
+		if self.error is not None:
+			raise self.error[0], self.error[1], self.error[2]
+		self.handoff.put(chunk)
+
+	def run(self):
+		pool = ThreadPool(self.threads) if self.threads > 1 else None
+		try:
+			chunk = self.handoff.get()
+			while chunk is not None:
+				t0 = time()
+				index, (data1, data2) = chunk
+				self.queue.put((index, (
+					bgzf.compressChunk(data1, self.level, pool),
+					bgzf.compressChunk(data2, self.level, pool))))
+				self.busy += time() - t0
+				chunk = self.handoff.get()
+		except Exception:
+			self.error = sys.exc_info()
+			# Keep draining so that the generation thread does not block.
+			while self.handoff.get() is not None:
+				pass
+		finally:
+			if pool is not None:
+				pool.close()
+				pool.join()
+
+	def finish(self):
+		"""Wait for the last chunk and re-raise an error of the thread."""
+		self.handoff.put(None)
+		self.join()
+		if self.error is not None:
+			raise self.error[0], self.error[1], self.error[2]
+
+
+def streamChunks(generate, args, shared, subid, tasks, queue):
+	"""
+	Worker: generate the chunks of `tasks` with `generate` and put them on
+	`queue`.
+
+	With `-z` the chunks are compressed into BGZF blocks by a
+	`ChunkCompressor` thread of the worker while the next chunk is generated.
+	The time spent generating, and waiting for or doing compression and I/O,
+	is printed at the end, with the fragments and reads that were rejected
+	on the way, and the reads generated so far every `PROGRESS_READS`. With `--report`, the worker's report is written
+	to a file of its own, and with `--profile-every N` every N-th chunk is
+	generated under cProfile. With `--metrics-port` or `--status-file`, the
+	worker's counters are sent to the main program after every chunk (see
+	`live_metrics`).
+
+	Args:
+		generate: Read generation function with the signature of
+			`__sub_wessim1.generateReads`.
+		args: Parsed arguments of the main program.
+		shared: Data loaded by the main program before forking.
+		subid: Worker id.
+		tasks: Queue of tasks from `ChunkScheduler`, ended by None.
+		queue: Queue of (index, chunk) read by the writer.
+	"""
+	# The counters of the report are always kept, for the rejections printed
+	# at the end and for the live metrics.
+	report = run_report.start("worker %d" % subid)
+	profiler = None
+	if args.report is not None and args.profile_every > 0:
+		profiler = cProfile.Profile()
+	buf1 = ChunkBuffer()
+	buf2 = ChunkBuffer()
+	if args.interleaved:
+		# The generation loop writes read 1 and then read 2 of every pair.
+		buf2 = buf1
+	sender = queue
+	if args.z:
+		sender = ChunkCompressor(queue, args.compress_level, args.compress_threads)
+		sender.start()
+	gentime = 0.0
+	waittime = 0.0
+	k = 0
+	reads = 0
+	t1 = time()
+	started = t1
+	task = tasks.get()
+	waittime += time() - t1
+	while task is not None:
+		for index, readstart, readend in task:
+			sample = profiler is not None and k % args.profile_every == 0
+			if sample:
+				profiler.enable()
+			t0 = time()
+			generate(args, shared, readstart, readend, subid, buf1, buf2)
+			t1 = time()
+			if sample:
+				profiler.disable()
+			if live_metrics.enabled():
+				live_metrics.send(subid, report.counters)
+			before = reads
+			reads = report.counters.get("reads", 0)
+			if reads // PROGRESS_READS > before // PROGRESS_READS:
+				print "[subprocess " + str(subid) + "]: " + str(reads) + " reads have been generated... in %f secs" % (t1 - started)
+			sender.put((index, (buf1.getvalue(), buf2.getvalue())))
+			gentime += t1 - t0
+			waittime += time() - t1
+			k += 1
+		t1 = time()
+		task = tasks.get()
+		waittime += time() - t1
+	if args.z:
+		t1 = time()
+		sender.finish()
+		waittime += time() - t1
+		report.add("compression", sender.busy, k)
+		print "[subprocess " + str(subid) + "]: generation %f secs, compression/IO %f secs (waited %f secs)" % (gentime, sender.busy, waittime)
+	else:
+		print "[subprocess " + str(subid) + "]: generation %f secs, IO %f secs" % (gentime, waittime)
+	rejections = ", ".join("%s %d" % (name, n) for name, n in sorted(report.counters.items())
+		if name.startswith("rejected_") or name == "failed_errors")
+	print "[subprocess " + str(subid) + "]: " + str(report.counters.get("reads", 0)) + " reads, rejected: " + (rejections or "none")
+	if args.report is not None:
+		# The stages of the generation are timed by `generate` itself.
+		report.extra["generation_secs"] = gentime
+		report.extra["wait_secs"] = waittime
+		report.count("chunks", k)
+		if profiler is not None:
+			report.extra["profile"] = run_report.workerProfileName(args.report, subid)
+			profiler.dump_stats(report.extra["profile"])
+		run_report.writeJSON(run_report.workerReportName(args.report, subid), report.asDict())
+
+
+class OrderedWriter(object):
+	"""
+	Writes the chunks taken from the workers into the output files.
+
+	`trailer` is written to every file when it is closed, e.g. the BGZF
+	end-of-file block after chunks that the workers already compressed.
+	"""
+
+	def __init__(self, wread, wread2=None, trailer=None):
+		self.wread = wread
+		self.wread2 = wread2
+		self.trailer = trailer
+
+	def __call__(self, chunk):
+		data1, data2 = chunk
+		self.wread.write(data1)
+		if self.wread2 is not None:
+			self.wread2.write(data2)
+
+	def close(self):
+		for w in (self.wread, self.wread2):
+			if w is not None and self.trailer:
+				w.write(self.trailer)
+			if w is sys.__stdout__:
+				w.flush()
+			elif w is not None:
+				w.close()
+
+
+def openWriter(outfile, paired, compress, interleaved):
+	"""
+	Open the final output of the main programs.
+
+	With `compress` the workers send BGZF blocks (see `streamChunks`), so the
+	writer only adds the end-of-file block.
+
+	Args:
+		outfile: Output file header from `-o`. "-" is stdout and an existing
+			named pipe is used as it is, without a suffix.
+		paired: Whether the reads are paired.
+		compress: Write BGZF instead of plain FASTQ.
+		interleaved: Write both reads of a pair into one stream.
+
+	Returns:
+		An `OrderedWriter`.
+	"""
+	if outfile == "-" or (os.path.exists(outfile) and stat.S_ISFIFO(os.stat(outfile).st_mode)):
+		if paired and not interleaved:
+			sys.exit("Paired reads can only be streamed to " + outfile + " with --interleaved.")
+		names = [sys.__stdout__ if outfile == "-" else outfile]
+	else:
+		names = merge_outputs.outputNames(outfile, paired and not interleaved, compress)
+	writers = []
+	for name in names:
+		if name is sys.__stdout__:
+			writers.append(name)
+		else:
+			writers.append(open(name, "wb" if compress else "w"))
+	if len(writers) == 1:
+		writers.append(None)
+	return OrderedWriter(writers[0], writers[1], bgzf.EOF_MARKER if compress else None)
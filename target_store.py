@@ -0,0 +1,155 @@
+"""
+Packed, memory-mappable store of the targets for Wessim1
+
+`get_region_vector.py` writes it next to the target FASTA and abd files. It
+is a directory holding:
+
+    sequences.bin   the target sequences concatenated, one byte per base
+    offsets.npy     int64 start of every target in sequences.bin, plus the end
+    targets.npy     structured array of chrom id, start, end, cumulative
+                    length and RCE of every target
+    index.json      format version, chromosome names and the target count
+
+The workers memory-map it, so opening it takes constant time and the pages
+are shared between processes however large the targets are.
+"""
+
+import json
+import os
+import shutil
+
+import numpy
+
+# Bump this when the layout of a store changes.
+STORE_FORMAT = 1
+
+TARGET_DTYPE = numpy.dtype([
+    ("chrom", numpy.int32),
+    ("start", numpy.int64),
+    ("end", numpy.int64),
+    ("cumlen", numpy.int64),
+    ("rce", numpy.float64),
+])
+
+
+class TargetStoreWriter(object):
+    """
+    Writes a target store one target at a time.
+
+    The sequences go straight to disk; only the per-target metadata is held
+    in memory until `close`.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        if os.path.isdir(store_dir):
+            shutil.rmtree(store_dir)
+        os.makedirs(store_dir)
+        self.seqfile = open(os.path.join(store_dir, "sequences.bin"), "wb")
+        self.chroms = []
+        self.chrom_ids = {}
+        self.offsets = [0]
+        self.targets = []
+
+    def add(self, chrom, start, end, seq, rce=1.0):
+        """Append a target with its sequence and relative capture efficiency."""
+        if chrom not in self.chrom_ids:
+            self.chrom_ids[chrom] = len(self.chroms)
+            self.chroms.append(chrom)
+        self.seqfile.write(seq)
+        self.offsets.append(self.offsets[-1] + len(seq))
+        self.targets.append(
+            (self.chrom_ids[chrom], start, end, self.offsets[-1], float(rce))
+        )
+
+    def close(self):
+        self.seqfile.close()
+        numpy.save(
+            os.path.join(self.store_dir, "offsets.npy"),
+            numpy.array(self.offsets, dtype = numpy.int64)
+        )
+        numpy.save(
+            os.path.join(self.store_dir, "targets.npy"),
+            numpy.array(self.targets, dtype = TARGET_DTYPE)
+        )
+        with open(os.path.join(self.store_dir, "index.json"), "w") as f:
+            json.dump({
+                "format": STORE_FORMAT,
+                "chroms": self.chroms,
+                "count": len(self.targets),
+            }, f)
+
+
+class _TargetTags(object):
+    """Read-only list of ("<chrom>_", start) of the targets of a store."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, i):
+        target = self.store.targets[i]
+        return self.store.chroms[target["chrom"]] + "_", int(target["start"])
+
+
+class TargetStore(object):
+    """
+    A memory-mapped target store.
+
+    Indexing it gives the same (header, sequence) tuples as reading the
+    target FASTA file, with the header "<chrom>_<start>_<end>".
+    """
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, "index.json")) as f:
+            index = json.load(f)
+        if index.get("format") != STORE_FORMAT:
+            raise ValueError(
+                "Target store " + store_dir + " has format " +
+                str(index.get("format")) + ", expected " + str(STORE_FORMAT) +
+                ". Run get_region_vector.py again."
+            )
+        self.chroms = [str(c) for c in index["chroms"]]
+        self.offsets = numpy.load(
+            os.path.join(store_dir, "offsets.npy"), mmap_mode = "r"
+        )
+        self.targets = numpy.load(
+            os.path.join(store_dir, "targets.npy"), mmap_mode = "r"
+        )
+        seqpath = os.path.join(store_dir, "sequences.bin")
+        if os.path.getsize(seqpath) > 0:
+            self.sequences = numpy.memmap(seqpath, dtype = numpy.uint8, mode = "r")
+        else:
+            self.sequences = numpy.zeros(0, dtype = numpy.uint8)
+        self.tags = _TargetTags(self)
+
+    def __len__(self):
+        return len(self.targets)
+
+    def sequence(self, i):
+        """The sequence of target `i` as a string."""
+        return self.sequences[self.offsets[i]:self.offsets[i + 1]].tostring()
+
+    def header(self, i):
+        target = self.targets[i]
+        return "%s_%d_%d" % (
+            self.chroms[target["chrom"]], target["start"], target["end"]
+        )
+
+    def __getitem__(self, i):
+        return self.header(i), self.sequence(i)
+
+
+def load_store(store_dir):
+    """
+    Open a target store written by `TargetStoreWriter`.
+
+    Args:
+        store_dir: Path of the store directory
+
+    Returns:
+        A `TargetStore`.
+    """
+    return TargetStore(store_dir)
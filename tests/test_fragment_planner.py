@@ -0,0 +1,67 @@
+"""
+Tests of fragment_planner.py
+
+Run them from the top directory with:
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fragment_planner
+
+
+class InsertSizeTableTest(unittest.TestCase):
+
+    def test_point_mass(self):
+        """With -d 0 every insert is the mean, or the minimum above it."""
+        table = fragment_planner.InsertSizeTable(200, 0, 120)
+        rnd = numpy.random.RandomState(1).random_sample(100)
+        self.assertTrue((table.draw(numpy.repeat(300, 100), rnd) == 200).all())
+        table = fragment_planner.InsertSizeTable(100, 0, 120)
+        self.assertTrue((table.draw(numpy.repeat(300, 100), rnd) == 120).all())
+
+    def test_point_mass_too_long(self):
+        """With -d 0 nothing is drawn for a target shorter than the mean."""
+        table = fragment_planner.InsertSizeTable(200, 0, 120)
+        length = table.draw(numpy.array([150, 199, 200, 201]), numpy.zeros(4) + 0.5)
+        self.assertEqual(length.tolist(),
+            [fragment_planner.NO_LENGTH, fragment_planner.NO_LENGTH, 200, 200])
+
+    def test_fits(self):
+        """Inserts never exceed the largest allowed size."""
+        table = fragment_planner.InsertSizeTable(200, 50, 120)
+        rng = numpy.random.RandomState(2)
+        maxlen = rng.randint(120, 400, 10000)
+        length = table.draw(maxlen, rng.random_sample(10000))
+        self.assertTrue((length >= 120).all())
+        self.assertTrue((length <= maxlen).all())
+
+
+class PlanFragmentsTest(unittest.TestCase):
+
+    def test_point_mass_short_target(self):
+        """
+        With -d 0, targets shorter than the mean insert get no paired
+        fragment, and the others get whole inserts that fit.
+        """
+        lengths = numpy.array([150, 500])
+        targets = numpy.array([0, 1] * 500)
+        table = fragment_planner.InsertSizeTable(200, 0, 120)
+        plan = fragment_planner.planFragments(
+            targets, lengths, 100, True, table, numpy.random.RandomState(3))
+        self.assertEqual(len(plan), 500)
+        self.assertTrue((plan["target"] == 1).all())
+        self.assertTrue((plan["length"] == 200).all())
+        self.assertTrue((plan["start"] >= 0).all())
+        self.assertTrue((plan["start"] + plan["length"] <= 500 + 1).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
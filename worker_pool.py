@@ -0,0 +1,134 @@
+"""
+Fork-once worker pool for Wessim.
+
+The main programs load everything the workers need (targets, the compiled
+error model, the mvn table and the GC calibration) once, and then fork the
+workers. The workers inherit all of it copy-on-write instead of starting a
+new interpreter and loading it again.
+
+Workers can also take tasks from a queue shared by all of them and hand
+their results back to the main process, where a scheduler decides what to
+hand out next and in which order the results are consumed (see
+`runWorkers` and `stream_writer.ChunkScheduler`).
+
+A worker that raises an exception or exits with a non-zero status makes
+`runWorkers` stop the remaining workers and raise a `WorkerError` carrying
+the worker's traceback.
+"""
+
+import multiprocessing
+import Queue
+import sys
+import traceback
+
+
+class WorkerError(Exception):
+	"""A worker failed. The message holds the worker tracebacks."""
+
+
+def _runWorker(target, args, errors, workerid):
+	"""Run `target(*args)` in a worker and report a failure to the parent."""
+	try:
+		target(*args)
+	except SystemExit as e:
+		if e.code not in (None, 0):
+			errors.put((workerid, "exited with status " + str(e.code)))
+		raise
+	except BaseException:
+		errors.put((workerid, traceback.format_exc()))
+		raise
+	finally:
+		sys.stdout.flush()
+
+
+def _checkWorkers(pending, failed):
+	"""Move the finished workers out of `pending` and the failed ones into `failed`."""
+	for p in list(pending):
+		if p.exitcode is not None:
+			pending.remove(p)
+			if p.exitcode != 0:
+				failed.append(p)
+
+
+def _nextItem(queue, pending, failed, poll):
+	"""Wait for the next item of `queue` until a worker fails."""
+	while not failed:
+		try:
+			return queue.get(True, poll)
+		except Queue.Empty:
+			_checkWorkers(pending, failed)
+	return None
+
+
+def runWorkers(target, jobs, poll=0.2, scheduler=None, consume=None):
+	"""
+	Run `target` once per job in forked worker processes and wait for them.
+
+	If `scheduler` is given, every worker also gets a task queue and a
+	result queue, shared by all workers, as its last two arguments. It takes
+	tasks until it gets None and puts its results on the result queue. The
+	main process hands out the tasks with `scheduler.fill(tasks)`, and
+	passes every result to `scheduler.collect(result)`, which returns the
+	results to pass to `consume`, until `scheduler.finished()`. All this
+	happens while the workers keep running.
+
+	Args:
+		target: Function run by each worker.
+		jobs: List of argument tuples, one per worker. Worker ids are the
+			1-based positions in this list.
+		poll: Interval in seconds at which the workers are checked.
+		scheduler: Object handing out the tasks, e.g. a
+			`stream_writer.ChunkScheduler`.
+		consume: Function called with each result in the main process.
+
+	Raises:
+		WorkerError: One of the workers failed. The other workers are
+			terminated first.
+	"""
+	errors = multiprocessing.Queue()
+	if scheduler is not None:
+		tasks = multiprocessing.Queue()
+		results = multiprocessing.Queue()
+	processes = []
+	failed = []
+	try:
+		for t, args in enumerate(jobs):
+			if scheduler is not None:
+				args = tuple(args) + (tasks, results)
+			p = multiprocessing.Process(
+				target=_runWorker, args=(target, args, errors, t + 1))
+			p.start()
+			processes.append(p)
+
+		pending = list(processes)
+		if scheduler is not None:
+			scheduler.fill(tasks)
+			while not scheduler.finished():
+				item = _nextItem(results, pending, failed, poll)
+				if failed:
+					break
+				for result in scheduler.collect(item):
+					consume(result)
+				scheduler.fill(tasks)
+		while pending and not failed:
+			pending[0].join(poll)
+			_checkWorkers(pending, failed)
+	finally:
+		for p in processes:
+			if p.is_alive():
+				p.terminate()
+		for p in processes:
+			p.join()
+
+	if failed:
+		messages = {}
+		while not errors.empty():
+			workerid, message = errors.get()
+			messages[workerid] = message
+		report = []
+		for p in failed:
+			t = processes.index(p) + 1
+			report.append("worker " + str(t) + " failed (exit code " + str(p.exitcode) + ")")
+			if t in messages:
+				report.append(messages[t].rstrip())
+		raise WorkerError("\n".join(report))